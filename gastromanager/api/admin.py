@@ -1,5 +1,6 @@
 from django.contrib import admin
 
+from .ledger import inventory_with_balance, stock_with_balance
 from .models import (
     Address,
     StockItem,
@@ -12,6 +13,10 @@ from .models import (
     RecipeIngredient,
     UserProfile,
     Journal,
+    InventoryMovement,
+    StockMovement,
+    InventorySnapshot,
+    StockSnapshot,
 )
 
 """from django.contrib.auth.admin import UserAdmin"""
@@ -82,14 +87,55 @@ class IngredientIncomingAdmin(admin.ModelAdmin):
 
 """
 
+
+# The ledger is append-only: its movements and snapshots can only be viewed
+class LedgerAdmin(admin.ModelAdmin):
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+# The balance is the last snapshot plus the ledger movements after it, so the
+# snapshot columns can only be viewed. The rows are created on the first
+# movement, corrections go through the inventory form.
+class InventoryAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "balance")
+    readonly_fields = ("quantity", "last_movement_id", "balance")
+    with_balance = staticmethod(inventory_with_balance)
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_queryset(self, request):
+        return self.with_balance(super().get_queryset(request))
+
+    @admin.display(description="Current balance")
+    def balance(self, obj):
+        return obj.current_balance()
+
+
+class StockItemAdmin(InventoryAdmin):
+    with_balance = staticmethod(stock_with_balance)
+
+
 admin.site.register(Address)
 admin.site.register(Ingredient)
-admin.site.register(IngredientInventory)
+admin.site.register(IngredientInventory, InventoryAdmin)
 admin.site.register(IngredientIncoming),  # IngredientIncomingAdmin)
 admin.site.register(Recipe),  # RecipeAdmin)
 admin.site.register(RecipeIngredient),
 admin.site.register(IceCreamProduction),
-admin.site.register(StockItem),
+admin.site.register(StockItem, StockItemAdmin)
 admin.site.register(IceCreamStockTakeOut),
 admin.site.register(UserProfile),  # UserProfileAdmin)
 admin.site.register(Journal)
+
+admin.site.register(InventoryMovement, LedgerAdmin)
+admin.site.register(StockMovement, LedgerAdmin)
+admin.site.register(InventorySnapshot, LedgerAdmin)
+admin.site.register(StockSnapshot, LedgerAdmin)
@@ -7,3 +7,6 @@ class ApiConfig(AppConfig):
 
     def ready(self):
         import api.signals
+        from api.caching import check_shared_cache
+
+        check_shared_cache()
@@ -0,0 +1,227 @@
+import functools
+import hashlib
+import io
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import qrcode
+from django.conf import settings
+from django.core.cache import caches
+from PIL import Image, ImageDraw, ImageFont
+
+
+# Employee badges, rendered in memory.
+#
+# The logo and the font are read from disk once per process and reused by every
+# badge; a badge is returned as PNG bytes. Rendered badges are kept in the
+# "badges" cache under a hash of the name, id, logo and font, so a badge is
+# rendered again only when one of them changes.
+
+BADGE_LOGO_PATH = os.path.join(settings.BASE_DIR, "api", "media", "green_scoop.png")
+BADGE_FONT_PATH = os.path.join(
+    settings.BASE_DIR, "templates", "fonts", "SantEliaScriptAlt-Bold.ttf"
+)
+BACKGROUND_COLOR = (255, 253, 240)
+BADGE_WIDTH = 250
+BADGE_HEIGHT = 400
+# Bump when the badge layout changes, so cached badges are rendered again
+BADGE_VERSION = 1
+# Alias in settings.CACHES of the rendered badges
+BADGE_CACHE = "badges"
+
+# Printable sheets: A4 at 150 dpi, 4 x 4 badges per page
+SHEET_DPI = 150
+SHEET_WIDTH = 1240
+SHEET_HEIGHT = 1754
+SHEET_COLUMNS = 4
+SHEET_ROWS = 4
+# Below this many badges to render, a process pool costs more than it saves
+POOL_THRESHOLD = 8
+
+
+@functools.lru_cache(maxsize=None)
+def badge_logo():
+    with Image.open(BADGE_LOGO_PATH) as logo:
+        logo.load()
+        return logo.copy()
+
+
+@functools.lru_cache(maxsize=None)
+def badge_font(size=20):
+    return ImageFont.truetype(BADGE_FONT_PATH, size)
+
+
+def render_badge(employee_name, employee_id):
+    """Return the badge of an employee as a PIL image."""
+    badge_center_x_axis = BADGE_WIDTH // 2
+    badge = Image.new("RGB", (BADGE_WIDTH, BADGE_HEIGHT), BACKGROUND_COLOR)
+    draw = ImageDraw.Draw(badge)
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=8,
+        border=2,
+    )
+    qr.add_data(employee_id)
+    qr.make(fit=True)
+    qr_img = qr.make_image(fill_color="black", back_color=BACKGROUND_COLOR)
+
+    logo = badge_logo()
+    logo_x_axis_position = badge_center_x_axis - (logo.width // 2)
+
+    draw.text((80, 180), employee_name, fill="black", font=badge_font())
+    badge.paste(qr_img, (25, 200))
+    badge.paste(logo, (logo_x_axis_position, 20))
+
+    return badge
+
+
+def badge_png(employee_name, employee_id):
+    """Return the badge of an employee as PNG bytes."""
+    buffer = io.BytesIO()
+    render_badge(employee_name, employee_id).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def badge_filename(employee_name):
+    return f"{employee_name.replace(' ', '_')}_Badge.png"
+
+
+@functools.lru_cache(maxsize=None)
+def asset_version():
+    # Hash of the layout version, logo and font: a new logo or font changes
+    # the key of every badge
+    digest = hashlib.sha256(str(BADGE_VERSION).encode())
+    for path in (BADGE_LOGO_PATH, BADGE_FONT_PATH):
+        with open(path, "rb") as asset:
+            digest.update(asset.read())
+    return digest.hexdigest()
+
+
+def badge_key(employee_name, employee_id):
+    # Content hash of everything the badge depends on, also used as its ETag
+    content = f"{asset_version()}:{employee_id}:{employee_name}".encode()
+    return hashlib.sha256(content).hexdigest()
+
+
+def cache_key(employee_name, employee_id):
+    return f"badge:{badge_key(employee_name, employee_id)}"
+
+
+def render_pngs(employees):
+    # [(name, id), ...] -> [png, ...], on a process pool when worth it
+    workers = min(len(employees), os.cpu_count() or 1)
+    if len(employees) < POOL_THRESHOLD or workers < 2:
+        return [badge_png(name, pk) for name, pk in employees]
+
+    # forkserver children start from a clean process, not a copy of this
+    # (possibly multi-threaded) web worker
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else "spawn"
+    )
+    names, pks = zip(*employees)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        return list(pool.map(badge_png, names, pks, chunksize=4))
+
+
+def cached_badges(employees):
+    """
+    PNG bytes of the badges of [(employee_name, employee_id), ...], in order.
+
+    Badges are cached by content hash, so only new or changed ones are
+    rendered, all of them in one batch.
+    """
+    cache = caches[BADGE_CACHE]
+    keys = [cache_key(name, pk) for name, pk in employees]
+    found = cache.get_many(keys)
+
+    missing = [
+        (key, employee) for key, employee in zip(keys, employees) if key not in found
+    ]
+    if missing:
+        rendered = render_pngs([employee for key, employee in missing])
+        new = {key: png for (key, employee), png in zip(missing, rendered)}
+        cache.set_many(new)
+        found.update(new)
+
+    return [found[key] for key in keys]
+
+
+def cached_badge(employee_name, employee_id):
+    return cached_badges([(employee_name, employee_id)])[0]
+
+
+def forget_badge(employee_name, employee_id):
+    # Drop the badge of a former name, it cannot be asked for again
+    caches[BADGE_CACHE].delete(cache_key(employee_name, employee_id))
+
+
+def badge_sheets_pdf(pngs):
+    """Lay the badges out on A4 pages and return a multi-page PDF."""
+    per_page = SHEET_COLUMNS * SHEET_ROWS
+    margin_x = (SHEET_WIDTH - SHEET_COLUMNS * BADGE_WIDTH) // (SHEET_COLUMNS + 1)
+    margin_y = (SHEET_HEIGHT - SHEET_ROWS * BADGE_HEIGHT) // (SHEET_ROWS + 1)
+
+    pages = []
+    for start in range(0, len(pngs), per_page):
+        page = Image.new("RGB", (SHEET_WIDTH, SHEET_HEIGHT), "white")
+        for index, png in enumerate(pngs[start : start + per_page]):
+            row, column = divmod(index, SHEET_COLUMNS)
+            with Image.open(io.BytesIO(png)) as badge:
+                page.paste(
+                    badge,
+                    (
+                        margin_x + column * (BADGE_WIDTH + margin_x),
+                        margin_y + row * (BADGE_HEIGHT + margin_y),
+                    ),
+                )
+        pages.append(page)
+
+    buffer = io.BytesIO()
+    pages[0].save(
+        buffer,
+        format="PDF",
+        save_all=True,
+        append_images=pages[1:],
+        resolution=SHEET_DPI,
+    )
+    return buffer.getvalue()
+
+
+class ZipStream:
+    # Write-only file object: zipfile writes into it, the response reads the
+    # written bytes after each badge
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def badge_zip_stream(named_pngs):
+    """Yield a ZIP archive of (filename, png) pairs chunk by chunk."""
+    stream = ZipStream()
+    # PNGs are already compressed
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED) as archive:
+        for filename, png in named_pngs:
+            archive.writestr(filename, png)
+            yield stream.drain()
+    yield stream.drain()
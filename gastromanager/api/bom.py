@@ -0,0 +1,125 @@
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+
+from .caching import cached
+from .models import Ingredient, Recipe, RecipeIngredient
+
+
+# Bill of materials (BOM) of every recipe, kept in the cache.
+#
+# A base recipe (is_base=True) is stocked as an Ingredient with the same name as
+# its flavor, so a recipe ingredient named like a base recipe is expanded into
+# the ingredients of that base, recursively (a base can contain other bases).
+#
+# The cached entry is keyed by the generations of Recipe, Ingredient and
+# RecipeIngredient (see caching.py), replaced whenever one of them changes.
+# It is only for read-only views: booking a production reads the vectors of the
+# booked recipes from the database with direct_bom(), inside its transaction.
+
+CATALOG = [Recipe, Ingredient, RecipeIngredient]
+BOM_TIMEOUT = 60 * 60 * 24
+
+
+class BillOfMaterials:
+    def __init__(self, direct, flattened, ingredient_names):
+        # {recipe_id: {ingredient_id: quantity per kg}}, one level deep
+        self.direct = direct
+        # {recipe_id: {ingredient_id: quantity per kg}}, bases fully expanded
+        self.flattened = flattened
+        # {ingredient_id: name}
+        self.ingredient_names = ingredient_names
+
+    def vector(self, recipe_id, expand_bases=True):
+        vectors = self.flattened if expand_bases else self.direct
+        return vectors.get(recipe_id, {})
+
+    def requirements(self, quantities, expand_bases=True):
+        # Sum the ingredient demand of {recipe_id: kg}
+        required = {}
+        for recipe_id, quantity in quantities.items():
+            for ingredient_id, per_kg in self.vector(recipe_id, expand_bases).items():
+                required[ingredient_id] = required.get(ingredient_id, 0) + (
+                    per_kg * quantity
+                )
+        return required
+
+
+def flatten(recipe_id, direct, base_recipes, flattened, visiting):
+    if recipe_id in flattened:
+        return flattened[recipe_id]
+    if recipe_id in visiting:
+        raise ValidationError("Base recipes contain each other in a loop.")
+
+    visiting.add(recipe_id)
+    vector = {}
+    for ingredient_id, quantity in direct.get(recipe_id, {}).items():
+        base_recipe_id = base_recipes.get(ingredient_id)
+        if base_recipe_id is None or base_recipe_id == recipe_id:
+            vector[ingredient_id] = vector.get(ingredient_id, 0) + quantity
+            continue
+        base_vector = flatten(base_recipe_id, direct, base_recipes, flattened, visiting)
+        for base_ingredient_id, base_quantity in base_vector.items():
+            vector[base_ingredient_id] = (
+                vector.get(base_ingredient_id, 0) + quantity * base_quantity
+            )
+    visiting.discard(recipe_id)
+
+    flattened[recipe_id] = vector
+    return vector
+
+
+def read_direct(recipe_ingredients):
+    # ({recipe_id: {ingredient_id: quantity per kg}}, {ingredient_id: name})
+    direct = {}
+    ingredient_names = {}
+    rows = recipe_ingredients.values_list(
+        "recipe_id", "ingredient_id", "ingredient__name", "quantity"
+    )
+    for recipe_id, ingredient_id, ingredient_name, quantity in rows:
+        vector = direct.setdefault(recipe_id, {})
+        vector[ingredient_id] = vector.get(ingredient_id, Decimal("0")) + quantity
+        ingredient_names[ingredient_id] = ingredient_name
+    return direct, ingredient_names
+
+
+def build_bom():
+    # Two queries for the whole catalog, whatever the depth of the bases
+    direct, ingredient_names = read_direct(RecipeIngredient.objects.all())
+
+    base_ids_by_flavor = dict(
+        Recipe.objects.filter(is_base=True).values_list("flavor", "id")
+    )
+    base_recipes = {
+        ingredient_id: base_ids_by_flavor[name]
+        for ingredient_id, name in ingredient_names.items()
+        if name in base_ids_by_flavor
+    }
+
+    flattened = {}
+    for recipe_id in direct:
+        flatten(recipe_id, direct, base_recipes, flattened, set())
+
+    return BillOfMaterials(direct, flattened, ingredient_names)
+
+
+def direct_bom(recipe_ids):
+    """
+    Return the BillOfMaterials of recipe_ids only, one level deep, in one
+    query. Bases are not expanded, so other recipes (and loops between bases)
+    are never read: this is what booking a production needs.
+    """
+    direct, ingredient_names = read_direct(
+        RecipeIngredient.objects.filter(recipe_id__in=recipe_ids)
+    )
+    # No flattened vectors: vector(expand_bases=True) fails instead of
+    # silently returning nothing
+    return BillOfMaterials(direct, None, ingredient_names)
+
+
+def get_bom():
+    """
+    Return the BillOfMaterials of the catalog, built once per generation. For
+    read-only views; bookings use direct_bom().
+    """
+    return cached("bom", CATALOG, build_bom, BOM_TIMEOUT)
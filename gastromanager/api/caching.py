@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import Counter, defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+
+# Derived data (recipe lists, stock tables, ...) kept in the default cache.
+#
+# Every model derived data is computed from has a generation token in the
+# cache. A value is stored under its name and the generations of the models it
+# depends on, so replacing a generation (see changed() and signals.py) makes
+# every value computed from that model unreachable; stale entries are never
+# read and simply expire. Hits and misses are counted per name, per process.
+#
+# The generations are only replaced in the default cache, so every process
+# must share it: outside DEBUG, a process-local cache is refused at startup
+# (check_shared_cache(), called from ApiConfig.ready()).
+
+DEFAULT_TIMEOUT = 60 * 60
+MISSING = object()
+
+stats = defaultdict(Counter)
+stats_lock = threading.Lock()
+
+
+def check_shared_cache():
+    if not settings.DEBUG and isinstance(caches["default"], LocMemCache):
+        raise ImproperlyConfigured(
+            "The default cache holds the generations of the derived data and "
+            'must be shared by every process: set CACHE_BACKEND to "redis" '
+            '(or "file" on a single machine).'
+        )
+
+
+def generation_key(model):
+    return f"generation:{model._meta.label_lower}"
+
+
+def generations(models):
+    keys = [generation_key(model) for model in models]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # add() keeps the token another process may have set meanwhile
+            cache.add(key, time.time_ns(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def version(*models):
+    # Changes whenever one of the models changes, e.g. to key template fragments
+    return "-".join(str(token) for token in generations(models))
+
+
+def invalidate(*models):
+    token = time.time_ns()
+    cache.set_many({generation_key(model): token for model in models}, None)
+
+
+def changed(*models):
+    # Once now, so this transaction reads nothing cached before the change,
+    # and again after commit: a value another process cached meanwhile from
+    # the data as it was before the commit is not read afterwards.
+    invalidate(*models)
+    transaction.on_commit(lambda: invalidate(*models))
+
+
+def count(name, outcome):
+    with stats_lock:
+        stats[name][outcome] += 1
+
+
+def derived_key(name, models):
+    return ":".join(["derived", name, *(str(token) for token in generations(models))])
+
+
+def cached(name, models, compute, timeout=DEFAULT_TIMEOUT):
+    """
+    Return compute(), computed once per generation of the models it depends
+    on and kept in the cache under name.
+    """
+    key = derived_key(name, models)
+    value = cache.get(key, MISSING)
+    if value is not MISSING:
+        count(name, "hits")
+        return value
+
+    count(name, "misses")
+    value = compute()
+    cache.set(key, value, timeout)
+    return value
+
+
+async def acached(name, models, compute, timeout=DEFAULT_TIMEOUT):
+    """cached() for async views: compute is a coroutine function."""
+    key = await sync_to_async(derived_key)(name, models)
+    value = await cache.aget(key, MISSING)
+    if value is not MISSING:
+        count(name, "hits")
+        return value
+
+    count(name, "misses")
+    value = await compute()
+    await cache.aset(key, value, timeout)
+    return value
+
+
+def cache_stats():
+    """{name: {"hits", "misses", "hit_rate"}} of this process."""
+    with stats_lock:
+        return {
+            name: {
+                "hits": counter["hits"],
+                "misses": counter["misses"],
+                "hit_rate": round(
+                    counter["hits"] / (counter["hits"] + counter["misses"]), 3
+                ),
+            }
+            for name, counter in sorted(stats.items())
+        }
@@ -0,0 +1,138 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import UserProfile, WorkingHours
+
+
+CLOCK_IN = "in"
+CLOCK_OUT = "out"
+# A second scan of the same badge within CLOCK_DOUBLE_SCAN_SECONDS, from any
+# terminal, is not booked
+DUPLICATE = "duplicate"
+
+
+def parse_badge(badge):
+    # The QR code of an EmployeeBadge holds the id of the employee
+    try:
+        return int(str(badge).strip())
+    except ValueError:
+        raise ValidationError("Invalid badge.")
+
+
+# One statement on PostgreSQL: close the open shift if it is old enough,
+# otherwise open one unless the employee clocked in or out just now. The
+# partial unique index one_open_shift_per_employee makes a concurrent second
+# INSERT a no-op, and a concurrent second UPDATE finds the shift closed and
+# sees it open in its snapshot, so it books nothing either.
+TOGGLE_SQL = """
+WITH closed AS (
+    UPDATE {shifts} SET clock_out = %(at)s
+    WHERE employee_id = %(employee)s AND clock_out IS NULL AND clock_in <= %(since)s
+    RETURNING id, clock_in, clock_out
+), opened AS (
+    INSERT INTO {shifts} (employee_id, clock_in)
+    SELECT id, %(at)s FROM {employees}
+    WHERE id = %(employee)s
+        AND NOT EXISTS (SELECT 1 FROM closed)
+        AND NOT EXISTS (
+            SELECT 1 FROM {shifts}
+            WHERE employee_id = %(employee)s
+                AND (clock_out IS NULL OR clock_out >= %(since)s)
+        )
+    ON CONFLICT DO NOTHING
+    RETURNING id, clock_in, clock_out
+)
+SELECT %(out)s, id, clock_in, clock_out FROM closed
+UNION ALL
+SELECT %(in)s, id, clock_in, clock_out FROM opened
+"""
+
+
+def toggle_shift(employee_id, at, since):
+    # Returns (action, working_hours) or None when nothing was booked
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            TOGGLE_SQL.format(
+                shifts=quote(WorkingHours._meta.db_table),
+                employees=quote(UserProfile._meta.db_table),
+            ),
+            {
+                "employee": employee_id,
+                "at": at,
+                "since": since,
+                "in": CLOCK_IN,
+                "out": CLOCK_OUT,
+            },
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    action, pk, clock_in, clock_out = row
+    return action, WorkingHours.from_db(
+        connection.alias,
+        ["id", "employee_id", "clock_in", "clock_out"],
+        [pk, employee_id, clock_in, clock_out],
+    )
+
+
+def toggle_shift_locked(employee_id, at, since):
+    # Same as toggle_shift for databases without UPDATE ... RETURNING in a CTE:
+    # the employee row is locked, so scans of the same badge run one by one.
+    list(
+        UserProfile.objects.select_for_update().filter(pk=employee_id).values_list("pk")
+    )
+    shifts = WorkingHours.objects.filter(employee_id=employee_id)
+
+    working_hours = shifts.filter(clock_out__isnull=True).order_by("-clock_in").first()
+    if working_hours is not None:
+        if working_hours.clock_in > since:
+            return None
+        working_hours.clock_out = at
+        working_hours.save(update_fields=["clock_out"])
+        return CLOCK_OUT, working_hours
+
+    if shifts.filter(clock_out__gte=since).exists():
+        return None
+    return CLOCK_IN, WorkingHours.objects.create(employee_id=employee_id, clock_in=at)
+
+
+def clock(badge, at=None):
+    """
+    Clock the employee of a badge out of their open shift, or in if there is
+    none. Returns (employee, working_hours, CLOCK_IN, CLOCK_OUT or DUPLICATE);
+    for a duplicate scan working_hours is the employee's latest shift.
+
+    Takes a constant number of queries: on PostgreSQL the toggle itself is one
+    conditional UPDATE-or-INSERT statement, without row locks.
+    """
+    employee_id = parse_badge(badge)
+    at = at or timezone.now()
+    since = at - timedelta(seconds=settings.CLOCK_DOUBLE_SCAN_SECONDS)
+
+    employee = UserProfile.objects.only("username").filter(pk=employee_id).first()
+    if employee is None:
+        raise ValidationError("Unknown badge.")
+
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            booked = toggle_shift(employee_id, at, since)
+        else:
+            booked = toggle_shift_locked(employee_id, at, since)
+
+    if booked is None:
+        latest = (
+            WorkingHours.objects.filter(employee_id=employee_id)
+            .order_by("-clock_in")
+            .first()
+        )
+        if latest is None:
+            # The employee was deleted in the meantime
+            raise ValidationError("Unknown badge.")
+        return employee, latest, DUPLICATE
+    action, working_hours = booked
+    return employee, working_hours, action
@@ -1,6 +1,8 @@
 from functools import wraps
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
 from django.http import HttpResponseForbidden
-from .models import Journal
+from .journal import journal_writer
 
 
 def manager_required(view_func):
@@ -39,6 +41,28 @@ def production_required(view_func):
     return _wrapped_view
 
 
+async def load_user(request):
+    # request.user is loaded lazily with a sync query: load it in a thread
+    # before an async view touches it
+    def load():
+        request.user.is_authenticated
+        return request.user
+
+    return await sync_to_async(load)()
+
+
+def async_login_required(view_func):
+    # login_required for async views (Django's only wraps sync views before 5.0)
+    @wraps(view_func)
+    async def _wrapped_view(request, *args, **kwargs):
+        user = await load_user(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view_func(request, *args, **kwargs)
+
+    return _wrapped_view
+
+
 # DONT TOUCH!
 def register_activity(action_func):
     def decorator(view_func):
@@ -50,8 +74,9 @@ def register_activity(action_func):
                 # Get the description of the action
                 action_description = action_func(request)
                 if action_description is not None:
-                    # Register the action in the "Journal" model
-                    Journal.objects.create(user=request.user, action=action_description)
+                    # Register the action in the "Journal" model, written in
+                    # the background by the journal writer
+                    journal_writer.record(request.user, action_description)
             return response  # Return the response obtained from running the view
 
         return _wrapped_view
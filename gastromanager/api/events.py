@@ -0,0 +1,186 @@
+import asyncio
+import itertools
+import json
+import logging
+import select
+import threading
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+
+# Live stock and inventory deltas, pushed to the browsers as Server-Sent Events
+# (view events_view, served by the ASGI application in gastromanager/asgi.py).
+#
+# The ledger publishes a "stock" or "inventory" event after the commit of every
+# batch of movements (productions, takeouts, deliveries, corrections). Events
+# are broadcast in-process to an asyncio queue per connected client. With
+# EVENTS_BROKER = "postgresql" they go through NOTIFY instead and each process
+# LISTENs, so the clients of every worker process receive them.
+#
+# Only offered under ASGI (see live_updates()): under WSGI every open page would
+# hold a worker with its endless response, so the pages are reloaded by hand.
+
+CHANNEL = "gastromanager_events"
+# NOTIFY payloads must stay under 8000 bytes
+NOTIFY_LIMIT = 7900
+STOCK = "stock"
+INVENTORY = "inventory"
+RELOAD = "reload"
+
+
+class Broadcaster:
+    """Hands every published event to every subscriber queue."""
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self.subscribers = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        """
+        Return a new asyncio queue of (id, kind, data) events, filled from this
+        thread's running loop.
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.subscribers[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, queue):
+        with self.lock:
+            self.subscribers.pop(queue, None)
+
+    def publish(self, kind, data):
+        # Callable from any thread
+        with self.lock:
+            event = (next(self.ids), kind, data)
+            subscribers = list(self.subscribers.items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(put_latest, queue, event)
+            except RuntimeError:
+                # The loop of a gone client is closed
+                self.unsubscribe(queue)
+        return event
+
+
+def put_latest(queue, event):
+    # A client too slow to keep up loses its oldest events
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+broadcaster = Broadcaster()
+
+
+class NotifyListener(threading.Thread):
+    """LISTENs on its own PostgreSQL connection and broadcasts what it hears."""
+
+    def __init__(self):
+        super().__init__(name="events-listener", daemon=True)
+
+    def run(self):
+        import psycopg2
+
+        while True:
+            try:
+                listener = psycopg2.connect(**connection.get_connection_params())
+                listener.autocommit = True
+                with listener.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANNEL}")
+                while True:
+                    if select.select([listener], [], [], 30) == ([], [], []):
+                        continue
+                    listener.poll()
+                    while listener.notifies:
+                        event = json.loads(listener.notifies.pop(0).payload)
+                        broadcaster.publish(event["kind"], event["data"])
+            except Exception:
+                logger.exception("Event listener failed, reconnecting")
+                threading.Event().wait(5)
+
+
+listener_lock = threading.Lock()
+notify_listener = None
+
+
+def start_listener():
+    # Once per process, when the first client connects
+    global notify_listener
+    if settings.EVENTS_BROKER != "postgresql":
+        return
+    with listener_lock:
+        if notify_listener is None:
+            notify_listener = NotifyListener()
+            notify_listener.start()
+
+
+def live_updates(request):
+    # The request came through the ASGI application
+    return isinstance(request, ASGIRequest)
+
+
+def send(kind, data):
+    if settings.EVENTS_BROKER == "postgresql" and connection.vendor == "postgresql":
+        payload = json.dumps({"kind": kind, "data": data})
+        if len(payload) > NOTIFY_LIMIT:
+            # Too many deltas for one NOTIFY: the clients reload instead
+            payload = json.dumps({"kind": RELOAD, "data": {}})
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, payload])
+    else:
+        broadcaster.publish(kind, data)
+
+
+def publish(kind, data):
+    """Publish an event once the current transaction commits."""
+    transaction.on_commit(lambda: send(kind, data))
+
+
+def stock_delta(quantities):
+    return [
+        {"recipe": recipe_id, "size": float(size), "delta": float(quantity)}
+        for (recipe_id, size), quantity in quantities.items()
+        if quantity
+    ]
+
+
+def inventory_delta(quantities):
+    return [
+        {"ingredient": ingredient_id, "delta": float(quantity)}
+        for ingredient_id, quantity in quantities.items()
+        if quantity
+    ]
+
+
+def format_event(event):
+    event_id, kind, data = event
+    return f"id: {event_id}\nevent: {kind}\ndata: {json.dumps(data)}\n\n"
+
+
+async def event_stream(heartbeat=15):
+    """
+    Yield Server-Sent Events until the client disconnects. Events missed while
+    a client was disconnected are not replayed: it reloads its page instead.
+    """
+    start_listener()
+    queue = broadcaster.subscribe()
+    try:
+        # Tells the browser how long to wait before reconnecting
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                # Comment line, keeps proxies from closing the connection
+                yield ": heartbeat\n\n"
+                continue
+            yield format_event(event)
+    finally:
+        broadcaster.unsubscribe(queue)
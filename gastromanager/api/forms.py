@@ -1,6 +1,61 @@
 from django import forms
-from .models import Recipe, Ingredient, UserProfile, IngredientInventory, Address
+from django.db import transaction
+from .ledger import ensure_inventory, record_inventory_movements
+from .models import (
+    Recipe,
+    Ingredient,
+    UserProfile,
+    InventoryMovement,
+    Address,
+)
 from django.core.exceptions import ValidationError
+from .caching import cached
+from .production import lock_inventory
+
+
+# Choice lists of the whole Ingredient / Recipe tables, rendered from the cache
+# (see caching.py) instead of being queried for every form. Submitted ids are
+# still checked against the database.
+
+
+class CachedChoices:
+    # Iterated when the widget renders, not when the form is created
+    def __init__(self, field):
+        self.field = field
+
+    def __iter__(self):
+        field = self.field
+        if field.empty_label is not None:
+            yield ("", field.empty_label)
+        yield from cached(
+            f"choices:{field.queryset.model._meta.label_lower}",
+            [field.queryset.model],
+            lambda: [
+                (obj.pk, field.label_from_instance(obj)) for obj in field.queryset
+            ],
+        )
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+
+class CachedChoicesMixin:
+    def _get_choices(self):
+        if hasattr(self, "_choices"):
+            return self._choices
+        return CachedChoices(self)
+
+    choices = property(_get_choices, forms.ChoiceField._set_choices)
+
+
+class CachedModelChoiceField(CachedChoicesMixin, forms.ModelChoiceField):
+    pass
+
+
+class CachedModelMultipleChoiceField(
+    CachedChoicesMixin, forms.ModelMultipleChoiceField
+):
+    pass
 
 
 class RecipeForm(forms.ModelForm):
@@ -8,12 +63,12 @@ class RecipeForm(forms.ModelForm):
         model = Recipe
         fields = ["flavor", "ingredients", "base_ingredients"]
 
-    ingredients = forms.ModelMultipleChoiceField(
+    ingredients = CachedModelMultipleChoiceField(
         queryset=Ingredient.objects.all(),
         widget=forms.CheckboxSelectMultiple,
     )
 
-    base_ingredients = forms.ModelMultipleChoiceField(
+    base_ingredients = CachedModelMultipleChoiceField(
         queryset=Ingredient.objects.all(),
         widget=forms.CheckboxSelectMultiple,
         required=False,
@@ -40,7 +95,7 @@ class RecipeForm(forms.ModelForm):
 
 
 class ProductionCalculatorForm(forms.Form):
-    recipes = forms.ModelMultipleChoiceField(
+    recipes = CachedModelMultipleChoiceField(
         queryset=Recipe.objects.all(),
         widget=forms.CheckboxSelectMultiple,
         label="Select Recipes for Production",
@@ -51,6 +106,14 @@ class ProductionCalculatorForm(forms.Form):
     )
 
 
+class MaxProductionForm(forms.Form):
+    recipes = CachedModelMultipleChoiceField(
+        queryset=Recipe.objects.all(),
+        widget=forms.CheckboxSelectMultiple,
+        label="Select Recipes to Plan",
+    )
+
+
 class CustomUserForm(forms.ModelForm):
     password = forms.CharField(
         label="Password",
@@ -155,10 +218,13 @@ class CustomUserNormalForm(forms.ModelForm):  # for all users
 
 
 # Ingredient Inventory Update Form
-class IngredientInventoryUpdateForm(forms.ModelForm):
-    class Meta:
-        model = IngredientInventory
-        fields = ("quantity",)
+class IngredientInventoryUpdateForm(forms.Form):
+    ingredient_name = CachedModelChoiceField(
+        queryset=Ingredient.objects.all(), label="Ingredient"
+    )
+    quantity = forms.DecimalField(
+        max_digits=10, decimal_places=2, label="Counted quantity"
+    )
 
     def clean_quantity(self):
         quantity = self.cleaned_data.get("quantity")
@@ -166,7 +232,26 @@ class IngredientInventoryUpdateForm(forms.ModelForm):
             raise ValidationError("Quantity must be a positive number.")
         return quantity
 
+    def save(self, corrected_by=None):
+        # The counted quantity is recorded as a correction movement in the
+        # inventory ledger (the difference with the current balance). The
+        # balance is read after the inventory row is locked (lock_inventory)
+        # and the row stays locked until the booking, so a movement committed
+        # before is part of the difference and none can come in between.
+        ingredient = self.cleaned_data["ingredient_name"]
+        ensure_inventory([ingredient.pk])
+        with transaction.atomic():
+            inventory = lock_inventory([ingredient.pk]).get()
+            record_inventory_movements(
+                {ingredient.pk: self.cleaned_data["quantity"] - inventory.balance},
+                InventoryMovement.CORRECTION,
+                corrected_by,
+            )
+        return inventory
+
 
 class ClockInOutForm(forms.Form):
     clock_in = forms.BooleanField(widget=forms.HiddenInput, required=False)
     clock_out = forms.BooleanField(widget=forms.HiddenInput, required=False)
+    # Badge number, when the badge cannot be scanned
+    badge = forms.CharField(max_length=20, required=False)
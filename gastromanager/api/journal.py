@@ -0,0 +1,194 @@
+import atexit
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import DatabaseError, connection
+from django.db.models import DecimalField, Q, Value
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .models import Journal
+
+logger = logging.getLogger(__name__)
+
+
+# Journal entries of @register_activity are written off the request path.
+#
+# record() only puts an unsaved Journal row on an in-process queue; a daemon
+# thread writes the queued rows with one bulk_create per batch, every
+# JOURNAL_BATCH_SIZE entries or JOURNAL_FLUSH_INTERVAL milliseconds, whichever
+# comes first. The queue is flushed when the process exits. When the queue is
+# full, or JOURNAL_ASYNC is False, the entry is written synchronously instead.
+
+STOP = object()
+
+
+class JournalWriter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queue = None
+        self.thread = None
+        self.pid = None
+        # queued / flushed / written synchronously / dropped (write failed)
+        self.stats = Counter()
+
+    def record(self, user, action):
+        """Journal an action of user without waiting for the database."""
+        entry = Journal(
+            user_id=user.pk if user.is_authenticated else None,
+            action=action,
+            timestamp=timezone.now(),
+        )
+        if not getattr(settings, "JOURNAL_ASYNC", True):
+            self.write_now([entry])
+            return
+
+        self.start()
+        try:
+            self.queue.put_nowait(entry)
+            self.count("queued")
+        except queue.Full:
+            self.write_now([entry])
+
+    def start(self):
+        # Started on first use, and again in a forked worker process, whose
+        # copy of the parent's thread does not run.
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(
+                maxsize=getattr(settings, "JOURNAL_QUEUE_SIZE", 10000)
+            )
+            self.thread = threading.Thread(
+                target=self.run, name="journal-writer", daemon=True
+            )
+            self.thread.start()
+            self.pid = os.getpid()
+            atexit.register(self.stop)
+
+    def run(self):
+        batch_size = getattr(settings, "JOURNAL_BATCH_SIZE", 100)
+        interval = getattr(settings, "JOURNAL_FLUSH_INTERVAL", 200) / 1000
+        stopping = False
+
+        while not stopping:
+            entry = self.queue.get()
+            batch = []
+            if entry is STOP:
+                stopping = True
+            else:
+                batch.append(entry)
+
+            # Collect more entries until the batch is full or the interval ends
+            deadline = time.monotonic() + interval
+            while batch and not stopping and len(batch) < batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if entry is STOP:
+                    stopping = True
+                else:
+                    batch.append(entry)
+
+            if batch:
+                self.write(batch)
+            for _ in range(len(batch) + stopping):
+                self.queue.task_done()
+
+        connection.close()
+
+    def write(self, batch):
+        try:
+            Journal.objects.bulk_create(batch)
+            self.count("flushed", len(batch))
+        except DatabaseError:
+            self.count("dropped", len(batch))
+            logger.exception("Could not write %d journal entries", len(batch))
+            # Start over with a new connection for the next batch
+            connection.close()
+
+    def write_now(self, batch):
+        Journal.objects.bulk_create(batch)
+        self.count("sync", len(batch))
+
+    def count(self, name, number=1):
+        with self.lock:
+            self.stats[name] += number
+
+    def flush(self):
+        """Block until every queued entry has been written."""
+        if self.pid == os.getpid():
+            self.queue.join()
+
+    def stop(self, timeout=5):
+        # Write what is left in the queue and stop the thread
+        if self.pid != os.getpid() or not self.thread.is_alive():
+            return
+        try:
+            self.queue.put(STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning("Journal writer queue still full on shutdown")
+            return
+        self.thread.join(timeout)
+        self.pid = None
+
+
+journal_writer = JournalWriter()
+
+
+# Journal search.
+#
+# On PostgreSQL the actions are matched with the full-text GIN index
+# journal_action_search: any search word, as a word prefix ("creat" finds
+# "User created: anna"), ranked by how well the action matches. Other databases
+# fall back to a substring match without index and with a rank of 0.
+
+SEARCH_CONFIG = "simple"
+# ts_rank is a float4; rounded to a numeric in SQL, a rank survives the round
+# trip through a page cursor exactly and the next page starts where it should.
+RANK_FIELD = DecimalField(max_digits=12, decimal_places=6)
+
+
+def journal_search_vector():
+    # Must stay identical to the indexed expression in Journal.Meta.indexes
+    return SearchVector("action", config=SEARCH_CONFIG)
+
+
+def search_journal(queryset, search_term):
+    """Journal entries matching any word of search_term, annotated with `rank`."""
+    words = re.findall(r"[^\W_]+", search_term)
+    if not words:
+        return queryset.annotate(rank=Value(Decimal(0), output_field=RANK_FIELD))
+
+    if connection.vendor != "postgresql":
+        matches = Q()
+        for word in words:
+            matches |= Q(action__icontains=word)
+        return queryset.filter(matches).annotate(
+            rank=Value(Decimal(0), output_field=RANK_FIELD)
+        )
+
+    query = SearchQuery(
+        " | ".join(f"{word}:*" for word in words),
+        search_type="raw",
+        config=SEARCH_CONFIG,
+    )
+    return (
+        queryset.alias(search=journal_search_vector())
+        .filter(search=query)
+        .annotate(rank=Cast(SearchRank(journal_search_vector(), query), RANK_FIELD))
+    )
@@ -0,0 +1,270 @@
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import DecimalField, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .caching import changed
+from .events import INVENTORY, STOCK, inventory_delta, publish, stock_delta
+from .models import (
+    IngredientInventory,
+    InventoryMovement,
+    InventorySnapshot,
+    StockItem,
+    StockMovement,
+    StockSnapshot,
+)
+
+
+# Inventory and stock ledger.
+#
+# Every change to an ingredient or ice cream quantity is an inserted
+# InventoryMovement / StockMovement row; nothing updates the quantity columns in
+# place on the write path. IngredientInventory.quantity and StockItem.quantity
+# hold the balance as of the last snapshot (last_movement_id), and the current
+# balance is that plus the movements recorded since, computed in the same query.
+# take_snapshot() (management command snapshot_inventory) folds the new
+# movements into the balances and stores a snapshot row per item.
+
+QUANTITY_FIELD = DecimalField(max_digits=10, decimal_places=2)
+
+
+def movement_total(movements, group_by):
+    # Sum of the movements as a correlated subquery, 0 when there are none
+    total = (
+        movements.order_by()
+        .values(group_by)
+        .annotate(total=Sum("quantity"))
+        .values("total")
+    )
+    return Coalesce(
+        Subquery(total, output_field=QUANTITY_FIELD),
+        Value(Decimal("0")),
+        output_field=QUANTITY_FIELD,
+    )
+
+
+def pending_total(movements, group_by, upto=None):
+    # Movements after the row's last_movement_id (and up to `upto`)
+    movements = movements.filter(pk__gt=OuterRef("last_movement_id"))
+    if upto is not None:
+        movements = movements.filter(pk__lte=upto)
+    return movement_total(movements, group_by)
+
+
+def pending_inventory_movements(upto=None):
+    return pending_total(
+        InventoryMovement.objects.filter(ingredient=OuterRef("ingredient_name")),
+        "ingredient",
+        upto,
+    )
+
+
+def pending_stock_movements(upto=None):
+    return pending_total(
+        StockMovement.objects.filter(recipe=OuterRef("recipe"), size=OuterRef("size")),
+        "recipe",
+        upto,
+    )
+
+
+def inventory_balance():
+    return (
+        Coalesce(F("quantity"), Value(Decimal("0")), output_field=QUANTITY_FIELD)
+        + pending_inventory_movements()
+    )
+
+
+def stock_balance():
+    return F("quantity") + pending_stock_movements()
+
+
+def inventory_with_balance(queryset=None):
+    """IngredientInventory rows annotated with their current `balance`."""
+    if queryset is None:
+        queryset = IngredientInventory.objects.all()
+    return queryset.annotate(balance=inventory_balance())
+
+
+def stock_with_balance(queryset=None):
+    """StockItem rows annotated with their current `balance`."""
+    if queryset is None:
+        queryset = StockItem.objects.all()
+    return queryset.annotate(balance=stock_balance())
+
+
+def balance_as_of(queryset, snapshots, movements, group_by, moment):
+    # Start from the last snapshot taken at or before `moment` and replay the
+    # movements recorded after it up to `moment`. Snapshots are daily, so the
+    # replay is bounded to about one day of movements per row.
+    snapshots = snapshots.filter(taken_at__lte=moment).order_by("-taken_at", "-pk")
+    queryset = queryset.annotate(
+        snapshot_quantity=Coalesce(
+            Subquery(snapshots.values("quantity")[:1]),
+            Value(Decimal("0")),
+            output_field=QUANTITY_FIELD,
+        ),
+        snapshot_movement_id=Coalesce(
+            Subquery(snapshots.values("last_movement_id")[:1]), Value(0)
+        ),
+    )
+    movements = movements.filter(
+        pk__gt=OuterRef("snapshot_movement_id"), date_moved__lte=moment
+    )
+    return queryset.annotate(
+        balance=F("snapshot_quantity") + movement_total(movements, group_by)
+    )
+
+
+def inventory_as_of(moment, queryset=None):
+    """
+    IngredientInventory rows annotated with their `balance` at `moment`.
+
+    Balances from before the first snapshot only include ledger movements.
+    """
+    if queryset is None:
+        queryset = IngredientInventory.objects.all()
+    return balance_as_of(
+        queryset,
+        InventorySnapshot.objects.filter(inventory=OuterRef("pk")),
+        InventoryMovement.objects.filter(ingredient=OuterRef("ingredient_name")),
+        "ingredient",
+        moment,
+    )
+
+
+def stock_as_of(moment, queryset=None):
+    """StockItem rows annotated with their `balance` at `moment`."""
+    if queryset is None:
+        queryset = StockItem.objects.all()
+    return balance_as_of(
+        queryset,
+        StockSnapshot.objects.filter(stock_item=OuterRef("pk")),
+        StockMovement.objects.filter(recipe=OuterRef("recipe"), size=OuterRef("size")),
+        "recipe",
+        moment,
+    )
+
+
+def ensure_inventory(ingredient_ids):
+    # Every ingredient with movements gets an inventory row (insert-only)
+    IngredientInventory.objects.bulk_create(
+        [
+            IngredientInventory(ingredient_name_id=pk, quantity=0)
+            for pk in ingredient_ids
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def record_inventory_movements(quantities, kind, moved_by=None):
+    """Append one InventoryMovement per {ingredient_id: signed quantity}."""
+    InventoryMovement.objects.bulk_create(
+        [
+            InventoryMovement(
+                ingredient_id=ingredient_id,
+                quantity=quantity,
+                kind=kind,
+                moved_by=moved_by,
+            )
+            for ingredient_id, quantity in quantities.items()
+            if quantity
+        ]
+    )
+    # The balances changed (see caching.py), and the open pages (events.py)
+    changed(IngredientInventory)
+    publish(INVENTORY, inventory_delta(quantities))
+
+
+def record_stock_movements(quantities, kind, moved_by=None):
+    """Append one StockMovement per {(recipe_id, size): signed quantity}."""
+    StockMovement.objects.bulk_create(
+        [
+            StockMovement(
+                recipe_id=recipe_id,
+                size=float(size),
+                quantity=quantity,
+                kind=kind,
+                moved_by=moved_by,
+            )
+            for (recipe_id, size), quantity in quantities.items()
+            if quantity
+        ]
+    )
+    changed(StockItem)
+    publish(STOCK, stock_delta(quantities))
+
+
+def lock_movements(model):
+    # Wait for transactions still inserting movements, so no movement with a
+    # lower id than the new watermark can commit after the snapshot.
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"LOCK TABLE {connection.ops.quote_name(model._meta.db_table)} "
+                "IN SHARE MODE"
+            )
+
+
+def take_snapshot():
+    """
+    Fold the movements recorded since the last snapshot into the balances and
+    store one snapshot row per ingredient and per stock item.
+
+    Only the movements after each row's watermark are read, so the cost
+    depends on the activity since the last snapshot, not on the ledger size.
+    Returns the number of snapshot rows written.
+    """
+    taken_at = timezone.now()
+
+    with transaction.atomic():
+        lock_movements(InventoryMovement)
+        lock_movements(StockMovement)
+
+        inventory_upto = (
+            InventoryMovement.objects.aggregate(upto=Max("pk"))["upto"] or 0
+        )
+        IngredientInventory.objects.filter(last_movement_id__lt=inventory_upto).update(
+            quantity=Coalesce(
+                F("quantity"), Value(Decimal("0")), output_field=QUANTITY_FIELD
+            )
+            + pending_inventory_movements(upto=inventory_upto),
+            last_movement_id=inventory_upto,
+        )
+
+        stock_upto = StockMovement.objects.aggregate(upto=Max("pk"))["upto"] or 0
+        StockItem.objects.filter(last_movement_id__lt=stock_upto).update(
+            quantity=F("quantity") + pending_stock_movements(upto=stock_upto),
+            last_movement_id=stock_upto,
+        )
+
+        inventories = IngredientInventory.objects.values_list(
+            "pk", "quantity", "last_movement_id"
+        )
+        inventory_snapshots = InventorySnapshot.objects.bulk_create(
+            [
+                InventorySnapshot(
+                    inventory_id=pk,
+                    quantity=quantity or 0,
+                    last_movement_id=last_movement_id,
+                    taken_at=taken_at,
+                )
+                for pk, quantity, last_movement_id in inventories
+            ]
+        )
+        stock_snapshots = StockSnapshot.objects.bulk_create(
+            [
+                StockSnapshot(
+                    stock_item_id=pk,
+                    quantity=quantity,
+                    last_movement_id=last_movement_id,
+                    taken_at=taken_at,
+                )
+                for pk, quantity, last_movement_id in StockItem.objects.values_list(
+                    "pk", "quantity", "last_movement_id"
+                )
+            ]
+        )
+
+    return len(inventory_snapshots) + len(stock_snapshots)
@@ -0,0 +1,76 @@
+import os
+
+import cv2
+from django.core.management.base import BaseCommand, CommandError
+
+from api.scanner import benchmark
+
+VIDEO_EXTENSIONS = {".avi", ".mkv", ".mov", ".mp4", ".webm"}
+
+
+def read_frames(path, limit):
+    # An image, a directory of images or a recorded video
+    if os.path.isdir(path):
+        frames = []
+        for name in sorted(os.listdir(path)):
+            frames.extend(read_frames(os.path.join(path, name), limit - len(frames)))
+            if len(frames) >= limit:
+                break
+        return frames
+
+    if os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS:
+        capture = cv2.VideoCapture(path)
+        frames = []
+        while len(frames) < limit:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            frames.append(frame)
+        capture.release()
+        return frames
+
+    frame = cv2.imread(path)
+    return [frame] if frame is not None and limit > 0 else []
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay recorded frames (images, directories of images or videos) "
+        "through the QR decode pipeline and report the decode rate and latency, "
+        "with and without the grayscale/downscale preprocessing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+")
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--roi", type=float, default=1.0)
+        parser.add_argument("--max-width", type=int, default=640)
+        parser.add_argument(
+            "--limit", type=int, default=1000, help="Maximum number of frames."
+        )
+
+    def handle(self, *args, **options):
+        frames = []
+        for path in options["paths"]:
+            if not os.path.exists(path):
+                raise CommandError(f"{path} does not exist.")
+            frames.extend(read_frames(path, options["limit"] - len(frames)))
+        if not frames:
+            raise CommandError("No frames could be read.")
+
+        self.stdout.write(f"{len(frames)} frames, {options['workers']} workers")
+        for label, raw in [("raw", True), ("pipeline", False)]:
+            metrics, badges = benchmark(
+                frames,
+                workers=options["workers"],
+                roi=options["roi"],
+                max_width=options["max_width"],
+                raw=raw,
+            )
+            self.stdout.write(
+                f"{label:>8}: {metrics['fps']} fps, "
+                f"p50 {metrics['latency_p50_ms']} ms, "
+                f"p95 {metrics['latency_p95_ms']} ms, "
+                f"{len(badges)} badges in {metrics['decoded']} frames "
+                f"({len(set(badges))} distinct)"
+            )
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.partitions import apply_retention, ensure_partitions, is_partitioned
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the monthly partitions of the journal ahead of time and archive "
+        "the partitions older than JOURNAL_RETENTION_MONTHS to gzipped CSV files "
+        "in JOURNAL_ARCHIVE_DIR. Run it periodically (e.g. daily from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=2,
+            help="Number of future months to create partitions for.",
+        )
+        parser.add_argument(
+            "--retention-months",
+            type=int,
+            default=settings.JOURNAL_RETENTION_MONTHS,
+            help="Months of journal kept in the database (0 keeps everything).",
+        )
+        parser.add_argument(
+            "--archive-dir",
+            default=settings.JOURNAL_ARCHIVE_DIR,
+            help="Directory of the archived partitions.",
+        )
+
+    def handle(self, *args, **options):
+        if not is_partitioned():
+            raise CommandError(
+                "The journal table is not partitioned (PostgreSQL only)."
+            )
+
+        for name in ensure_partitions(options["months_ahead"]):
+            self.stdout.write(f"Created partition {name}.")
+
+        if options["retention_months"]:
+            for path in apply_retention(
+                options["retention_months"], options["archive_dir"]
+            ):
+                self.stdout.write(f"Archived partition to {path}.")
+
+        self.stdout.write(self.style.SUCCESS("Journal partitions up to date."))
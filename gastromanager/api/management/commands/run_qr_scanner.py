@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from api.clock import clock
+from api.scanner import BadgeScanner, ClockClient
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the badge scanner of a clock terminal: read QR badges from the "
+        "camera and clock the employees in and out, through the clock endpoint "
+        "of the web application (--url) or directly in the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--camera", type=int, default=0, help="Camera index.")
+        parser.add_argument(
+            "--url",
+            help="Clock endpoint, e.g. https://gastro.example.com/api/clock/. "
+            "Without it the events are booked directly in the database.",
+        )
+        parser.add_argument(
+            "--token",
+            default=settings.CLOCK_API_TOKEN,
+            help="Token of the clock endpoint (default: CLOCK_API_TOKEN).",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=5.0,
+            help="Seconds to wait for the clock endpoint before giving up.",
+        )
+        parser.add_argument(
+            "--every", type=int, default=3, help="Decode every n-th frame."
+        )
+        parser.add_argument(
+            "--roi",
+            type=float,
+            default=1.0,
+            help="Decode only this centered fraction of each side of the frame.",
+        )
+        parser.add_argument(
+            "--max-width", type=int, default=640, help="Downscale frames to this width."
+        )
+        parser.add_argument(
+            "--workers", type=int, default=2, help="Number of decoding threads."
+        )
+        parser.add_argument(
+            "--stats-every",
+            type=float,
+            default=60.0,
+            help="Seconds between two log lines of decode metrics (0 for none).",
+        )
+        parser.add_argument(
+            "--debounce",
+            type=float,
+            default=5.0,
+            help="Seconds during which the same badge is not booked again.",
+        )
+
+    def handle(self, *args, **options):
+        if options["url"]:
+            if not options["token"]:
+                raise CommandError("--token or CLOCK_API_TOKEN is required with --url.")
+            client = ClockClient(options["url"], options["token"], options["timeout"])
+
+            def on_badge(badge):
+                self.stdout.write(f"{badge}: {client(badge)}")
+
+        else:
+
+            def on_badge(badge):
+                try:
+                    employee, working_hours, action = clock(badge)
+                except ValidationError as e:
+                    self.stderr.write(f"{badge}: {' '.join(e.messages)}")
+                    return
+                self.stdout.write(f"{employee.username} - Clocked {action}")
+
+        scanner = BadgeScanner(
+            on_badge,
+            camera=options["camera"],
+            every=options["every"],
+            roi=options["roi"],
+            max_width=options["max_width"],
+            debounce=options["debounce"],
+            workers=options["workers"],
+            stats_every=options["stats_every"] or None,
+        )
+        self.stdout.write("Scanning badges, press Ctrl+C to stop.")
+        try:
+            scanner.run()
+        except KeyboardInterrupt:
+            scanner.stop()
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"Decode metrics: {scanner.pipeline.metrics.snapshot()}")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.ledger import take_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold the inventory and stock movements recorded since the last snapshot "
+        "into the balances and store a snapshot row per item. Run it periodically "
+        "(e.g. nightly from cron)."
+    )
+
+    def handle(self, *args, **options):
+        written = take_snapshot()
+        self.stdout.write(self.style.SUCCESS(f"{written} snapshot rows written."))
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:39
+
+from django.db import migrations, models
+
+
+def merge_duplicate_stock_items(apps, schema_editor):
+    # Fold duplicated (recipe, size) rows into the oldest one before the
+    # unique constraint is added.
+    StockItem = apps.get_model("api", "StockItem")
+    kept = {}
+    for stock_item in StockItem.objects.order_by("pk"):
+        key = (stock_item.recipe_id, stock_item.size)
+        if key not in kept:
+            kept[key] = stock_item
+            continue
+        kept[key].quantity += stock_item.quantity
+        kept[key].save(update_fields=["quantity"])
+        stock_item.delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_stock_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="stockitem",
+            constraint=models.UniqueConstraint(
+                fields=("recipe", "size"), name="unique_stock_item_recipe_size"
+            ),
+        ),
+    ]
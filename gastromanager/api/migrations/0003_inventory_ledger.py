@@ -0,0 +1,195 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def merge_duplicate_inventories(apps, schema_editor):
+    # Fold duplicated inventory rows of an ingredient into the oldest one
+    # before the unique constraint is added.
+    IngredientInventory = apps.get_model("api", "IngredientInventory")
+    kept = {}
+    for inventory in IngredientInventory.objects.order_by("pk"):
+        if inventory.ingredient_name_id not in kept:
+            kept[inventory.ingredient_name_id] = inventory
+            continue
+        first = kept[inventory.ingredient_name_id]
+        first.quantity = (first.quantity or 0) + (inventory.quantity or 0)
+        first.save(update_fields=["quantity"])
+        inventory.delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0002_stockitem_unique_recipe_size"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InventoryMovement",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("quantity", models.DecimalField(decimal_places=2, max_digits=10)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("incoming", "Incoming"),
+                            ("production", "Production"),
+                            ("correction", "Manual correction"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("date_moved", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="InventorySnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("quantity", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("last_movement_id", models.BigIntegerField()),
+                ("taken_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="StockMovement",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "size",
+                    models.FloatField(
+                        choices=[(0.5, "0.5 Litres"), (3, "3 Litres"), (6, "6 Litres")]
+                    ),
+                ),
+                ("quantity", models.DecimalField(decimal_places=2, max_digits=10)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("production", "Production"),
+                            ("takeout", "Takeout"),
+                            ("correction", "Manual correction"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("date_moved", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="StockSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("quantity", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("last_movement_id", models.BigIntegerField()),
+                ("taken_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="ingredientinventory",
+            name="last_movement_id",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="stockitem",
+            name="last_movement_id",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(merge_duplicate_inventories, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="ingredientinventory",
+            constraint=models.UniqueConstraint(
+                fields=("ingredient_name",), name="unique_inventory_ingredient"
+            ),
+        ),
+        migrations.AddField(
+            model_name="stocksnapshot",
+            name="stock_item",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="snapshots",
+                to="api.stockitem",
+            ),
+        ),
+        migrations.AddField(
+            model_name="stockmovement",
+            name="moved_by",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="stockmovement",
+            name="recipe",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, to="api.recipe"
+            ),
+        ),
+        migrations.AddField(
+            model_name="inventorysnapshot",
+            name="inventory",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="snapshots",
+                to="api.ingredientinventory",
+            ),
+        ),
+        migrations.AddField(
+            model_name="inventorymovement",
+            name="ingredient",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="movements",
+                to="api.ingredient",
+            ),
+        ),
+        migrations.AddField(
+            model_name="inventorymovement",
+            name="moved_by",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
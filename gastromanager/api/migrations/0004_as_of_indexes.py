@@ -0,0 +1,65 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0003_inventory_ledger"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="icecreamproduction",
+            name="date_produced",
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name="icecreamstocktakeout",
+            name="date_moved",
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name="ingredientincoming",
+            name="date_received",
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name="inventorymovement",
+            index=models.Index(
+                fields=["ingredient", "date_moved"],
+                name="api_invento_ingredi_8a8f8a_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="inventorymovement",
+            index=models.Index(
+                fields=["date_moved"], name="api_invento_date_mo_209716_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="inventorysnapshot",
+            index=models.Index(
+                fields=["inventory", "taken_at"], name="api_invento_invento_d9c66b_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="stockmovement",
+            index=models.Index(
+                fields=["recipe", "size", "date_moved"],
+                name="api_stockmo_recipe__f23be8_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="stockmovement",
+            index=models.Index(
+                fields=["date_moved"], name="api_stockmo_date_mo_3d5baf_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="stocksnapshot",
+            index=models.Index(
+                fields=["stock_item", "taken_at"], name="api_stocksn_stock_i_8a9a6f_idx"
+            ),
+        ),
+    ]
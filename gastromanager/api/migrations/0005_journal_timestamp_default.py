@@ -0,0 +1,20 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:45
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0004_as_of_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="journal",
+            name="timestamp",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, editable=False
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:46
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0005_journal_timestamp_default"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="journal",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.search.SearchVector("action", config="simple"),
+                name="journal_action_search",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="journal",
+            index=models.Index(
+                fields=["timestamp", "user"], name="journal_timestamp_user"
+            ),
+        ),
+    ]
@@ -0,0 +1,100 @@
+from django.db import migrations
+
+
+# Turns api_journal into a table partitioned by month on "timestamp"
+# (PostgreSQL only). Every existing row goes to the default partition;
+# the journal_partitions management command then creates the monthly
+# partitions and moves the rows out of the default one.
+#
+# A primary key of a partitioned table must contain the partition key, so it
+# becomes (id, timestamp); id is still unique, drawn from a sequence.
+
+
+def partition_journal(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    Journal = apps.get_model("api", "Journal")
+    user = Journal._meta.get_field("user")
+
+    schema_editor.execute("ALTER TABLE api_journal RENAME TO api_journal_unpartitioned")
+    schema_editor.execute(
+        "ALTER INDEX api_journal_pkey RENAME TO api_journal_unpartitioned_pkey"
+    )
+    schema_editor.execute("CREATE SEQUENCE api_journal_partitioned_id_seq")
+    schema_editor.execute(
+        """
+        CREATE TABLE api_journal (
+            "id" bigint NOT NULL DEFAULT nextval('api_journal_partitioned_id_seq'),
+            "action" varchar(255) NOT NULL,
+            "timestamp" timestamp with time zone NOT NULL,
+            "user_id" bigint NULL,
+            PRIMARY KEY ("id", "timestamp")
+        ) PARTITION BY RANGE ("timestamp")
+        """
+    )
+    schema_editor.execute(
+        "ALTER SEQUENCE api_journal_partitioned_id_seq OWNED BY api_journal.id"
+    )
+    schema_editor.execute(
+        "CREATE TABLE api_journal_default PARTITION OF api_journal DEFAULT"
+    )
+    schema_editor.execute(
+        """
+        INSERT INTO api_journal ("id", "action", "timestamp", "user_id")
+        SELECT "id", "action", "timestamp", "user_id" FROM api_journal_unpartitioned
+        """
+    )
+    schema_editor.execute(
+        "SELECT setval('api_journal_partitioned_id_seq', "
+        "COALESCE(MAX(id), 0) + 1, false) FROM api_journal"
+    )
+    schema_editor.execute("DROP TABLE api_journal_unpartitioned")
+
+    # Indexes and foreign key under their usual names, on every partition
+    for index in Journal._meta.indexes:
+        schema_editor.add_index(Journal, index)
+    schema_editor.execute(schema_editor._create_index_sql(Journal, fields=[user]))
+    schema_editor.execute(
+        schema_editor._create_fk_sql(Journal, user, "_fk_%(to_table)s_%(to_column)s")
+    )
+
+
+def unpartition_journal(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    Journal = apps.get_model("api", "Journal")
+    user = Journal._meta.get_field("user")
+
+    for index in Journal._meta.indexes:
+        schema_editor.remove_index(Journal, index)
+    for name in schema_editor._constraint_names(Journal, [user.column], index=True):
+        schema_editor.execute(f"DROP INDEX {schema_editor.quote_name(name)}")
+    schema_editor.execute("ALTER TABLE api_journal RENAME TO api_journal_partitioned")
+    schema_editor.execute(
+        "ALTER INDEX api_journal_pkey RENAME TO api_journal_partitioned_pkey"
+    )
+
+    schema_editor.create_model(Journal)
+    schema_editor.execute(
+        """
+        INSERT INTO api_journal ("id", "action", "timestamp", "user_id")
+        SELECT "id", "action", "timestamp", "user_id" FROM api_journal_partitioned
+        """
+    )
+    schema_editor.execute(
+        "SELECT setval(pg_get_serial_sequence('api_journal', 'id'), "
+        "COALESCE(MAX(id), 0) + 1, false) FROM api_journal"
+    )
+    schema_editor.execute("DROP TABLE api_journal_partitioned CASCADE")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0006_journal_search_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_journal, unpartition_journal),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0007_partition_journal"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="workinghours",
+            index=models.Index(
+                fields=["employee", "clock_in"], name="api_working_employe_f08ca3_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:55
+
+from django.db import migrations, models
+
+
+def close_extra_open_shifts(apps, schema_editor):
+    # Only the latest open shift of an employee stays open; the older ones,
+    # left open by double scans, are closed with no worked time.
+    WorkingHours = apps.get_model("api", "WorkingHours")
+    seen = set()
+    for working_hours in WorkingHours.objects.filter(clock_out__isnull=True).order_by(
+        "employee_id", "-clock_in", "-pk"
+    ):
+        if working_hours.employee_id is None or working_hours.employee_id not in seen:
+            seen.add(working_hours.employee_id)
+            continue
+        working_hours.clock_out = working_hours.clock_in
+        working_hours.save(update_fields=["clock_out"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0008_working_hours_employee_clock_in"),
+    ]
+
+    operations = [
+        migrations.RunPython(close_extra_open_shifts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="workinghours",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("clock_out__isnull", True)),
+                fields=("employee",),
+                name="one_open_shift_per_employee",
+            ),
+        ),
+    ]
@@ -1,12 +1,15 @@
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 
 from datetime import datetime
-from PIL import Image, ImageDraw, ImageFont
-import qrcode
+
+from .badges import badge_filename, cached_badge
 
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth import get_user_model
@@ -47,7 +50,17 @@ class UserProfile(AbstractUser):
 class Journal(models.Model):
     user = models.ForeignKey(get_user_model(), on_delete=models.SET_NULL, null=True)
     action = models.CharField(max_length=255)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the action happens, entries can be written later (see journal.py)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            # Full-text search on the action (see journal.search_journal)
+            GinIndex(
+                SearchVector("action", config="simple"), name="journal_action_search"
+            ),
+            models.Index(fields=["timestamp", "user"], name="journal_timestamp_user"),
+        ]
 
     def __str__(self):
         return f"{self.timestamp} - {self.user} - {self.action}"
@@ -58,40 +71,11 @@ class EmployeeBadge(models.Model):
     employee_id = models.PositiveIntegerField()
 
     def generate_badge(self):
-        data = self.employee_id
-        background_color = (255, 253, 240)
-
-        badge_width = 250
-        badge_height = 400
-        badge_center_x_axis = badge_width // 2
-        badge = Image.new("RGB", (badge_width, badge_height), background_color)
-        draw = ImageDraw.Draw(badge)
-
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=8,
-            border=2,
-        )
-        qr.add_data(data)
-        qr.make(fit=True)
-        qr_img = qr.make_image(fill_color="black", back_color=background_color)
-
-        logo_path = "api/media/green_scoop.png"
-        logo = Image.open(logo_path)
-        logo_x_axis_position = badge_center_x_axis - (logo.width // 2)
-
-        font_path = "api/fonts/SantEliaScriptAlt-Bold.ttf"
-        font = ImageFont.truetype(font_path, 20)
+        # PNG bytes of the badge, rendered once and then read from the cache
+        return cached_badge(self.employee_name, self.employee_id)
 
-        draw.text((80, 180), self.employee_name, fill="black", font=font)
-        badge.paste(qr_img, (25, 200))
-        badge.paste(logo, (logo_x_axis_position, 20))
-
-        file_name = f"api/badges/{self.employee_name.replace(' ', '_')}_Badge.png"
-        badge.save(file_name)
-
-        return file_name
+    def badge_filename(self):
+        return badge_filename(self.employee_name)
 
 
 class WorkingHours(models.Model):
@@ -99,16 +83,33 @@ class WorkingHours(models.Model):
     clock_in = models.DateTimeField(default=datetime.now)
     clock_out = models.DateTimeField(null=True, blank=datetime.now)
 
+    class Meta:
+        indexes = [models.Index(fields=["employee", "clock_in"])]
+        constraints = [
+            # At most one open shift per employee (see clock.py)
+            models.UniqueConstraint(
+                fields=["employee"],
+                condition=models.Q(clock_out__isnull=True),
+                name="one_open_shift_per_employee",
+            )
+        ]
+
     def recorded_time(self):
         if self.clock_out is not None:
-            time_difference = self.clock_out - self.clock_in
-            hours, remainder = divmod(time_difference.seconds, 3600)
-            minutes, seconds = divmod(remainder, 60)
-            return f"{time_difference.days} days {hours} hours {minutes} minutes {seconds} seconds"
+            return format_duration(self.clock_out - self.clock_in)
         else:
             return None
 
 
+def format_duration(time_difference):
+    hours, remainder = divmod(time_difference.seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return (
+        f"{time_difference.days} days {hours} hours "
+        f"{minutes} minutes {seconds} seconds"
+    )
+
+
 class Ingredient(models.Model):  # Model to represent an ingredient
     name = models.CharField(max_length=255, unique=True)
 
@@ -133,7 +134,17 @@ class Ingredient(models.Model):  # Model to represent an ingredient
 
 class IngredientInventory(models.Model):
     ingredient_name = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
+    # Balance as of the last snapshot; movements after last_movement_id are
+    # added on read (see api.ledger).
     quantity = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    last_movement_id = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["ingredient_name"], name="unique_inventory_ingredient"
+            )
+        ]
 
     def __str__(self):
         unit = (
@@ -141,22 +152,36 @@ class IngredientInventory(models.Model):
         )  # Get the unit of measurement from the related Ingredient
         if unit == "grams":
             # If the unit is "grams," display the quantity in grams
-            return f"{self.ingredient_name.name}: {self.quantity} {unit}"
+            return f"{self.ingredient_name.name}: {self.current_balance()} {unit}"
         elif unit == "units":
             # If the unit is "units," display the quantity in units
-            return f"{self.ingredient_name.name}: {int(self.quantity)} {unit}"
+            return f"{self.ingredient_name.name}: {int(self.current_balance())} {unit}"
         else:
             # If the unit is neither "grams" nor "units," display only the ingredient name
             return self.ingredient_name.name
 
+    def current_balance(self):
+        # The `balance` annotated by api.ledger, or one query for it; quantity
+        # is only the last snapshot. (api.ledger imports this module.)
+        from .ledger import inventory_with_balance
+
+        if hasattr(self, "balance"):
+            return self.balance
+        queryset = inventory_with_balance(
+            IngredientInventory.objects.filter(pk=self.pk)
+        )
+        return queryset.values_list("balance", flat=True).first() or 0
+
+    @classmethod
     def update_or_create_inventory(cls, ingredient, new_quantity):
-        # Get or create the inventory entry
-        inventory_entry, created = cls.objects.get_or_create(ingredient_name=ingredient)
+        # Incoming quantities are appended to the ledger, the row itself is
+        # only created if missing
+        from .ledger import ensure_inventory, record_inventory_movements
 
-        # Update the existing quantity with the new quantity if not created
-        if not created:
-            inventory_entry.quantity += new_quantity
-            inventory_entry.save()
+        ensure_inventory([ingredient.pk])
+        record_inventory_movements(
+            {ingredient.pk: new_quantity}, InventoryMovement.INCOMING
+        )
 
 
 #  model represents incoming ingredients in the shop.
@@ -173,7 +198,9 @@ class IngredientIncoming(models.Model):
     unit_of_measurement = models.CharField(
         max_length=10, choices=UNIT_CHOICES, default=GRAMS
     )
-    date_received = models.DateTimeField(auto_now_add=True)  # date time automatic
+    date_received = models.DateTimeField(
+        auto_now_add=True, db_index=True
+    )  # date time automatic
     lot_number = models.CharField(max_length=255, blank=True, null=True)
     expiration_date = models.DateField(blank=True, null=True)
     temperature = models.DecimalField(
@@ -217,21 +244,41 @@ class StockItem(models.Model):  # model represents IceCream in stock.
     size = models.FloatField(
         choices=[(0.5, "0.5 Litres"), (3, "3 Litres"), (6, "6 Litres")], default=0.5
     )
+    # Balance as of the last snapshot; movements after last_movement_id are
+    # added on read (see api.ledger).
     quantity = models.DecimalField(max_digits=10, decimal_places=2)
+    last_movement_id = models.BigIntegerField(default=0)
     date_added = models.DateTimeField(auto_now=True)
     added_by = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            # One row per flavor and size
+            models.UniqueConstraint(
+                fields=["recipe", "size"], name="unique_stock_item_recipe_size"
+            )
+        ]
+
     def __str__(self):
-        return f"{self.recipe} ({self.size}L) - {self.quantity} in stock"
+        return f"{self.recipe} ({self.size}L) - {self.current_balance()} in stock"
+
+    def current_balance(self):
+        # Same as IngredientInventory.current_balance
+        from .ledger import stock_with_balance
+
+        if hasattr(self, "balance"):
+            return self.balance
+        queryset = stock_with_balance(StockItem.objects.filter(pk=self.pk))
+        return queryset.values_list("balance", flat=True).first() or 0
 
 
 class IceCreamProduction(models.Model):  # Model to represent ice cream production
+    CONTAINER_CHOICES = [(0.5, "0.5 Litres"), (3, "3 Litres"), (6, "6 Litres")]
+
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, default=None)
-    container_size = models.FloatField(
-        choices=[(0.5, "0.5 Litres"), (3, "3 Litres"), (6, "6 Litres")]
-    )
+    container_size = models.FloatField(choices=CONTAINER_CHOICES)
     quantity_produced = models.DecimalField(max_digits=10, decimal_places=2)
-    date_produced = models.DateTimeField(auto_now_add=True)
+    date_produced = models.DateTimeField(auto_now_add=True, db_index=True)
     produced_by = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
 
     def __str__(self):
@@ -245,8 +292,117 @@ class IceCreamStockTakeOut(
         IceCreamProduction, on_delete=models.CASCADE
     )
     quantity_moved = models.DecimalField(max_digits=10, decimal_places=2)
-    date_moved = models.DateTimeField()
+    date_moved = models.DateTimeField(db_index=True)
     moved_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
 
     def __str__(self):
         return f"{self.ice_cream_production.recipe} ({self.ice_cream_production.container_size}L) - {self.quantity_moved} sold on {self.date_moved}"
+
+
+class InventoryMovement(models.Model):  # append-only ledger of ingredient movements
+    INCOMING = "incoming"
+    PRODUCTION = "production"
+    CORRECTION = "correction"
+    KIND_CHOICES = [
+        (INCOMING, "Incoming"),
+        (PRODUCTION, "Production"),
+        (CORRECTION, "Manual correction"),
+    ]
+
+    ingredient = models.ForeignKey(
+        Ingredient, on_delete=models.CASCADE, related_name="movements"
+    )
+    # Positive for ingredients coming in, negative for ingredients used
+    quantity = models.DecimalField(max_digits=10, decimal_places=2)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    date_moved = models.DateTimeField(default=timezone.now)
+    moved_by = models.ForeignKey(
+        get_user_model(), on_delete=models.SET_NULL, null=True, blank=True
+    )
+
+    class Meta:
+        indexes = [
+            # Replay of an ingredient's movements up to a point in time
+            models.Index(fields=["ingredient", "date_moved"]),
+            models.Index(fields=["date_moved"]),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Inventory movements cannot be changed.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.ingredient} {self.quantity:+} ({self.kind}) on {self.date_moved}"
+
+
+class StockMovement(models.Model):  # append-only ledger of ice cream stock movements
+    PRODUCTION = "production"
+    TAKEOUT = "takeout"
+    CORRECTION = "correction"
+    KIND_CHOICES = [
+        (PRODUCTION, "Production"),
+        (TAKEOUT, "Takeout"),
+        (CORRECTION, "Manual correction"),
+    ]
+
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
+    size = models.FloatField(choices=IceCreamProduction.CONTAINER_CHOICES)
+    # Positive for produced ice cream, negative for ice cream taken out
+    quantity = models.DecimalField(max_digits=10, decimal_places=2)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    date_moved = models.DateTimeField(default=timezone.now)
+    moved_by = models.ForeignKey(
+        get_user_model(), on_delete=models.SET_NULL, null=True, blank=True
+    )
+
+    class Meta:
+        indexes = [
+            # Replay of a stock item's movements up to a point in time
+            models.Index(fields=["recipe", "size", "date_moved"]),
+            models.Index(fields=["date_moved"]),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Stock movements cannot be changed.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return (
+            f"{self.recipe} ({self.size}L) {self.quantity:+} ({self.kind}) "
+            f"on {self.date_moved}"
+        )
+
+
+class InventorySnapshot(models.Model):  # periodic copy of the ingredient balances
+    inventory = models.ForeignKey(
+        IngredientInventory, on_delete=models.CASCADE, related_name="snapshots"
+    )
+    quantity = models.DecimalField(max_digits=10, decimal_places=2)
+    last_movement_id = models.BigIntegerField()
+    taken_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=["inventory", "taken_at"])]
+
+    def __str__(self):
+        return f"{self.inventory.ingredient_name}: {self.quantity} on {self.taken_at}"
+
+
+class StockSnapshot(models.Model):  # periodic copy of the ice cream stock balances
+    stock_item = models.ForeignKey(
+        StockItem, on_delete=models.CASCADE, related_name="snapshots"
+    )
+    quantity = models.DecimalField(max_digits=10, decimal_places=2)
+    last_movement_id = models.BigIntegerField()
+    taken_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=["stock_item", "taken_at"])]
+
+    def __str__(self):
+        return (
+            f"{self.stock_item.recipe} ({self.stock_item.size}L): "
+            f"{self.quantity} on {self.taken_at}"
+        )
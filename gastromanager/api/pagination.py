@@ -0,0 +1,100 @@
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+# Keyset (cursor) pagination.
+#
+# A page continues after the last row of the previous one: the cursor holds the
+# values of the ordering fields of that row and the next page filters on them
+# ("timestamp < t OR (timestamp = t AND id < i)"), so with an index on the
+# ordering fields every page costs the same, however deep, unlike OFFSET.
+
+PAGE_SIZE = 50
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    # Full microseconds: DjangoJSONEncoder rounds datetimes to milliseconds,
+    # and the cursor must match the stored value exactly.
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    data = json.dumps(values, cls=CursorEncoder).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def decode_cursor(queryset, fields, cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValidationError("Invalid cursor.")
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise ValidationError("Invalid cursor.")
+
+    # Back to Python values, e.g. an ISO string to a datetime
+    decoded = []
+    for name, value in zip(fields, values):
+        try:
+            field = queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # An annotation such as a rank
+            field = queryset.query.annotations[name].output_field
+        decoded.append(field.to_python(value))
+    return decoded
+
+
+def after_cursor(ordering, values):
+    # Rows after (ordering) = values, as an OR of "equal prefix, next field past"
+    condition = Q()
+    for index, (order, value) in enumerate(zip(ordering, values)):
+        lookup = "lt" if order.startswith("-") else "gt"
+        step = Q(**{f"{order.lstrip('-')}__{lookup}": value})
+        for previous, previous_value in zip(ordering[:index], values[:index]):
+            step &= Q(**{previous.lstrip("-"): previous_value})
+        condition |= step
+    return condition
+
+
+def keyset_slice(queryset, ordering, cursor, page_size):
+    # The queryset of one page plus one row, to know if there is a next page
+    fields = [order.lstrip("-") for order in ordering]
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        queryset = queryset.filter(
+            after_cursor(ordering, decode_cursor(queryset, fields, cursor))
+        )
+    return queryset[: page_size + 1], fields
+
+
+def keyset_result(rows, fields, page_size):
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor([getattr(rows[-1], name) for name in fields])
+    return rows, next_cursor
+
+
+def keyset_page(queryset, ordering, cursor=None, page_size=PAGE_SIZE):
+    """
+    One page of queryset ordered by ordering (field names, "-" for descending).
+
+    The last ordering field must be unique (e.g. "-id") so no row is skipped or
+    repeated. Returns (rows, next_cursor); next_cursor is None on the last page.
+    Raises ValidationError for a cursor that cannot be read.
+    """
+    page, fields = keyset_slice(queryset, ordering, cursor, page_size)
+    return keyset_result(list(page), fields, page_size)
+
+
+async def akeyset_page(queryset, ordering, cursor=None, page_size=PAGE_SIZE):
+    """keyset_page for async views, read with the async ORM."""
+    page, fields = keyset_slice(queryset, ordering, cursor, page_size)
+    return keyset_result([row async for row in page], fields, page_size)
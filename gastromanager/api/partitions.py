@@ -0,0 +1,161 @@
+import gzip
+import os
+import re
+from datetime import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Journal
+
+
+# Monthly partitions of the journal (PostgreSQL, see migration 0007).
+#
+# api_journal is partitioned by range on "timestamp", one partition per month
+# named api_journal_yYYYYmMM, plus api_journal_default for rows outside every
+# partition. Filters on a timestamp range (today, this week, ...) only read the
+# matching partitions. The journal_partitions management command creates the
+# partitions ahead of time and archives the ones older than the retention
+# period: detached, copied to a gzipped CSV file and dropped.
+
+TABLE = Journal._meta.db_table
+DEFAULT_PARTITION = f"{TABLE}_default"
+PARTITION_NAME = re.compile(rf"^{TABLE}_y(\d{{4}})m(\d{{2}})$")
+
+
+def month_start(moment):
+    # First instant of the month of moment, in the current timezone
+    return timezone.localtime(moment).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    # Same wall time in the new month, with that month's UTC offset
+    return timezone.make_aware(
+        month.replace(tzinfo=None, year=index // 12, month=index % 12 + 1)
+    )
+
+
+def partition_name(month):
+    return f"{TABLE}_y{month.year:04d}m{month.month:02d}"
+
+
+def partition_month(name):
+    match = PARTITION_NAME.match(name)
+    if match is None:
+        return None
+    year, month = (int(group) for group in match.groups())
+    return timezone.make_aware(datetime(year, month, 1))
+
+
+def is_partitioned():
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+            [TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def monthly_partitions():
+    """Names of the monthly partitions attached to the journal, oldest first."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = %s::regclass",
+            [TABLE],
+        )
+        names = [name for (name,) in cursor.fetchall()]
+    return sorted(name for name in names if partition_month(name) is not None)
+
+
+def create_partition(month):
+    # The rows of that month already in the default partition are moved into
+    # the new one before it is attached, otherwise attaching it would fail.
+    name = partition_name(month)
+    quote = connection.ops.quote_name
+    bounds = [month, add_months(month, 1)]
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE {quote(name)} (LIKE {quote(TABLE)} INCLUDING DEFAULTS)"
+        )
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {quote(DEFAULT_PARTITION)} "
+            f'WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *) '
+            f"INSERT INTO {quote(name)} SELECT * FROM moved",
+            bounds,
+        )
+        # Attaching creates the partition's indexes and foreign key
+        cursor.execute(
+            f"ALTER TABLE {quote(TABLE)} ATTACH PARTITION {quote(name)} "
+            "FOR VALUES FROM (%s) TO (%s)",
+            bounds,
+        )
+    return name
+
+
+def ensure_partitions(months_ahead=2):
+    """
+    Create the missing monthly partitions: every month that has rows in the
+    default partition and the months from the current one to months_ahead.
+    Returns the names of the created partitions.
+    """
+    existing = set(monthly_partitions())
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', \"timestamp\" AT TIME ZONE %s) "
+            f"FROM {connection.ops.quote_name(DEFAULT_PARTITION)}",
+            [timezone.get_current_timezone_name()],
+        )
+        months = {timezone.make_aware(month) for (month,) in cursor.fetchall()}
+
+    current = month_start(timezone.now())
+    months.update(add_months(current, offset) for offset in range(months_ahead + 1))
+
+    return [
+        create_partition(month)
+        for month in sorted(months)
+        if partition_name(month) not in existing
+    ]
+
+
+def archive_partition(name, directory):
+    """
+    Detach a monthly partition, copy its rows to <directory>/<name>.csv.gz and
+    drop it. Returns the path of the archive.
+    """
+    quote = connection.ops.quote_name
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.csv.gz")
+
+    with connection.cursor() as cursor:
+        # Detached first, so no new row can arrive while it is being copied
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} DETACH PARTITION {quote(name)}")
+        with gzip.open(f"{path}.part", "wb") as archive:
+            cursor.copy_expert(
+                f"COPY {quote(name)} TO STDOUT WITH (FORMAT csv, HEADER)", archive
+            )
+        os.replace(f"{path}.part", path)
+        cursor.execute(f"DROP TABLE {quote(name)}")
+    return path
+
+
+def expired_partitions(names, retention_months, now=None):
+    # Partitions whose whole month is older than the retention period
+    cutoff = add_months(month_start(now or timezone.now()), -retention_months)
+    return [name for name in names if partition_month(name) < cutoff]
+
+
+def apply_retention(retention_months, directory):
+    """Archive every partition older than retention_months; returns the paths."""
+    return [
+        archive_partition(name, directory)
+        for name in expired_partitions(monthly_partitions(), retention_months)
+    ]
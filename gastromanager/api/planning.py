@@ -0,0 +1,204 @@
+from decimal import ROUND_FLOOR, Decimal
+
+import numpy as np
+
+from .bom import BOM_TIMEOUT, CATALOG, get_bom
+from .caching import cached
+from .ledger import inventory_with_balance
+
+
+# Production planning on in-memory arrays.
+#
+# The bill of materials is turned into a recipe x ingredient matrix (quantity of
+# each ingredient per kg of each recipe), cached like the BOM itself (see
+# caching.py), so a whole plan is one matrix product instead of a loop over
+# recipes and ingredients.
+
+# Tolerance for comparing float demand with the 2-decimal inventory quantities
+EPSILON = 1e-6
+
+
+class RecipeMatrix:
+    def __init__(self, recipe_ids, ingredient_ids, ingredient_names, matrix):
+        self.recipe_ids = recipe_ids
+        self.ingredient_ids = ingredient_ids
+        self.ingredient_names = ingredient_names
+        self.recipe_index = {pk: index for index, pk in enumerate(recipe_ids)}
+        # shape (len(recipe_ids), len(ingredient_ids))
+        self.matrix = matrix
+
+    def quantity_vector(self, quantities):
+        # {recipe_id: kg} -> vector aligned with the matrix rows
+        vector = np.zeros(len(self.recipe_ids))
+        for recipe_id, quantity in quantities.items():
+            index = self.recipe_index.get(recipe_id)
+            if index is not None:
+                vector[index] += float(quantity)
+        return vector
+
+    def inventory_vector(self):
+        # Current inventory aligned with the matrix columns, in one query
+        column = {pk: index for index, pk in enumerate(self.ingredient_ids)}
+        vector = np.zeros(len(self.ingredient_ids))
+        for ingredient_id, quantity in inventory_with_balance().values_list(
+            "ingredient_name", "balance"
+        ):
+            if ingredient_id in column:
+                vector[column[ingredient_id]] += float(quantity)
+        return vector
+
+
+def build_recipe_matrix(bom, expand_bases=True):
+    vectors = bom.flattened if expand_bases else bom.direct
+    recipe_ids = sorted(vectors)
+    ingredient_ids = sorted(
+        {ingredient_id for vector in vectors.values() for ingredient_id in vector}
+    )
+    column = {pk: index for index, pk in enumerate(ingredient_ids)}
+
+    matrix = np.zeros((len(recipe_ids), len(ingredient_ids)))
+    for row, recipe_id in enumerate(recipe_ids):
+        for ingredient_id, quantity in vectors[recipe_id].items():
+            matrix[row, column[ingredient_id]] = float(quantity)
+
+    return RecipeMatrix(
+        recipe_ids,
+        ingredient_ids,
+        [bom.ingredient_names[pk] for pk in ingredient_ids],
+        matrix,
+    )
+
+
+def get_recipe_matrix(expand_bases=True):
+    """Return the RecipeMatrix of the catalog, built once per BOM generation."""
+    return cached(
+        f"recipe_matrix:{int(expand_bases)}",
+        CATALOG,
+        lambda: build_recipe_matrix(get_bom(), expand_bases),
+        BOM_TIMEOUT,
+    )
+
+
+def production_report(quantities, expand_bases=True):
+    """
+    Compute the ingredient demand of {recipe_id: kg} against current inventory.
+
+    Returns (requirements, shortages): every needed ingredient, and every
+    ingredient whose requirement exceeds the inventory, each as a list of
+    {"ingredient", "required", "available", "missing"} dicts.
+    """
+    recipe_matrix = get_recipe_matrix(expand_bases)
+    required = recipe_matrix.quantity_vector(quantities) @ recipe_matrix.matrix
+    available = recipe_matrix.inventory_vector()
+    missing = required - available
+
+    requirements = []
+    shortages = []
+    for index in np.flatnonzero(required > 0):
+        line = {
+            "ingredient": recipe_matrix.ingredient_names[index],
+            "required": round(float(required[index]), 2),
+            "available": round(float(available[index]), 2),
+            "missing": round(max(float(missing[index]), 0), 2),
+        }
+        requirements.append(line)
+        if missing[index] > EPSILON:
+            shortages.append(line)
+
+    return requirements, shortages
+
+
+def simplex_maximize(constraints, limits, weights, max_iterations=10000):
+    """
+    Maximize weights @ x subject to constraints @ x <= limits and x >= 0.
+
+    Small dense tableau simplex with Bland's rule (no cycling). limits must be
+    non-negative, so the slack variables give the starting basis, and every
+    column of constraints must have a positive entry, so the problem is bounded.
+
+    Returns (x, optimal): after max_iterations pivots without reaching the
+    optimum, x is the feasible but not optimal point reached and optimal False.
+    """
+    rows, columns = constraints.shape
+    tableau = np.zeros((rows + 1, columns + rows + 1))
+    tableau[:rows, :columns] = constraints
+    tableau[:rows, columns : columns + rows] = np.eye(rows)
+    tableau[:rows, -1] = limits
+    tableau[-1, :columns] = -weights
+    basis = list(range(columns, columns + rows))
+
+    for _ in range(max_iterations):
+        entering = np.flatnonzero(tableau[-1, :-1] < -EPSILON)
+        if not entering.size:
+            break
+        column = entering[0]
+
+        pivot_column = tableau[:rows, column]
+        candidates = np.flatnonzero(pivot_column > EPSILON)
+        ratios = tableau[candidates, -1] / pivot_column[candidates]
+        ties = candidates[ratios <= ratios.min() + EPSILON]
+        row = min(ties, key=lambda index: basis[index])
+
+        tableau[row] /= tableau[row, column]
+        for other in range(rows + 1):
+            if other != row and tableau[other, column]:
+                tableau[other] -= tableau[other, column] * tableau[row]
+        basis[row] = column
+
+    optimal = not (tableau[-1, :-1] < -EPSILON).any()
+    solution = np.zeros(columns)
+    for row, variable in enumerate(basis):
+        if variable < columns:
+            solution[variable] = tableau[row, -1]
+    return solution, optimal
+
+
+def floor_kg(value):
+    # Rounded down, so the plan never promises more than the inventory holds,
+    # after absorbing the float error of the divisions and the solver
+    # (3 kg must not become 2.99)
+    value = max(float(value), 0) + 1e-9
+    return float(Decimal(value).quantize(Decimal("0.01"), ROUND_FLOOR))
+
+
+def max_production(recipe_ids, expand_bases=True):
+    """
+    How much of each recipe the current inventory supports.
+
+    Returns ({recipe_id: {"alone": kg, "in_mix": kg}}, optimal): "alone" is the
+    maximum of the recipe if it were the only one produced, "in_mix" the
+    quantity in the mix of all given recipes that maximizes the total kg
+    produced while the recipes share the same ingredients. optimal is False
+    when the solver stopped before finding that best mix. Recipes without
+    ingredients are left out.
+    """
+    recipe_matrix = get_recipe_matrix(expand_bases)
+    rows = [
+        recipe_matrix.recipe_index[recipe_id]
+        for recipe_id in recipe_ids
+        if recipe_id in recipe_matrix.recipe_index
+        and recipe_matrix.matrix[recipe_matrix.recipe_index[recipe_id]].any()
+    ]
+    if not rows:
+        return {}, True
+
+    matrix = recipe_matrix.matrix[rows]
+    used = matrix.any(axis=0)
+    matrix = matrix[:, used]
+    available = np.clip(recipe_matrix.inventory_vector()[used], 0, None)
+
+    # Each recipe alone: the scarcest ingredient decides
+    with np.errstate(divide="ignore"):
+        ratios = np.where(matrix > 0, available / matrix, np.inf)
+    alone = ratios.min(axis=1)
+
+    in_mix, optimal = simplex_maximize(matrix.T, available, np.ones(len(rows)))
+
+    plan = {
+        recipe_matrix.recipe_ids[row]: {
+            "alone": floor_kg(alone[index]),
+            "in_mix": floor_kg(in_mix[index]),
+        }
+        for index, row in enumerate(rows)
+    }
+    return plan, optimal
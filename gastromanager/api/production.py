@@ -0,0 +1,240 @@
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .bom import direct_bom
+from .ledger import ensure_inventory, inventory_with_balance, record_inventory_movements
+from .stock import book_stock
+from .models import (
+    Ingredient,
+    IngredientInventory,
+    IceCreamProduction,
+    InventoryMovement,
+    Recipe,
+)
+
+
+CONTAINER_SIZES = [size for size, label in IceCreamProduction.CONTAINER_CHOICES]
+
+
+def to_decimal(value):
+    # Floats (container sizes) go through str() so 0.5 stays exactly 0.5
+    try:
+        result = Decimal(str(value))
+    except InvalidOperation:
+        raise ValidationError(f"{value} is not a valid number.")
+    # NaN and Infinity parse, but cannot be compared or stored
+    if not result.is_finite():
+        raise ValidationError(f"{value} is not a valid number.")
+    return result
+
+
+def production_multiplier(recipe, container_size, quantity_produced):
+    # Base recipes are produced by the kg, ice cream by containers of a given size
+    if recipe.is_base:
+        return to_decimal(quantity_produced)
+
+    if float(container_size) not in CONTAINER_SIZES:
+        raise ValidationError("Invalid container size selected")
+
+    return to_decimal(quantity_produced) * to_decimal(container_size)
+
+
+def lock_inventory(ingredient_ids):
+    # The inventory rows of the ingredients, locked for the rest of the
+    # transaction (in pk order, so concurrent bookings cannot deadlock), then
+    # their current balance in a second statement: under READ COMMITTED only a
+    # statement started after the lock sees the movements of the booking that
+    # held it. The rows are only used as a lock, the consumption itself is
+    # appended to the ledger.
+    locked = list(
+        IngredientInventory.objects.select_for_update()
+        .filter(ingredient_name__in=ingredient_ids)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    return inventory_with_balance(IngredientInventory.objects.filter(pk__in=locked))
+
+
+def check_availability(balance_rows, required):
+    # Collect every shortage instead of stopping at the first one
+    errors = []
+
+    for ingredient_id, (ingredient_name, required_quantity) in required.items():
+        row = balance_rows.get(ingredient_id)
+        current_quantity = row.balance if row is not None else 0
+        if current_quantity < required_quantity:
+            errors.append(
+                ValidationError(
+                    f"Ingredient {ingredient_name} is not available in sufficient "
+                    f"quantity. Current quantity: {current_quantity}, "
+                    f"Required quantity: {required_quantity}"
+                )
+            )
+
+    if errors:
+        raise ValidationError(errors)
+
+
+def credit_base_inventory(base_quantities, produced_by):
+    # A produced base becomes an ingredient of the same name for other recipes
+    base_ingredients = {}
+    for recipe, quantity in base_quantities.items():
+        base_ingredient, created = Ingredient.objects.get_or_create(
+            name=recipe.flavor, defaults={"unit_of_measurement": Ingredient.GRAMS}
+        )
+        base_ingredients[base_ingredient.pk] = quantity
+
+    ensure_inventory(base_ingredients.keys())
+    record_inventory_movements(
+        base_ingredients, InventoryMovement.PRODUCTION, produced_by
+    )
+
+
+def reserve_ingredients(multipliers, produced_by):
+    """
+    Check and consume the ingredients for {recipe_id: multiplier}.
+
+    The per-kg vectors come from the bill of materials, one level deep: a base
+    used by a recipe is taken from the base stock, not its ingredients. Only
+    the booked recipes are read, from the database rather than the cache, so a
+    recipe just edited in another process is booked as it is now.
+    Must run inside a transaction: the inventory rows stay locked until it ends.
+    """
+    bom = direct_bom(multipliers.keys())
+    required = bom.requirements(multipliers, expand_bases=False)
+    if not required:
+        return
+
+    balance_rows = {
+        row.ingredient_name_id: row for row in lock_inventory(required.keys())
+    }
+
+    check_availability(
+        balance_rows,
+        {
+            ingredient_id: (bom.ingredient_names[ingredient_id], quantity)
+            for ingredient_id, quantity in required.items()
+        },
+    )
+
+    record_inventory_movements(
+        {ingredient_id: -quantity for ingredient_id, quantity in required.items()},
+        InventoryMovement.PRODUCTION,
+        produced_by,
+    )
+
+
+def book_production(recipe, container_size, quantity_produced, produced_by):
+    """
+    Book one production of a recipe in a single transaction.
+
+    The inventory rows of every recipe ingredient are locked and loaded with
+    their balance in one query, checked, the consumption is appended to the
+    ledger with one INSERT and the IceCreamProduction row is written, so the
+    number of queries does not depend on the recipe size.
+    Raises ValidationError listing every missing ingredient.
+    """
+    quantity_produced = to_decimal(quantity_produced)
+    if quantity_produced <= 0:
+        raise ValidationError("Quantity produced must be a positive number.")
+
+    multiplier = production_multiplier(recipe, container_size, quantity_produced)
+
+    with transaction.atomic():
+        reserve_ingredients({recipe.pk: multiplier}, produced_by)
+
+        production = IceCreamProduction.objects.create(
+            recipe=recipe,
+            container_size=float(container_size),
+            quantity_produced=quantity_produced,
+            produced_by=produced_by,
+        )
+
+        if recipe.is_base:
+            credit_base_inventory({recipe: quantity_produced}, produced_by)
+
+    return production
+
+
+def parse_production_lines(lines):
+    """
+    Turn [{"recipe": id, "container_size": size, "quantity": n}, ...] into
+    (recipe, container_size, quantity) tuples, loading all recipes in one query.
+    """
+    if not isinstance(lines, list) or not lines:
+        raise ValidationError("At least one production line is required.")
+
+    try:
+        recipe_ids = {int(line["recipe"]) for line in lines}
+    except (KeyError, TypeError, ValueError):
+        raise ValidationError("Every production line needs a valid recipe id.")
+    recipes = Recipe.objects.in_bulk(recipe_ids)
+
+    parsed = []
+    errors = []
+    for number, line in enumerate(lines, start=1):
+        recipe = recipes.get(int(line["recipe"]))
+        if recipe is None:
+            errors.append(ValidationError(f"Line {number}: recipe does not exist."))
+            continue
+        try:
+            container_size = float(line.get("container_size"))
+        except (TypeError, ValueError):
+            errors.append(ValidationError(f"Line {number}: invalid container size."))
+            continue
+        parsed.append((recipe, container_size, to_decimal(line.get("quantity"))))
+
+    if errors:
+        raise ValidationError(errors)
+
+    return parsed
+
+
+def book_production_batch(lines, produced_by):
+    """
+    Book a whole production plan of (recipe, container_size, quantity) lines.
+
+    The ingredient demand of all lines is summed and checked against the
+    inventory once, the productions are written with bulk_create and the stock
+    movements are appended in one aggregated INSERT. Since bulk_create does not
+    send post_save, the stock is booked here instead of by the signal.
+    """
+    multipliers = {}
+    stock_totals = {}
+    base_totals = {}
+    for recipe, container_size, quantity in lines:
+        if quantity <= 0:
+            raise ValidationError("Quantity produced must be a positive number.")
+        multiplier = production_multiplier(recipe, container_size, quantity)
+        multipliers[recipe.pk] = multipliers.get(recipe.pk, 0) + multiplier
+
+        if recipe.is_base:
+            base_totals[recipe] = base_totals.get(recipe, 0) + quantity
+        else:
+            key = (recipe.pk, float(container_size))
+            stock_totals[key] = stock_totals.get(key, 0) + quantity
+
+    with transaction.atomic():
+        reserve_ingredients(multipliers, produced_by)
+
+        productions = IceCreamProduction.objects.bulk_create(
+            [
+                IceCreamProduction(
+                    recipe=recipe,
+                    container_size=float(container_size),
+                    quantity_produced=quantity,
+                    produced_by=produced_by,
+                )
+                for recipe, container_size, quantity in lines
+            ]
+        )
+
+        if stock_totals:
+            book_stock(stock_totals, produced_by)
+
+        if base_totals:
+            credit_base_inventory(base_totals, produced_by)
+
+    return productions
@@ -0,0 +1,416 @@
+import json
+import logging
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+
+import cv2
+from pyzbar.pyzbar import ZBarSymbol, decode
+
+logger = logging.getLogger(__name__)
+
+
+# Badge scanner of a clock terminal (management command run_qr_scanner).
+#
+# Runs in its own process next to the camera, never in a web worker: the main
+# thread owns the camera and only reads frames into a small bounded queue
+# (when the decoders fall behind, the oldest frame is dropped, so they always
+# work on recent frames). A few decoding threads turn each frame to grayscale,
+# crop and downscale it and decode the QR codes; zbar runs without the GIL, so
+# the threads decode in parallel. A badge read again within the debounce delay
+# is ignored, the others are queued for a sender thread that calls on_badge,
+# which books the clock event (see ClockClient): a slow server holds up the
+# sender, never the decoding.
+
+
+class Debouncer:
+    """Let a badge through once, then again only after `seconds` without it."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.last_seen = {}
+        self.lock = threading.Lock()
+
+    def accept(self, badge, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            last = self.last_seen.get(badge)
+            # Every read extends the window: a badge held in front of the
+            # camera is booked once
+            self.last_seen[badge] = now
+            if len(self.last_seen) > 1000:
+                self.last_seen = {
+                    key: seen
+                    for key, seen in self.last_seen.items()
+                    if now - seen < self.seconds
+                }
+        return last is None or now - last >= self.seconds
+
+
+class AdaptiveWidth:
+    """
+    Width the frames are downscaled to before decoding.
+
+    Shrinks when the decode latency is over budget and grows back, up to
+    max_width, when there is room, so slow terminals keep up with the camera.
+    """
+
+    def __init__(self, max_width=640, min_width=320, budget=0.03):
+        self.max_width = max_width
+        self.min_width = min(min_width, max_width)
+        self.budget = budget
+        self.width = max_width
+        self.average = None
+        self.lock = threading.Lock()
+
+    def update(self, latency):
+        with self.lock:
+            # Exponential moving average of the decode latency
+            if self.average is None:
+                self.average = latency
+            else:
+                self.average = 0.8 * self.average + 0.2 * latency
+            if self.average > self.budget:
+                self.width = max(self.min_width, int(self.width * 0.8))
+            elif self.average < self.budget / 2:
+                self.width = min(self.max_width, int(self.width * 1.1) + 1)
+            return self.width
+
+
+def region_of_interest(frame, roi=1.0, max_width=640):
+    # Grayscale, centered crop of roi of each side, at most max_width wide
+    if frame.ndim == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    height, width = frame.shape[:2]
+    if roi < 1:
+        crop_height, crop_width = int(height * roi), int(width * roi)
+        top, left = (height - crop_height) // 2, (width - crop_width) // 2
+        frame = frame[top : top + crop_height, left : left + crop_width]
+        height, width = crop_height, crop_width
+    if width > max_width:
+        frame = cv2.resize(
+            frame,
+            (max_width, int(height * max_width / width)),
+            interpolation=cv2.INTER_AREA,
+        )
+    return frame
+
+
+def decode_badges(frame):
+    return [
+        symbol.data.decode("utf-8")
+        for symbol in decode(frame, symbols=[ZBarSymbol.QRCODE])
+    ]
+
+
+class ScanMetrics:
+    """Frame counters, decode latency and frames per second of a pipeline."""
+
+    def __init__(self, window=200):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.submitted = 0
+        self.dropped = 0
+        self.decoded = 0
+        self.badges = 0
+        # Latencies of the last `window` decoded frames, in seconds
+        self.latencies = deque(maxlen=window)
+
+    def count(self, name, number=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + number)
+
+    def record(self, latency, badges):
+        with self.lock:
+            self.decoded += 1
+            self.badges += badges
+            self.latencies.append(latency)
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            latencies = sorted(self.latencies)
+            decoded = self.decoded
+
+            def percentile(fraction):
+                if not latencies:
+                    return None
+                index = min(len(latencies) - 1, int(fraction * len(latencies)))
+                return round(latencies[index] * 1000, 2)
+
+            return {
+                "submitted": self.submitted,
+                "dropped": self.dropped,
+                "decoded": decoded,
+                "badges": self.badges,
+                "fps": round(decoded / elapsed, 1) if elapsed else 0.0,
+                "latency_p50_ms": percentile(0.5),
+                "latency_p95_ms": percentile(0.95),
+            }
+
+
+class DecodePipeline:
+    """
+    Decode frames on `workers` threads from a bounded queue.
+
+    submit() never blocks: when the queue is full the oldest frame is dropped.
+    on_badges(badges) is called from the worker threads for every frame.
+    """
+
+    def __init__(
+        self,
+        on_badges,
+        workers=2,
+        roi=1.0,
+        width=None,
+        queue_size=None,
+        preprocess=True,
+    ):
+        self.on_badges = on_badges
+        self.roi = roi
+        # False decodes the frames as they come, e.g. to compare in a benchmark
+        self.preprocess = preprocess
+        self.width = width or AdaptiveWidth()
+        self.metrics = ScanMetrics()
+        self.frames = queue.Queue(maxsize=queue_size or workers)
+        self.stopped = threading.Event()
+        self.threads = [
+            threading.Thread(target=self.work, name=f"qr-decoder-{index}", daemon=True)
+            for index in range(workers)
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def submit(self, frame):
+        self.metrics.count("submitted")
+        while True:
+            try:
+                self.frames.put_nowait(frame)
+                return
+            except queue.Full:
+                pass
+            # Make room by dropping the stalest frame
+            try:
+                self.frames.get_nowait()
+                self.frames.task_done()
+                self.metrics.count("dropped")
+            except queue.Empty:
+                pass
+
+    def work(self):
+        while not self.stopped.is_set():
+            try:
+                frame = self.frames.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self.decode(frame)
+            except Exception:
+                logger.exception("Could not decode frame")
+            finally:
+                self.frames.task_done()
+
+    def decode(self, frame):
+        started = time.perf_counter()
+        if self.preprocess:
+            frame = region_of_interest(frame, self.roi, self.width.width)
+        badges = decode_badges(frame)
+        latency = time.perf_counter() - started
+        self.width.update(latency)
+        self.metrics.record(latency, len(badges))
+        if badges:
+            self.on_badges(badges)
+
+    def join(self):
+        """Wait until every queued frame is decoded."""
+        self.frames.join()
+
+    def stop(self):
+        self.stopped.set()
+        for thread in self.threads:
+            if thread.is_alive():
+                thread.join()
+
+
+class BadgeSender:
+    """
+    Calls send(badge) for every submitted badge, one at a time, on a thread of
+    its own. submit() never blocks: when `queue_size` badges are waiting, the
+    badge is dropped and logged.
+    """
+
+    def __init__(self, send, queue_size=100):
+        self.send = send
+        self.badges = queue.Queue(maxsize=queue_size)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self.work, name="badge-sender", daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, badge):
+        try:
+            self.badges.put_nowait(badge)
+        except queue.Full:
+            logger.error("Too many badges waiting, badge %s not booked", badge)
+
+    def work(self):
+        # The badges still queued when stopped are sent before leaving
+        while not (self.stopped.is_set() and self.badges.empty()):
+            try:
+                badge = self.badges.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self.send(badge)
+            except Exception:
+                logger.exception("Could not book badge %s", badge)
+            finally:
+                self.badges.task_done()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+
+class BadgeScanner:
+    def __init__(
+        self,
+        on_badge,
+        camera=0,
+        every=3,
+        roi=1.0,
+        max_width=640,
+        debounce=5.0,
+        workers=2,
+        stats_every=None,
+    ):
+        self.sender = BadgeSender(on_badge)
+        self.camera = camera
+        # Only every n-th frame is decoded
+        self.every = max(every, 1)
+        self.debouncer = Debouncer(debounce)
+        self.pipeline = DecodePipeline(
+            self.on_badges,
+            workers=workers,
+            roi=roi,
+            width=AdaptiveWidth(max_width, min_width=max_width // 2),
+        )
+        # Seconds between two metrics log lines, None for none
+        self.stats_every = stats_every
+        self.stopped = threading.Event()
+
+    def on_badges(self, badges):
+        for badge in badges:
+            if self.debouncer.accept(badge):
+                self.sender.submit(badge)
+
+    def run(self):
+        """Read the camera until stop() is called (or the camera fails)."""
+        capture = cv2.VideoCapture(self.camera)
+        if not capture.isOpened():
+            raise RuntimeError(f"Cannot open camera {self.camera}")
+
+        self.sender.start()
+        self.pipeline.start()
+        last_stats = time.monotonic()
+        try:
+            count = 0
+            while not self.stopped.is_set():
+                ok, frame = capture.read()
+                if not ok:
+                    logger.warning("Camera %s returned no frame", self.camera)
+                    break
+                count += 1
+                if count % self.every == 0:
+                    self.pipeline.submit(frame)
+                if (
+                    self.stats_every
+                    and time.monotonic() - last_stats >= self.stats_every
+                ):
+                    logger.info("QR scanner: %s", self.pipeline.metrics.snapshot())
+                    last_stats = time.monotonic()
+        finally:
+            self.stopped.set()
+            capture.release()
+            self.pipeline.stop()
+            self.sender.stop()
+
+    def stop(self):
+        self.stopped.set()
+
+
+def benchmark(frames, workers=2, roi=1.0, max_width=640, raw=False):
+    """
+    Replay frames (numpy images) through a DecodePipeline as fast as possible.
+
+    Nothing is dropped: each frame waits for a free slot. With raw=True the
+    frames are decoded as they are, without grayscale or downscaling, for
+    comparison. Returns the metrics snapshot and the decoded badges.
+    """
+    found = []
+    lock = threading.Lock()
+
+    def on_badges(badges):
+        with lock:
+            found.extend(badges)
+
+    pipeline = DecodePipeline(
+        on_badges,
+        workers=workers,
+        roi=roi,
+        width=AdaptiveWidth(max_width, min_width=max_width // 2),
+        preprocess=not raw,
+    )
+    pipeline.start()
+    for frame in frames:
+        pipeline.metrics.count("submitted")
+        pipeline.frames.put(frame)
+    pipeline.join()
+    metrics = pipeline.metrics.snapshot()
+    pipeline.stop()
+    return metrics, found
+
+
+class ClockClient:
+    """
+    Posts a badge to the clock endpoint of the web application, giving up
+    after `timeout` seconds without an answer.
+    """
+
+    def __init__(self, url, token, timeout=5):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+
+    def __call__(self, badge):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({"badge": badge}).encode(),
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Token {self.token}",
+            },
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as error:
+            # 400 for an unknown badge, with the reason in the body
+            try:
+                return json.load(error)
+            except ValueError:
+                return {"error": f"HTTP {error.code}"}
+        except (urllib.error.URLError, TimeoutError) as error:
+            # Unreachable or too slow: logged, the scanner goes on
+            return {"error": str(error)}
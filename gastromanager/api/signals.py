@@ -1,23 +1,70 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
-from .models import IceCreamProduction, StockItem
+from .badges import forget_badge
+from .caching import changed
+from .ledger import ensure_inventory, record_inventory_movements
+from .models import (
+    IceCreamProduction,
+    Ingredient,
+    IngredientIncoming,
+    IngredientInventory,
+    InventoryMovement,
+    Recipe,
+    RecipeIngredient,
+    StockItem,
+    UserProfile,
+)
+from .stock import book_stock
 
 
-"""@receiver(post_save, sender=IngredientIncoming)
+@receiver(post_save, sender=IngredientIncoming)
 def update_inventory(sender, instance, created, **kwargs):
     if created:
-        # Update or create the inventory entry for the received ingredient
-        IngredientInventory.update_or_create_inventory(
-            instance.ingredient, instance.quantity
-        )"""
+        # Append the received ingredient to the inventory ledger
+        ensure_inventory([instance.ingredient_id])
+        record_inventory_movements(
+            {instance.ingredient_id: instance.quantity},
+            InventoryMovement.INCOMING,
+            instance.received_by,
+        )
 
 
 @receiver(post_save, sender=IceCreamProduction)
 def update_stock_on_production(sender, instance, created, **kwargs):
-    if created:
-        stock_item, created = StockItem.objects.get_or_create(
-            recipe=instance.recipe, size=instance.container_size
+    # The only stock hook for productions: appends the produced ice cream.
+    # Bases are stocked as ingredients (see production.credit_base_inventory).
+    if created and not instance.recipe.is_base:
+        book_stock(
+            {(instance.recipe_id, instance.container_size): instance.quantity_produced},
+            instance.produced_by,
         )
-        stock_item.quantity += instance.quantity_produced
-        stock_item.added_by = instance.produced_by
-        stock_item.save()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+@receiver(post_save, sender=StockItem)
+@receiver(post_delete, sender=StockItem)
+@receiver(post_save, sender=IngredientInventory)
+@receiver(post_delete, sender=IngredientInventory)
+def invalidate_derived_data(sender, instance, **kwargs):
+    # Cached BOM, recipe lists, stock tables, ... computed from this model
+    changed(sender)
+
+
+@receiver(pre_save, sender=UserProfile)
+def forget_badge_on_rename(sender, instance, update_fields=None, **kwargs):
+    # The badge shows the username: drop the cached one of the old name
+    if instance.pk is None or (update_fields and "username" not in update_fields):
+        return
+    old_username = (
+        UserProfile.objects.filter(pk=instance.pk)
+        .values_list("username", flat=True)
+        .first()
+    )
+    if old_username is not None and old_username != instance.username:
+        transaction.on_commit(lambda: forget_badge(old_username, instance.pk))
@@ -0,0 +1,107 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import ExpressionWrapper, F
+
+from .ledger import QUANTITY_FIELD, record_stock_movements, stock_with_balance
+from .models import IceCreamProduction, IceCreamStockTakeOut, StockItem, StockMovement
+
+
+def book_stock(stock_totals, added_by):
+    """
+    Add {(recipe_id, size): quantity} of produced ice cream to the stock.
+
+    Only inserts: the missing (recipe, size) rows are created (existing ones are
+    left untouched thanks to the unique constraint) and the quantities are
+    appended to the stock ledger, so concurrent productions never contend for
+    the same row.
+    """
+    if not stock_totals:
+        return
+
+    StockItem.objects.bulk_create(
+        [
+            StockItem(
+                recipe_id=recipe_id, size=float(size), quantity=0, added_by=added_by
+            )
+            for recipe_id, size in stock_totals
+        ],
+        ignore_conflicts=True,
+    )
+    record_stock_movements(stock_totals, StockMovement.PRODUCTION, added_by)
+
+
+def take_out_stock(stock_item_id, quantity_moved, date_moved, moved_by):
+    """
+    Take ice cream out of stock, checking the current balance under a row lock.
+    """
+    if quantity_moved <= 0:
+        raise ValidationError("Must be positive number")
+
+    with transaction.atomic():
+        # Locked first, then the balance read in a statement of its own, which
+        # sees the takeouts committed while this one waited for the lock
+        list(
+            StockItem.objects.select_for_update()
+            .filter(pk=stock_item_id)
+            .values_list("pk", flat=True)
+        )
+        stock_item = stock_with_balance().select_related("recipe").get(pk=stock_item_id)
+        if stock_item.balance < quantity_moved:
+            raise ValidationError("Not enough in Stock")
+
+        production = (
+            IceCreamProduction.objects.filter(
+                recipe=stock_item.recipe, container_size=stock_item.size
+            )
+            .order_by("-date_produced")
+            .first()
+        )
+        if production is None:
+            raise ValidationError("No production registered for this stock item")
+
+        # Register the stock movement
+        takeout = IceCreamStockTakeOut.objects.create(
+            ice_cream_production=production,
+            quantity_moved=quantity_moved,
+            date_moved=date_moved,
+            moved_by=moved_by,
+        )
+        record_stock_movements(
+            {(stock_item.recipe_id, stock_item.size): -quantity_moved},
+            StockMovement.TAKEOUT,
+            moved_by,
+        )
+
+    return takeout
+
+
+# Orderings of the stock overview, by the name of the ?sort= parameter
+STOCK_SORTS = {
+    "flavor": ["recipe__flavor", "size"],
+    "size": ["size", "recipe__flavor"],
+    "balance": ["balance", "recipe__flavor", "size"],
+    "-balance": ["-balance", "recipe__flavor", "size"],
+    "litres": ["litres", "recipe__flavor", "size"],
+    "-litres": ["-litres", "recipe__flavor", "size"],
+}
+
+
+def stock_overview(sort="flavor", flavor=None, size=None, in_stock=False):
+    """
+    Balance and litres of every flavor and size, filtered and sorted by the
+    database in one query, as dicts with recipe_id, flavor, size, balance
+    and litres.
+    """
+    rows = stock_with_balance().annotate(
+        flavor=F("recipe__flavor"),
+        litres=ExpressionWrapper(F("balance") * F("size"), output_field=QUANTITY_FIELD),
+    )
+    if flavor:
+        rows = rows.filter(recipe__flavor__icontains=flavor)
+    if size is not None:
+        rows = rows.filter(size=size)
+    if in_stock:
+        rows = rows.filter(balance__gt=0)
+    return rows.order_by(*STOCK_SORTS[sort]).values(
+        "recipe_id", "flavor", "size", "balance", "litres"
+    )
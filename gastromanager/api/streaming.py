@@ -0,0 +1,33 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+
+# JSON arrays written while the rows are read, for endpoints returning long
+# lists: with a queryset .iterator() only one chunk of rows is in memory.
+
+CHUNK_SIZE = 500
+
+
+def json_array(rows, chunk_size=CHUNK_SIZE):
+    # "[", then the encoded rows chunk_size at a time, then "]"
+    encoder = DjangoJSONEncoder()
+    yield "["
+    chunk = []
+    separator = ""
+    for row in rows:
+        chunk.append(separator + encoder.encode(row))
+        separator = ","
+        if len(chunk) >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+    yield "]"
+
+
+class StreamingJsonResponse(StreamingHttpResponse):
+    """Stream an iterable of JSON-serializable rows as one JSON array."""
+
+    def __init__(self, rows, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(json_array(rows), **kwargs)
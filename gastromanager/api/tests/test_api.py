@@ -1,12 +1,26 @@
 import pytest
+from asgiref.sync import async_to_sync
 from datetime import timedelta
+import asyncio
+import io
+import json
 import os
+import threading
+import time
+import zipfile
+from unittest import mock, skipUnless
+
+import numpy as np
 
 from django.utils import timezone
-from django.test import Client, TestCase
-from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.contrib import admin
 from api.models import (
     Ingredient,
     IngredientInventory,
@@ -19,7 +33,11 @@ from api.models import (
 )
 from django.test import Client
 
-from api.forms import RecipeForm, ProductionCalculatorForm
+from api.forms import (
+    RecipeForm,
+    ProductionCalculatorForm,
+    IngredientInventoryUpdateForm,
+)
 from api.models import (
     Ingredient,
     IngredientInventory,
@@ -32,6 +50,38 @@ from api.models import (
     UserProfile,
     WorkingHours,
     EmployeeBadge,
+    InventoryMovement,
+    InventorySnapshot,
+    Journal,
+    StockMovement,
+)
+from api import badges, caching, events, production, stock
+from api.bom import get_bom
+from api.journal import JournalWriter, search_journal
+from api.pagination import keyset_page
+from api.working_hours import worked_time
+from api.stock import book_stock, stock_overview, take_out_stock
+from api.clock import CLOCK_IN, CLOCK_OUT, DUPLICATE, clock
+from api.scanner import (
+    AdaptiveWidth,
+    BadgeSender,
+    Debouncer,
+    benchmark,
+    region_of_interest,
+)
+from api.partitions import expired_partitions, partition_month, partition_name
+from api.ledger import (
+    inventory_as_of,
+    inventory_with_balance,
+    stock_as_of,
+    stock_with_balance,
+    take_snapshot,
+)
+from api.planning import max_production, production_report, simplex_maximize
+from api.production import (
+    book_production,
+    book_production_batch,
+    parse_production_lines,
 )
 
 
@@ -102,8 +152,8 @@ def test_ingredient_inventory_update_on_incoming(create_ingredient):
     initial_quantity = 0
     incoming_quantity = 100
     IngredientInventory.update_or_create_inventory(ingredient, incoming_quantity)
-    updated_inventory = IngredientInventory.objects.get(ingredient_name=ingredient)
-    assert updated_inventory.quantity == initial_quantity + incoming_quantity
+    updated_inventory = inventory_with_balance().get(ingredient_name=ingredient)
+    assert updated_inventory.balance == initial_quantity + incoming_quantity
 
 
 # Production and Inventory Test: Check ice cream production and inventory update.
@@ -402,21 +452,100 @@ def test_insufficient_stock_takeout(create_stock_item, create_user, client):
     # This test checks that attempting to take more stock quantity than what is available raises a validation error.
 
 
+# Rendered badges in memory instead of in BASE_DIR/badge_cache
+BADGE_TEST_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "badges": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "badges",
+    },
+}
+
+
+@override_settings(CACHES=BADGE_TEST_CACHES)
 class EmployeeBadgeTest(TestCase):
+    def setUp(self):
+        caches["badges"].clear()
+
     def test_generate_badge(self):
         employee = EmployeeBadge(employee_name="John Doe", employee_id=12345)
         employee.save()
 
-        badge_file = employee.generate_badge()
+        badge = employee.generate_badge()
 
-        self.assertIsNotNone(badge_file)
-        os.remove(badge_file)
+        # PNG bytes, rendered without touching the disk
+        self.assertTrue(badge.startswith(b"\x89PNG"))
+        self.assertEqual(employee.badge_filename(), "John_Doe_Badge.png")
 
         logo_path = "api/media/green_scoop.png"
         self.assertTrue(os.path.isfile(logo_path))
 
+    def test_badge_download(self):
+        employee = UserProfile.objects.create(username="anna")
+        self.client.force_login(employee)
+
+        response = self.client.post(
+            reverse("badge_maker"), {"employee_id": employee.pk}
+        )
+
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertIn("anna_Badge.png", response["Content-Disposition"])
+        self.assertTrue(response.content.startswith(b"\x89PNG"))
+
+        # Only the own badge, and an unknown id is not found
+        response = self.client.post(reverse("badge_maker"), {"employee_id": 0})
+        self.assertEqual(response.status_code, 403)
+        manager = UserProfile.objects.create(username="manager", level="Manager")
+        self.client.force_login(manager)
+        response = self.client.post(reverse("badge_maker"), {"employee_id": 0})
+        self.assertEqual(response.status_code, 404)
+
         employee.delete()
 
+    @override_settings(LOGIN_URL="/login/")
+    def test_badge_download_needs_a_login(self):
+        employee = UserProfile.objects.create(username="anna")
+
+        response = self.client.post(
+            reverse("badge_maker"), {"employee_id": employee.pk}
+        )
+
+        self.assertEqual(response.status_code, 302)
+
+    def test_repeat_download_is_not_modified(self):
+        employee = UserProfile.objects.create(username="anna")
+        self.client.force_login(employee)
+        url = reverse("employee_badge", args=[employee.pk])
+
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertTrue(response.content.startswith(b"\x89PNG"))
+
+        with mock.patch.object(badges, "badge_png") as render:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        render.assert_not_called()
+
+        # Someone else's badge is for managers only
+        self.assertEqual(
+            self.client.get(
+                reverse("employee_badge", args=[employee.pk + 1])
+            ).status_code,
+            403,
+        )
+
+    def test_rename_invalidates_badge(self):
+        employee = UserProfile.objects.create(username="anna")
+        old_key = badges.cache_key("anna", employee.pk)
+        badges.cached_badge("anna", employee.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            employee.username = "anna maria"
+            employee.save()
+
+        self.assertIsNone(caches["badges"].get(old_key))
+        self.assertNotEqual(old_key, badges.cache_key("anna maria", employee.pk))
+
 
 class WorkingHoursTest(TestCase):
     def setUp(self):
@@ -449,3 +578,1222 @@ class WorkingHoursTest(TestCase):
         )
 
         self.assertIsNone(working_hours.recorded_time())
+
+
+class ProductionBookingTest(TestCase):
+    def setUp(self):
+        self.user = UserProfile.objects.create(username="producer", password="password")
+
+    def create_recipe(self, flavor, ingredient_count, stock=1000, is_base=False):
+        recipe = Recipe.objects.create(flavor=flavor, is_base=is_base)
+        for number in range(ingredient_count):
+            ingredient = Ingredient.objects.create(name=f"{flavor} ingredient {number}")
+            IngredientInventory.objects.create(
+                ingredient_name=ingredient, quantity=stock
+            )
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=ingredient, quantity=10
+            )
+        StockItem.objects.create(recipe=recipe, size=3, quantity=0, added_by=self.user)
+        return recipe
+
+    def test_book_production_consumes_inventory(self):
+        recipe = self.create_recipe("Vanilla", 2)
+
+        production = book_production(recipe, "3", "2", self.user)
+
+        self.assertEqual(production.quantity_produced, 2)
+        for inventory in inventory_with_balance():
+            self.assertEqual(inventory.balance, 1000 - 10 * 2 * 3)
+
+    def test_book_production_reports_every_shortage(self):
+        recipe = self.create_recipe("Mango", 3, stock=5)
+
+        with self.assertRaises(ValidationError) as error:
+            book_production(recipe, 3, 1, self.user)
+
+        self.assertEqual(len(error.exception.messages), 3)
+        self.assertFalse(IceCreamProduction.objects.exists())
+        for inventory in inventory_with_balance():
+            self.assertEqual(inventory.balance, 5)
+
+    def test_book_production_query_count_does_not_grow_with_recipe(self):
+        small_recipe = self.create_recipe("Lemon", 2)
+        large_recipe = self.create_recipe("Tiramisu", 20)
+        get_bom()
+
+        with CaptureQueriesContext(connection) as small:
+            book_production(small_recipe, 3, 1, self.user)
+        with CaptureQueriesContext(connection) as large:
+            book_production(large_recipe, 3, 1, self.user)
+
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_book_production_ignores_a_stale_cached_bom(self):
+        recipe = self.create_recipe("Banana", 1)
+        get_bom()
+        # Edited without signals, as seen from a process whose cache is stale
+        RecipeIngredient.objects.filter(recipe=recipe).update(quantity=20)
+
+        book_production(recipe, 3, 1, self.user)
+
+        self.assertEqual(inventory_with_balance().get().balance, 1000 - 20 * 3)
+
+    def test_book_production_ignores_a_loop_between_other_bases(self):
+        recipe = self.create_recipe("Coconut", 1)
+        first = self.create_recipe("First Base", 0, is_base=True)
+        second = self.create_recipe("Second Base", 0, is_base=True)
+        RecipeIngredient.objects.create(
+            recipe=first,
+            ingredient=Ingredient.objects.create(name="Second Base"),
+            quantity=1,
+        )
+        RecipeIngredient.objects.create(
+            recipe=second,
+            ingredient=Ingredient.objects.create(name="First Base"),
+            quantity=1,
+        )
+
+        book_production(recipe, 3, 1, self.user)
+
+        self.assertEqual(
+            inventory_with_balance()
+            .get(ingredient_name__name="Coconut ingredient 0")
+            .balance,
+            1000 - 10 * 3,
+        )
+
+    def test_book_base_production_credits_base_inventory(self):
+        recipe = self.create_recipe("Milk Base", 1, is_base=True)
+
+        book_production(recipe, 3, 4, self.user)
+
+        base_inventory = inventory_with_balance().get(ingredient_name__name="Milk Base")
+        self.assertEqual(base_inventory.balance, 4)
+
+    def test_book_production_batch_aggregates_stock(self):
+        recipe = self.create_recipe("Pistachio", 2)
+        lines = parse_production_lines(
+            [
+                {"recipe": recipe.pk, "container_size": 3, "quantity": 1},
+                {"recipe": recipe.pk, "container_size": 3, "quantity": 2},
+                {"recipe": recipe.pk, "container_size": 0.5, "quantity": 4},
+            ]
+        )
+
+        productions = book_production_batch(lines, self.user)
+
+        self.assertEqual(len(productions), 3)
+        self.assertEqual(stock_with_balance().get(recipe=recipe, size=3).balance, 3)
+        self.assertEqual(stock_with_balance().get(recipe=recipe, size=0.5).balance, 4)
+        for inventory in inventory_with_balance():
+            self.assertEqual(inventory.balance, 1000 - 10 * (3 * 3 + 4 * 0.5))
+
+    def test_book_production_batch_rejects_whole_plan_on_shortage(self):
+        recipe = self.create_recipe("Hazelnut", 1, stock=50)
+        lines = parse_production_lines(
+            [
+                {"recipe": recipe.pk, "container_size": 3, "quantity": 1},
+                {"recipe": recipe.pk, "container_size": 3, "quantity": 1},
+            ]
+        )
+
+        with self.assertRaises(ValidationError):
+            book_production_batch(lines, self.user)
+
+        self.assertFalse(IceCreamProduction.objects.exists())
+        self.assertEqual(inventory_with_balance().get().balance, 50)
+
+    def test_production_batch_view(self):
+        recipe = self.create_recipe("Stracciatella", 1)
+        client = Client()
+        client.force_login(self.user)
+
+        response = client.post(
+            reverse("production_batch"),
+            data=json.dumps(
+                {"lines": [{"recipe": recipe.pk, "container_size": 6, "quantity": 2}]}
+            ),
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {"booked": 1})
+
+    def test_non_finite_quantities_are_rejected(self):
+        recipe = self.create_recipe("Cherry", 1)
+
+        for quantity in ["NaN", "Infinity", "-inf", "sNaN"]:
+            with self.assertRaises(ValidationError):
+                book_production(recipe, 3, quantity, self.user)
+
+        self.assertFalse(IceCreamProduction.objects.exists())
+
+    def test_production_batch_view_rejects_non_finite_quantity(self):
+        recipe = self.create_recipe("Melon", 1)
+        client = Client()
+        client.force_login(self.user)
+
+        response = client.post(
+            reverse("production_batch"),
+            data=json.dumps(
+                {
+                    "lines": [
+                        {"recipe": recipe.pk, "container_size": 3, "quantity": "NaN"}
+                    ]
+                }
+            ),
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(IceCreamProduction.objects.exists())
+
+
+class BillOfMaterialsTest(TestCase):
+    def add(self, recipe, ingredient, quantity):
+        return RecipeIngredient.objects.create(
+            recipe=recipe, ingredient=ingredient, quantity=quantity
+        )
+
+    def setUp(self):
+        self.milk = Ingredient.objects.create(name="Milk")
+        self.sugar = Ingredient.objects.create(name="Sugar")
+        self.cocoa = Ingredient.objects.create(name="Cocoa")
+
+        # White Base -> Chocolate Base -> Chocolate ice cream
+        self.white_base = Recipe.objects.create(flavor="White Base", is_base=True)
+        self.add(self.white_base, self.milk, 2)
+        self.add(self.white_base, self.sugar, 1)
+
+        self.chocolate_base = Recipe.objects.create(
+            flavor="Chocolate Base", is_base=True
+        )
+        self.add(self.chocolate_base, Ingredient.objects.create(name="White Base"), 1)
+        self.add(self.chocolate_base, self.cocoa, 3)
+
+        self.chocolate = Recipe.objects.create(flavor="Chocolate")
+        self.add(self.chocolate, Ingredient.objects.create(name="Chocolate Base"), 2)
+        self.add(self.chocolate, self.sugar, 1)
+
+    def test_bases_are_expanded_recursively(self):
+        vector = get_bom().vector(self.chocolate.pk)
+
+        self.assertEqual(vector, {self.milk.pk: 4, self.sugar.pk: 3, self.cocoa.pk: 6})
+
+    def test_direct_vector_keeps_bases(self):
+        vector = get_bom().vector(self.chocolate.pk, expand_bases=False)
+
+        self.assertEqual(len(vector), 2)
+        self.assertEqual(vector[self.sugar.pk], 1)
+
+    def test_bom_is_cached_and_invalidated_on_recipe_change(self):
+        get_bom()
+        with self.assertNumQueries(0):
+            get_bom()
+
+        self.add(self.white_base, self.cocoa, 1)
+
+        self.assertEqual(get_bom().vector(self.chocolate.pk)[self.cocoa.pk], 8)
+
+
+@skipUnless(connection.vendor == "postgresql", "Needs concurrent transactions")
+class ConcurrentBookingTest(TransactionTestCase):
+    def setUp(self):
+        self.user = UserProfile.objects.create(username="producer")
+        self.recipe = Recipe.objects.create(flavor="Vanilla")
+        self.milk = Ingredient.objects.create(name="Milk")
+        IngredientInventory.objects.create(ingredient_name=self.milk, quantity=50)
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, ingredient=self.milk, quantity=10
+        )
+
+    def run_concurrently(self, first, second, slow_down):
+        # The first booking holds its locks a while; the second one waits for
+        # them and must see what the first one committed
+        errors = []
+
+        def run(book):
+            try:
+                book()
+            except ValidationError as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        target, original = slow_down
+
+        def slow(*args, **kwargs):
+            time.sleep(0.3)
+            return original(*args, **kwargs)
+
+        with mock.patch(target, slow):
+            threads = [
+                threading.Thread(target=run, args=[book]) for book in (first, second)
+            ]
+            threads[0].start()
+            time.sleep(0.1)
+            threads[1].start()
+            for thread in threads:
+                thread.join()
+        return errors
+
+    def test_concurrent_productions_cannot_overdraw_the_inventory(self):
+        # 30 of the 50 milk each
+        def book():
+            book_production(self.recipe, 3, 1, self.user)
+
+        errors = self.run_concurrently(
+            book,
+            book,
+            ("api.production.check_availability", production.check_availability),
+        )
+
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(inventory_with_balance().get().balance, 20)
+
+    def test_concurrent_takeouts_cannot_overdraw_the_stock(self):
+        book_production(self.recipe, 3, 1, self.user)
+        stock_item = StockItem.objects.get()
+
+        def take_out():
+            take_out_stock(stock_item.pk, 1, timezone.now(), self.user)
+
+        errors = self.run_concurrently(
+            take_out,
+            take_out,
+            ("api.stock.record_stock_movements", stock.record_stock_movements),
+        )
+
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(stock_with_balance().get().balance, 0)
+
+    def test_correction_during_a_production_keeps_the_counted_quantity(self):
+        form = IngredientInventoryUpdateForm(
+            {"ingredient_name": self.milk.pk, "quantity": 40}
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+
+        # The production consumes 30 while the correction waits for the lock:
+        # the correction then books the difference to the balance after it
+        errors = self.run_concurrently(
+            lambda: book_production(self.recipe, 3, 1, self.user),
+            lambda: form.save(corrected_by=self.user),
+            ("api.production.check_availability", production.check_availability),
+        )
+
+        self.assertEqual(errors, [])
+        self.assertEqual(inventory_with_balance().get().balance, 40)
+
+
+class ProductionPlanningTest(TestCase):
+    def setUp(self):
+        self.milk = Ingredient.objects.create(name="Milk")
+        self.sugar = Ingredient.objects.create(name="Sugar")
+        IngredientInventory.objects.create(ingredient_name=self.milk, quantity=100)
+        IngredientInventory.objects.create(ingredient_name=self.sugar, quantity=10)
+
+        self.vanilla = Recipe.objects.create(flavor="Vanilla")
+        RecipeIngredient.objects.create(
+            recipe=self.vanilla, ingredient=self.milk, quantity=5
+        )
+        RecipeIngredient.objects.create(
+            recipe=self.vanilla, ingredient=self.sugar, quantity=1
+        )
+        self.lemon = Recipe.objects.create(flavor="Lemon")
+        RecipeIngredient.objects.create(
+            recipe=self.lemon, ingredient=self.sugar, quantity=2
+        )
+
+    def test_report_lists_every_shortage(self):
+        requirements, shortages = production_report(
+            {self.vanilla.pk: 30, self.lemon.pk: 5}
+        )
+
+        self.assertEqual(len(requirements), 2)
+        self.assertEqual(
+            shortages,
+            [
+                {
+                    "ingredient": "Milk",
+                    "required": 150,
+                    "available": 100,
+                    "missing": 50,
+                },
+                {"ingredient": "Sugar", "required": 40, "available": 10, "missing": 30},
+            ],
+        )
+
+    def test_report_without_shortages(self):
+        requirements, shortages = production_report({self.lemon.pk: 5})
+
+        self.assertEqual(requirements[0]["required"], 10)
+        self.assertEqual(shortages, [])
+
+    def test_max_production_alone_and_mix(self):
+        plan, optimal = max_production([self.vanilla.pk, self.lemon.pk])
+
+        self.assertTrue(optimal)
+        # Vanilla alone: 100 milk / 5 = 20, 10 sugar / 1 = 10 -> 10 kg
+        self.assertEqual(plan[self.vanilla.pk]["alone"], 10)
+        self.assertEqual(plan[self.lemon.pk]["alone"], 5)
+        # Sharing the sugar, the most kg comes from vanilla only
+        self.assertEqual(plan[self.vanilla.pk]["in_mix"], 10)
+        self.assertEqual(plan[self.lemon.pk]["in_mix"], 0)
+
+    def test_max_production_is_rounded_down(self):
+        # 100 milk / 6 per kg = 16.666.. kg, 0.3 honey / 0.1 per kg = 3 kg
+        cream = Recipe.objects.create(flavor="Cream")
+        RecipeIngredient.objects.create(recipe=cream, ingredient=self.milk, quantity=6)
+        glaze = Recipe.objects.create(flavor="Glaze")
+        honey = Ingredient.objects.create(name="Honey")
+        IngredientInventory.objects.create(ingredient_name=honey, quantity="0.3")
+        RecipeIngredient.objects.create(recipe=glaze, ingredient=honey, quantity="0.1")
+
+        plan, optimal = max_production([cream.pk, glaze.pk])
+
+        self.assertEqual(plan[cream.pk]["alone"], 16.66)
+        self.assertEqual(plan[glaze.pk]["alone"], 3)
+
+    def test_simplex_shares_ingredients(self):
+        # max x + y with x + 2y <= 14, 3x - y <= 0 -> x = 2, y = 6
+        problem = (
+            np.array([[1.0, 2.0], [3.0, -1.0]]),
+            np.array([14.0, 0.0]),
+            np.array([1.0, 1.0]),
+        )
+        solution, optimal = simplex_maximize(*problem)
+
+        self.assertTrue(optimal)
+        self.assertAlmostEqual(solution[0], 2)
+        self.assertAlmostEqual(solution[1], 6)
+
+        # Stopped after one pivot: a feasible point, reported as not optimal
+        solution, optimal = simplex_maximize(*problem, max_iterations=1)
+        self.assertFalse(optimal)
+        self.assertLessEqual(solution[0] + 2 * solution[1], 14 + 1e-9)
+
+
+class StockBookingTest(TestCase):
+    def setUp(self):
+        self.user = UserProfile.objects.create(username="producer", password="password")
+        self.recipe = Recipe.objects.create(flavor="Strawberry")
+
+    def test_production_creates_then_increments_stock_item(self):
+        for quantity in (2, 3):
+            IceCreamProduction.objects.create(
+                recipe=self.recipe,
+                container_size=3,
+                quantity_produced=quantity,
+                produced_by=self.user,
+            )
+
+        stock_item = stock_with_balance().get(recipe=self.recipe, size=3)
+        self.assertEqual(stock_item.balance, 5)
+        self.assertEqual(stock_item.added_by, self.user)
+
+    def test_stock_update_is_insert_only(self):
+        production = IceCreamProduction(
+            recipe=self.recipe,
+            container_size=6,
+            quantity_produced=1,
+            produced_by=self.user,
+        )
+        # INSERT of the production, of the stock item if missing and of the movement
+        with self.assertNumQueries(3):
+            production.save()
+
+    def test_base_production_is_not_stocked(self):
+        base = Recipe.objects.create(flavor="Cream Base", is_base=True)
+        IceCreamProduction.objects.create(
+            recipe=base, container_size=3, quantity_produced=1, produced_by=self.user
+        )
+
+        self.assertFalse(StockItem.objects.filter(recipe=base).exists())
+
+
+class InventoryLedgerTest(TestCase):
+    def setUp(self):
+        self.user = UserProfile.objects.create(username="manager", level="Manager")
+        self.milk = Ingredient.objects.create(name="Milk")
+
+    def receive(self, quantity):
+        IngredientIncoming.objects.create(
+            ingredient=self.milk, quantity=quantity, received_by=self.user
+        )
+
+    def balance(self):
+        return inventory_with_balance().get(ingredient_name=self.milk).balance
+
+    def test_incoming_is_appended_to_the_ledger(self):
+        self.receive(100)
+        self.receive(50)
+
+        self.assertEqual(self.balance(), 150)
+        self.assertEqual(self.milk.movements.count(), 2)
+        # The stored quantity only changes when a snapshot is taken
+        self.assertEqual(IngredientInventory.objects.get().quantity, 0)
+
+    def test_str_shows_the_current_balance(self):
+        self.receive(100)
+        take_snapshot()
+        self.receive(20)
+
+        self.assertIn(": 120", str(IngredientInventory.objects.get()))
+
+    def test_admin_cannot_edit_the_snapshot(self):
+        inventory_admin = admin.site._registry[IngredientInventory]
+        stock_admin = admin.site._registry[StockItem]
+
+        for model_admin in (inventory_admin, stock_admin):
+            self.assertIn("quantity", model_admin.readonly_fields)
+            self.assertIn("last_movement_id", model_admin.readonly_fields)
+
+    def test_snapshot_folds_movements_into_the_balance(self):
+        self.receive(100)
+        take_snapshot()
+        self.receive(20)
+
+        inventory = IngredientInventory.objects.get()
+        self.assertEqual(inventory.quantity, 100)
+        self.assertEqual(inventory.snapshots.get().quantity, 100)
+        self.assertEqual(self.balance(), 120)
+
+        take_snapshot()
+        self.assertEqual(IngredientInventory.objects.get().quantity, 120)
+
+    def test_manual_correction_records_the_difference(self):
+        self.receive(100)
+        form = IngredientInventoryUpdateForm(
+            {"ingredient_name": self.milk.pk, "quantity": 90}
+        )
+
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save(corrected_by=self.user)
+
+        self.assertEqual(self.balance(), 90)
+        self.assertEqual(
+            self.milk.movements.get(kind=InventoryMovement.CORRECTION).quantity, -10
+        )
+
+    def test_movements_cannot_be_changed(self):
+        self.receive(100)
+        movement = self.milk.movements.get()
+        movement.quantity = 1
+
+        with self.assertRaises(ValueError):
+            movement.save()
+
+    def test_ledger_is_read_only_in_the_admin(self):
+        self.receive(100)
+        superuser = UserProfile.objects.create(
+            username="admin", is_staff=True, is_superuser=True
+        )
+        self.client.force_login(superuser)
+        movement = self.milk.movements.get()
+        url = reverse("admin:api_inventorymovement_change", args=[movement.pk])
+
+        self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.post(
+            reverse("admin:api_inventorymovement_delete", args=[movement.pk]),
+            {"post": "yes"},
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(self.milk.movements.exists())
+
+
+class AsOfQueryTest(TestCase):
+    def setUp(self):
+        self.user = UserProfile.objects.create(username="manager", level="Manager")
+        self.milk = Ingredient.objects.create(name="Milk")
+        self.now = timezone.now()
+
+    def receive(self, quantity, days_ago):
+        IngredientIncoming.objects.create(
+            ingredient=self.milk, quantity=quantity, received_by=self.user
+        )
+        # Movements are append-only, backdate them with a queryset update
+        InventoryMovement.objects.filter(pk=self.milk.movements.latest("pk").pk).update(
+            date_moved=self.now - timedelta(days=days_ago)
+        )
+
+    def balance_as_of(self, days_ago):
+        moment = self.now - timedelta(days=days_ago)
+        return inventory_as_of(moment).get(ingredient_name=self.milk).balance
+
+    def test_replays_movements_without_snapshot(self):
+        self.receive(100, days_ago=3)
+        self.receive(50, days_ago=1)
+
+        self.assertEqual(self.balance_as_of(4), 0)
+        self.assertEqual(self.balance_as_of(2), 100)
+        self.assertEqual(self.balance_as_of(0), 150)
+
+    def test_starts_from_the_last_snapshot_before_the_moment(self):
+        self.receive(100, days_ago=3)
+        take_snapshot()
+        InventorySnapshot.objects.update(taken_at=self.now - timedelta(days=2))
+        # Folded into the snapshot: only the snapshot quantity is read
+        InventoryMovement.objects.update(quantity=0)
+        self.receive(-30, days_ago=1)
+
+        self.assertEqual(self.balance_as_of(2), 100)
+        self.assertEqual(self.balance_as_of(0), 70)
+
+    def test_stock_as_of(self):
+        recipe = Recipe.objects.create(flavor="Vanilla")
+        StockItem.objects.create(recipe=recipe, size=3, quantity=0, added_by=self.user)
+        StockMovement.objects.create(
+            recipe=recipe, size=3, quantity=4, kind=StockMovement.PRODUCTION
+        )
+        StockMovement.objects.update(date_moved=self.now - timedelta(days=1))
+
+        self.assertEqual(stock_as_of(self.now - timedelta(days=2)).get().balance, 0)
+        self.assertEqual(stock_as_of(self.now).get().balance, 4)
+
+    def test_as_of_view(self):
+        self.receive(100, days_ago=3)
+        self.client.force_login(self.user)
+
+        response = self.client.get(
+            reverse("inventory_as_of"), {"at": (self.now - timedelta(days=2)).date()}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        [line] = response.json()["ingredients"]
+        self.assertEqual(line["ingredient"], "Milk")
+        self.assertEqual(float(line["quantity"]), 100)
+        self.assertEqual(
+            self.client.get(reverse("inventory_as_of"), {"at": "soon"}).status_code, 400
+        )
+
+
+class JournalWriterTest(TestCase):
+    def setUp(self):
+        self.user = UserProfile.objects.create(username="manager", level="Manager")
+        self.writer = JournalWriter()
+
+    @override_settings(JOURNAL_ASYNC=False)
+    def test_synchronous_fallback(self):
+        self.writer.record(self.user, "User created: anna")
+
+        entry = Journal.objects.get()
+        self.assertEqual((entry.user, entry.action), (self.user, "User created: anna"))
+        self.assertEqual(self.writer.stats["sync"], 1)
+
+    @override_settings(JOURNAL_BATCH_SIZE=3, JOURNAL_FLUSH_INTERVAL=1000)
+    def test_entries_are_written_in_batches(self):
+        batches = []
+
+        def write(batch):
+            batches.append([entry.action for entry in batch])
+
+        self.writer.write = write
+        for number in range(4):
+            self.writer.record(self.user, f"action {number}")
+        self.writer.flush()
+        self.writer.stop()
+
+        self.assertEqual(batches, [["action 0", "action 1", "action 2"], ["action 3"]])
+        self.assertEqual(self.writer.stats["queued"], 4)
+        self.assertFalse(self.writer.thread.is_alive())
+
+
+class JournalSearchTest(TestCase):
+    def setUp(self):
+        self.user = UserProfile.objects.create(username="manager", level="Manager")
+        for action in ["User created: anna", "User updated: anna", "Recipe deleted"]:
+            Journal.objects.create(user=self.user, action=action)
+
+    def actions(self, search_term):
+        return sorted(
+            entry.action for entry in search_journal(Journal.objects.all(), search_term)
+        )
+
+    def test_matches_any_word(self):
+        self.assertEqual(
+            self.actions("created deleted"), ["Recipe deleted", "User created: anna"]
+        )
+        self.assertEqual(len(self.actions("")), 3)
+
+    def test_journal_view_orders_by_relevance(self):
+        self.client.force_login(self.user)
+
+        response = self.client.get(
+            reverse("view_journal"), {"search": "user anna", "order": "relevance"}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["journal"]), 2)
+
+
+class JournalPaginationTest(TestCase):
+    def setUp(self):
+        self.user = UserProfile.objects.create(username="manager", level="Manager")
+        timestamp = timezone.now()
+        # Entries sharing a timestamp are ordered by id
+        Journal.objects.bulk_create(
+            Journal(user=self.user, action=f"action {number}", timestamp=timestamp)
+            for number in range(5)
+        )
+
+    def test_keyset_pages_cover_every_entry_once(self):
+        actions = []
+        cursor = None
+        while True:
+            rows, cursor = keyset_page(
+                Journal.objects.all(), ["-timestamp", "-id"], cursor, page_size=2
+            )
+            actions.extend(row.action for row in rows)
+            if cursor is None:
+                break
+
+        self.assertEqual(actions, [f"action {number}" for number in range(4, -1, -1)])
+
+    def test_relevance_pages_cover_every_entry_once(self):
+        # Every entry matches equally well: the pages continue on the rank
+        # stored in the cursor, then on timestamp and id
+        journal = search_journal(Journal.objects.all(), "action")
+        actions = []
+        cursor = None
+        while True:
+            rows, cursor = keyset_page(
+                journal, ["-rank", "-timestamp", "-id"], cursor, page_size=2
+            )
+            actions.extend(row.action for row in rows)
+            if cursor is None:
+                break
+
+        self.assertEqual(actions, [f"action {number}" for number in range(4, -1, -1)])
+
+    def test_journal_page_links_the_next_page(self):
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse("view_journal"))
+
+        self.assertEqual(len(response.context["journal"]), 5)
+        self.assertIsNone(response.context["next_params"])
+
+    def test_streaming_export(self):
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse("journal_export"), {"format": "ndjson"})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[0])["user"], "manager")
+
+        response = self.client.get(reverse("journal_export"), {"search": "action"})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "timestamp,user,action")
+        self.assertEqual(len(lines), 6)
+
+
+class JournalPartitionTest(TestCase):
+    def test_partition_names(self):
+        month = partition_month("api_journal_y2023m11")
+
+        self.assertEqual((month.year, month.month, month.day), (2023, 11, 1))
+        self.assertEqual(partition_name(month), "api_journal_y2023m11")
+        self.assertIsNone(partition_month("api_journal_default"))
+
+    def test_expired_partitions(self):
+        names = ["api_journal_y2023m01", "api_journal_y2023m02", "api_journal_y2023m03"]
+        now = partition_month("api_journal_y2023m05") + timedelta(days=3)
+
+        self.assertEqual(expired_partitions(names, 3, now), ["api_journal_y2023m01"])
+
+
+class WorkingHoursSummaryTest(TestCase):
+    def setUp(self):
+        self.manager = UserProfile.objects.create(username="manager", level="Manager")
+        self.anna = UserProfile.objects.create(username="anna", level="Service")
+        monday = timezone.make_aware(timezone.datetime(2023, 11, 6, 8))
+        for day, hours in [(0, 8), (1, 4), (7, 26)]:
+            clock_in = monday + timedelta(days=day)
+            WorkingHours.objects.create(
+                employee=self.anna,
+                clock_in=clock_in,
+                clock_out=clock_in + timedelta(hours=hours),
+            )
+        # Still clocked in: not counted
+        WorkingHours.objects.create(employee=self.anna, clock_in=monday)
+        self.start = monday - timedelta(days=7)
+        self.end = monday + timedelta(days=30)
+
+    def test_totals_in_seconds(self):
+        self.assertEqual(
+            worked_time(self.start, self.end),
+            [{"employee": self.anna.pk, "seconds": 38 * 3600}],
+        )
+
+    def test_per_week(self):
+        weeks = worked_time(self.start, self.end, self.anna.pk, "week")
+
+        self.assertEqual([week["seconds"] for week in weeks], [12 * 3600, 26 * 3600])
+        self.assertEqual(str(weeks[0]["period"]), "2023-11-06")
+
+    def test_summary_endpoint(self):
+        self.client.force_login(self.manager)
+
+        response = self.client.get(
+            reverse("working_hours_summary"),
+            {"start": "2023-11-01", "end": "2023-11-30"},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["total"][0]["seconds"], 38 * 3600)
+        self.assertEqual(len(data["day"]), 3)
+        self.assertEqual(data["month"][0]["period"], "2023-11-01")
+
+
+class StreamingListTest(TestCase):
+    def setUp(self):
+        self.anna = UserProfile.objects.create(
+            username="anna", email="anna@example.com"
+        )
+        self.ben = UserProfile.objects.create(username="ben", email="ben@example.com")
+        clock_in = timezone.now() - timedelta(days=2)
+        for hours in [8, 6]:
+            WorkingHours.objects.create(
+                employee=self.anna,
+                clock_in=clock_in,
+                clock_out=clock_in + timedelta(hours=hours),
+            )
+            clock_in += timedelta(days=1)
+
+    def get_json(self, url, params=None):
+        response = self.client.get(url, params or {})
+        self.assertTrue(response.streaming)
+        return json.loads(b"".join(response.streaming_content))
+
+    def test_staff_member_list_continues_after_cursor(self):
+        url = reverse("staff_member_list")
+
+        first = self.get_json(url, {"page_size": 1})
+        rest = self.get_json(url, {"after": first[-1]["id"]})
+
+        self.assertEqual([staff["name"] for staff in first + rest], ["anna", "ben"])
+        self.assertEqual(rest[0]["email"], "ben@example.com")
+
+    def test_working_hours_list(self):
+        url = reverse("working_hours_list", args=[self.anna.pk])
+
+        shifts = self.get_json(url)
+        rest = self.get_json(url, {"after": shifts[0]["id"]})
+
+        self.assertEqual([shift["seconds"] for shift in shifts], [8 * 3600, 6 * 3600])
+        self.assertEqual(
+            shifts[0]["recorded_time"], "0 days 8 hours 0 minutes 0 seconds"
+        )
+        self.assertEqual(rest, shifts[1:])
+        self.assertEqual(self.get_json(url, {"page_size": "1"}), shifts[:1])
+
+
+@override_settings(CLOCK_API_TOKEN="terminal-secret")
+class ClockTest(TestCase):
+    def setUp(self):
+        self.anna = UserProfile.objects.create(username="anna", level="Service")
+
+    def post_badge(self, badge, token="terminal-secret"):
+        return self.client.post(
+            reverse("clock"),
+            json.dumps({"badge": badge}),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {token}",
+        )
+
+    def test_clock_toggles_the_open_shift(self):
+        start = timezone.now()
+        employee, working_hours, action = clock(str(self.anna.pk), at=start)
+        self.assertEqual(action, CLOCK_IN)
+        self.assertIsNone(working_hours.clock_out)
+
+        end = start + timedelta(hours=8)
+        # Employee, then one toggle statement (plus the savepoint) on PostgreSQL
+        with self.assertNumQueries(4 if connection.vendor == "postgresql" else 6):
+            employee, working_hours, action = clock(str(self.anna.pk), at=end)
+        self.assertEqual(action, CLOCK_OUT)
+        self.assertEqual(WorkingHours.objects.get().clock_out, end)
+
+        with self.assertRaises(ValidationError):
+            clock("not a badge")
+
+    def test_double_scans_are_booked_once(self):
+        start = timezone.now()
+        clock(self.anna.pk, at=start)
+
+        employee, working_hours, action = clock(
+            self.anna.pk, at=start + timedelta(seconds=5)
+        )
+        self.assertEqual(action, DUPLICATE)
+        self.assertIsNone(working_hours.clock_out)
+
+        end = start + timedelta(hours=1)
+        clock(self.anna.pk, at=end)
+        employee, working_hours, action = clock(
+            self.anna.pk, at=end + timedelta(seconds=5)
+        )
+        self.assertEqual(action, DUPLICATE)
+        self.assertEqual(WorkingHours.objects.count(), 1)
+
+    def test_one_open_shift_per_employee(self):
+        WorkingHours.objects.create(employee=self.anna, clock_in=timezone.now())
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            WorkingHours.objects.create(employee=self.anna, clock_in=timezone.now())
+
+    def test_clock_endpoint(self):
+        response = self.post_badge(self.anna.pk)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["action"], CLOCK_IN)
+        self.assertEqual(self.post_badge(self.anna.pk).json()["action"], DUPLICATE)
+        self.assertEqual(self.post_badge(self.anna.pk + 1).status_code, 400)
+        self.assertEqual(self.post_badge(self.anna.pk, token="wrong").status_code, 403)
+
+    @override_settings(LOGIN_URL="/login/")
+    def test_manual_badge_needs_the_own_badge(self):
+        response = self.client.post(reverse("scan_qr_code"), {"badge": self.anna.pk})
+        self.assertIn(response.status_code, (302, 403))
+        self.assertFalse(WorkingHours.objects.exists())
+
+        bert = UserProfile.objects.create(username="bert", level="Service")
+        self.client.force_login(bert)
+        self.client.post(reverse("scan_qr_code"), {"badge": self.anna.pk})
+        self.assertFalse(WorkingHours.objects.exists())
+
+        self.client.post(reverse("scan_qr_code"), {"badge": bert.pk})
+        self.assertEqual(WorkingHours.objects.get().employee, bert)
+
+    def test_debouncer_ignores_repeated_reads(self):
+        debouncer = Debouncer(5)
+
+        self.assertTrue(debouncer.accept("1", now=0))
+        self.assertFalse(debouncer.accept("1", now=3))
+        self.assertFalse(debouncer.accept("1", now=7))
+        self.assertTrue(debouncer.accept("2", now=7))
+        self.assertTrue(debouncer.accept("1", now=13))
+
+    def test_badges_are_sent_off_the_decoder_threads(self):
+        release = threading.Event()
+        sent = []
+
+        def send(badge):
+            # A clock endpoint answering slowly
+            release.wait(5)
+            sent.append(badge)
+
+        sender = BadgeSender(send).start()
+        started = time.monotonic()
+        sender.submit("1")
+        sender.submit("2")
+        self.assertLess(time.monotonic() - started, 1)
+
+        release.set()
+        sender.stop()
+        self.assertEqual(sent, ["1", "2"])
+
+    def test_region_of_interest(self):
+        frame = np.zeros((960, 1280, 3), dtype=np.uint8)
+
+        # Grayscale, cropped, then downscaled
+        self.assertEqual(region_of_interest(frame, 1.0, 640).shape, (480, 640))
+        self.assertEqual(region_of_interest(frame, 0.5, 640).shape, (480, 640))
+        self.assertEqual(region_of_interest(frame, 0.25, 640).shape, (240, 320))
+
+    def test_adaptive_width_follows_latency(self):
+        width = AdaptiveWidth(max_width=640, min_width=320, budget=0.03)
+
+        for _ in range(10):
+            width.update(0.1)
+        self.assertEqual(width.width, 320)
+        for _ in range(30):
+            width.update(0.001)
+        self.assertEqual(width.width, 640)
+
+    def test_benchmark_decodes_every_frame(self):
+        frames = [np.zeros((480, 640, 3), dtype=np.uint8) for _ in range(6)]
+
+        metrics, badges = benchmark(frames, workers=3)
+
+        self.assertEqual(metrics["decoded"], 6)
+        self.assertEqual(metrics["dropped"], 0)
+        self.assertIsNotNone(metrics["latency_p95_ms"])
+
+
+@override_settings(CACHES=BADGE_TEST_CACHES)
+class BadgeSheetTest(TestCase):
+    def setUp(self):
+        caches["badges"].clear()
+        self.user = UserProfile.objects.create(username="manager", level="Manager")
+        self.anna = UserProfile.objects.create(username="anna")
+        self.client.force_login(self.user)
+
+    def test_unchanged_badges_are_not_rendered_again(self):
+        employees = [("anna", self.anna.pk), ("manager", self.user.pk)]
+
+        with mock.patch.object(badges, "badge_png", wraps=badges.badge_png) as render:
+            first = badges.cached_badges(employees)
+            second = badges.cached_badges(employees)
+            badges.cached_badges([("anna renamed", self.anna.pk)])
+
+        self.assertEqual(first, second)
+        self.assertEqual(render.call_count, 3)
+
+    def test_pdf_sheet(self):
+        response = self.client.post(reverse("badge_sheet"), {"format": "pdf"})
+
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertTrue(response.content.startswith(b"%PDF"))
+
+    def test_zip_of_selected_badges(self):
+        response = self.client.post(
+            reverse("badge_sheet"), {"format": "zip", "employee_ids": [self.anna.pk]}
+        )
+
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), [f"{self.anna.pk}_anna_Badge.png"])
+        self.assertTrue(archive.read(archive.namelist()[0]).startswith(b"\x89PNG"))
+
+    def test_sheet_pages(self):
+        pngs = badges.cached_badges([("anna", self.anna.pk)]) * 17
+
+        pdf = badges.badge_sheets_pdf(pngs)
+
+        # 16 badges per page
+        self.assertEqual(pdf.count(b"/Type /Page\n"), 2)
+
+    def test_managers_only(self):
+        self.client.force_login(self.anna)
+
+        response = self.client.post(reverse("badge_sheet"), {"format": "zip"})
+
+        self.assertEqual(response.status_code, 403)
+
+
+class DerivedDataCacheTest(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        caching.stats.clear()
+        self.user = UserProfile.objects.create(username="manager", level="Manager")
+        self.client.force_login(self.user)
+        self.recipe = Recipe.objects.create(flavor="Vanilla")
+
+    def test_hits_misses_and_invalidation(self):
+        compute = mock.Mock(
+            side_effect=lambda: list(Recipe.objects.values_list("flavor", flat=True))
+        )
+
+        self.assertEqual(caching.cached("flavors", [Recipe], compute), ["Vanilla"])
+        self.assertEqual(caching.cached("flavors", [Recipe], compute), ["Vanilla"])
+        self.assertEqual(compute.call_count, 1)
+
+        # post_save of a Recipe replaces its generation
+        Recipe.objects.create(flavor="Chocolate")
+        self.assertEqual(
+            caching.cached("flavors", [Recipe], compute), ["Vanilla", "Chocolate"]
+        )
+        self.assertEqual(
+            caching.cache_stats()["flavors"],
+            {"hits": 1, "misses": 2, "hit_rate": 0.333},
+        )
+
+    def test_stock_table_follows_the_ledger(self):
+        book_stock({(self.recipe.pk, 2.5): 10}, self.user)
+        response = self.client.get(reverse("stock_view"))
+        self.assertEqual(float(response.context["stock_items"][0]["balance"]), 10)
+
+        # Only the session and the user are read
+        with self.assertNumQueries(2):
+            self.client.get(reverse("stock_view"))
+
+        # A movement (bulk_create, no signal) invalidates the stock table too
+        book_stock({(self.recipe.pk, 2.5): 5}, self.user)
+        response = self.client.get(reverse("stock_view"))
+        self.assertEqual(float(response.context["stock_items"][0]["balance"]), 15)
+
+    def test_recipe_list_is_cached(self):
+        self.client.get(reverse("recipe_list"))
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("recipe_list"))
+        self.assertContains(response, "Vanilla")
+
+        self.assertEqual(
+            self.client.get(reverse("cache_stats")).json()["recipe_list"]["hits"], 1
+        )
+
+    def test_process_local_cache_is_refused_outside_debug(self):
+        with override_settings(DEBUG=False):
+            with self.assertRaises(ImproperlyConfigured):
+                caching.check_shared_cache()
+
+        shared = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache"}
+        with override_settings(DEBUG=False, CACHES={"default": shared}):
+            caching.check_shared_cache()
+
+
+class CachedChoiceFieldTest(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        self.sugar = Ingredient.objects.create(name="Sugar", unit_of_measurement="kg")
+        self.milk = Ingredient.objects.create(name="Milk", unit_of_measurement="l")
+
+    def test_choices_are_rendered_from_the_cache(self):
+        RecipeForm().as_p()
+        with self.assertNumQueries(0):
+            html = RecipeForm().as_p()
+        self.assertIn("Sugar", html)
+
+        # A new ingredient replaces the generation of the choice list
+        Ingredient.objects.create(name="Cream", unit_of_measurement="l")
+        self.assertIn("Cream", RecipeForm().as_p())
+
+    def test_submitted_ids_are_checked_in_one_query(self):
+        form = ProductionCalculatorForm()
+        field = form.fields["recipes"]
+        vanilla = Recipe.objects.create(flavor="Vanilla")
+        chocolate = Recipe.objects.create(flavor="Chocolate")
+
+        with self.assertNumQueries(1):
+            recipes = field.clean([str(vanilla.pk), str(chocolate.pk)])
+            self.assertEqual(
+                {recipe.flavor for recipe in recipes}, {"Vanilla", "Chocolate"}
+            )
+
+        with self.assertRaises(ValidationError):
+            field.clean([str(vanilla.pk), str(chocolate.pk + 100)])
+        with self.assertRaises(ValidationError):
+            field.clean(["not a number"])
+
+
+class StockOverviewTest(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        self.user = UserProfile.objects.create(username="manager", level="Manager")
+        self.client.force_login(self.user)
+        vanilla = Recipe.objects.create(flavor="Vanilla")
+        chocolate = Recipe.objects.create(flavor="Chocolate")
+        book_stock(
+            {(vanilla.pk, 0.5): 10, (vanilla.pk, 6): 1, (chocolate.pk, 3): 2}, self.user
+        )
+
+    def test_sorted_and_filtered_by_the_database(self):
+        rows = [(row["flavor"], row["size"]) for row in stock_overview("-litres")]
+        self.assertEqual(rows, [("Chocolate", 3), ("Vanilla", 6), ("Vanilla", 0.5)])
+
+        rows = [(row["flavor"], row["size"]) for row in stock_overview("size", "nill")]
+        self.assertEqual(rows, [("Vanilla", 0.5), ("Vanilla", 6)])
+        self.assertEqual(len(stock_overview(size=3)), 1)
+
+        with self.assertNumQueries(1):
+            list(stock_overview("balance", in_stock=True))
+
+    def test_rendered_table_is_cached_until_the_stock_changes(self):
+        response = self.client.get(reverse("stock_view"), {"sort": "-balance"})
+        self.assertContains(response, "Chocolate")
+
+        # Only the session and the user are read
+        with self.assertNumQueries(2):
+            self.client.get(reverse("stock_view"), {"sort": "-balance"})
+        # Another sort or filter is another fragment
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("stock_view"), {"flavor": "choc"})
+        self.assertNotContains(response, "Vanilla</td>")
+
+        # Any stock movement replaces the stock version
+        chocolate = Recipe.objects.get(flavor="Chocolate")
+        book_stock({(chocolate.pk, 3): -2}, self.user)
+        with self.assertNumQueries(3):
+            self.client.get(reverse("stock_view"), {"sort": "-balance"})
+
+
+class LiveEventsTest(TestCase):
+    def setUp(self):
+        self.user = UserProfile.objects.create(username="manager", level="Manager")
+        self.recipe = Recipe.objects.create(flavor="Vanilla")
+
+    def test_ledger_publishes_deltas_after_commit(self):
+        with mock.patch.object(events.broadcaster, "publish") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                book_stock({(self.recipe.pk, 3): 4}, self.user)
+                publish.assert_not_called()
+
+        publish.assert_called_once_with(
+            events.STOCK, [{"recipe": self.recipe.pk, "size": 3.0, "delta": 4.0}]
+        )
+
+    def test_event_stream(self):
+        async def read():
+            stream = events.event_stream(heartbeat=0.05)
+            received = [await stream.__anext__()]
+            # From another thread, like a view booking a production
+            await asyncio.to_thread(
+                events.broadcaster.publish,
+                events.INVENTORY,
+                [{"ingredient": 1, "delta": 2.0}],
+            )
+            received.append(await stream.__anext__())
+            received.append(await stream.__anext__())
+            await stream.aclose()
+            return received
+
+        retry, event, heartbeat = asyncio.run(read())
+
+        self.assertEqual(retry, "retry: 3000\n\n")
+        self.assertEqual(
+            event.split("\n", 1)[1],
+            'event: inventory\ndata: [{"ingredient": 1, "delta": 2.0}]\n\n',
+        )
+        self.assertEqual(heartbeat, ": heartbeat\n\n")
+        self.assertEqual(events.broadcaster.subscribers, {})
+
+    async def async_get(self, name):
+        return await self.async_client.get(reverse(name))
+
+    def test_events_need_a_login(self):
+        self.assertEqual(async_to_sync(self.async_get)("events").status_code, 403)
+
+    def test_live_updates_only_under_asgi(self):
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+
+        # Under WSGI an endless stream would hold a worker: no script, no stream
+        self.assertNotContains(self.client.get(reverse("stock_view")), "EventSource")
+        self.assertEqual(self.client.get(reverse("events")).status_code, 404)
+
+        response = async_to_sync(self.async_get)("stock_view")
+        self.assertContains(response, "EventSource")
+
+
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        self.user = UserProfile.objects.create(username="manager", level="Manager")
+        recipe = Recipe.objects.create(flavor="Vanilla")
+        book_stock({(recipe.pk, 3): 2}, self.user)
+        Journal.objects.create(user=self.user, action="Opened the shop")
+
+    def test_views_run_without_async_unsafe(self):
+        self.assertNotIn("DJANGO_ALLOW_ASYNC_UNSAFE", os.environ)
+        self.async_client.force_login(self.user)
+
+        async def get(name):
+            return await self.async_client.get(reverse(name))
+
+        self.assertContains(async_to_sync(get)("stock_view"), "Vanilla")
+        self.assertContains(async_to_sync(get)("view_journal"), "Opened the shop")
+        self.assertEqual(async_to_sync(get)("ingredient_inventory").status_code, 200)
+
+    @override_settings(LOGIN_URL="/login/")
+    def test_journal_pages_require_login(self):
+        async def get(name):
+            return await self.async_client.get(reverse(name))
+
+        for response in (
+            async_to_sync(get)("view_journal"),
+            self.client.get(reverse("journal_export")),
+        ):
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(response.url.startswith("/login/"))
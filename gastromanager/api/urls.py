@@ -9,12 +9,18 @@ urlpatterns = [
     path("staff/", views.staff_view, name="staff_view"),
     path("stock/", views.stock_view, name="stock_view"),
     path("journal/", views.view_journal, name="view_journal"),
+    path("journal/export/", views.journal_export, name="journal_export"),
     path("recipes/", views.RecipeListView.as_view(), name="recipe_list"),
     path("recipes/<int:pk>/", views.recipe_detail, name="recipe_detail"),
     path("recipes/create/", views.create_recipe, name="create_recipe"),
     path("recipes/update/<int:pk>/", views.update_recipe, name="update_recipe"),
     path("recipes/delete/<int:pk>/", views.delete_recipe, name="delete_recipe"),
     path("production/", views.production_view, name="production_view"),
+    path(
+        "production/batch/",
+        views.production_batch_view,
+        name="production_batch",
+    ),
     path("stock-takeout/", views.stock_takeout_view, name="stock_takeout_view"),
     path("add-ingredient/", views.add_ingredient, name="add_ingredient"),
     path(
@@ -22,12 +28,22 @@ urlpatterns = [
         views.production_calculator_view,
         name="production_calculator",
     ),
+    path(
+        "production-calculator/max/",
+        views.max_production_view,
+        name="max_production",
+    ),
     path("edit-profile/<int:user_id>", views.edit_profile, name="edit_profile"),
     path(
         "ingredient-inventory/",
         views.ingredient_inventory_view,
         name="ingredient_inventory",
     ),
+    path(
+        "ingredient-inventory/as-of/",
+        views.inventory_as_of_view,
+        name="inventory_as_of",
+    ),
     path("logout/", views.custom_logout, name="custom_logout"),
     path("profile/<int:user_id>/", views.view_profile, name="view_profile"),
     path("staff_members/", views.staff_member_list, name="staff_member_list"),
@@ -38,10 +54,20 @@ urlpatterns = [
     #     name="working_hours_list",
     # ),
     path("scan/", views.scan_qr_code, name="scan_qr_code"),
+    path("clock/", views.clock_view, name="clock"),
+    path("events/", views.events_view, name="events"),
+    path("cache/stats/", views.cache_stats_view, name="cache_stats"),
     path("badge/", views.generate_employee_badge, name="badge_maker"),
+    path("badge/sheet/", views.badge_sheet, name="badge_sheet"),
+    path("badge/<int:employee_id>/", views.employee_badge, name="employee_badge"),
     path(
         "working_hours/<int:staff_member_id>/",
         views.working_hours_list,
         name="working_hours_list",
     ),
+    path(
+        "working_hours/summary/",
+        views.working_hours_summary,
+        name="working_hours_summary",
+    ),
 ]
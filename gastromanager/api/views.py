@@ -1,6 +1,3 @@
-import cv2
-from pyzbar.pyzbar import decode
-
 from django.shortcuts import render, redirect, get_object_or_404
 from .activities import (
     activity_staff_view,
@@ -31,9 +28,9 @@ from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.views.generic import ListView
 from django.forms import modelformset_factory
-from django.db.models.signals import post_save
-from django.dispatch import receiver
 from .decorators import (
+    async_login_required,
+    load_user,
     manager_required,
     service_required,
     production_required,
@@ -47,20 +44,32 @@ from django.contrib.auth import logout
 from django.utils import timezone
 from django.db.models import Q
 from datetime import datetime
-import os
+import csv
+import hmac
+import itertools
+import json
 
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ValidationError
 from django.db import transaction
-from django.db.models.signals import post_save
-from django.dispatch import receiver
 from django.forms import modelformset_factory
-from django.http import JsonResponse, HttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
 from django.shortcuts import render, redirect, get_object_or_404
 from django.utils.decorators import method_decorator
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import ListView
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from urllib.parse import urlencode
+from asgiref.sync import sync_to_async
 
 
 from .models import (
@@ -76,9 +85,46 @@ from .models import (
     Journal,
     EmployeeBadge,
     WorkingHours,
+    format_duration,
+)
+from .forms import (
+    RecipeForm,
+    ProductionCalculatorForm,
+    MaxProductionForm,
+    ClockInOutForm,
+)
+from .journal import search_journal
+from .pagination import after_cursor, akeyset_page
+from .partitions import add_months, month_start
+from .ledger import (
+    inventory_as_of,
+    inventory_with_balance,
+    stock_as_of,
+    stock_with_balance,
 )
-from .forms import RecipeForm, ProductionCalculatorForm, ClockInOutForm
+from .planning import max_production, production_report
+from .production import (
+    book_production,
+    book_production_batch,
+    parse_production_lines,
+    to_decimal,
+)
+from .badges import (
+    badge_filename,
+    badge_key,
+    badge_sheets_pdf,
+    badge_zip_stream,
+    cached_badges,
+)
+from .caching import acached, cache_stats, cached, version
+from .clock import CLOCK_OUT, DUPLICATE, clock, parse_badge
+from .events import event_stream, live_updates
+from .stock import STOCK_SORTS, stock_overview, take_out_stock
+from .streaming import CHUNK_SIZE, StreamingJsonResponse
+from .working_hours import PERIODS, worked_time
 from .decorators import (
+    async_login_required,
+    load_user,
     manager_required,
     service_required,
     production_required,
@@ -91,48 +137,49 @@ RecipeIngredientFormSet = modelformset_factory(
 )
 
 
+# Welcome page options depending on access level (static, nothing to query)
+WELCOME_OPTIONS = {
+    "Manager": {
+        "Clock in/out": "scan_qr_code",
+        "Staff Management": "staff_view",
+        "Ice Cream Stock": "stock_view",
+        "Journal": "view_journal",
+        "Recipes": "recipe_list",
+        "Production": "production_view",
+        "Stock Takeout": "stock_takeout_view",
+        "Ingredient Incoming": "add_ingredient",
+        "Production Calculator": "production_calculator",
+        "Ingredient Inventory": "ingredient_inventory",
+    },
+    "Service": {
+        "Clock in/out": "scan_qr_code",
+        "Profile": "view_profile",
+        "Ice Cream Stock": "stock_view",
+        "Recipes": "recipe_list",
+        "Stock Takeout": "stock_takeout_view",
+        "Ingredient Incoming": "add_ingredient",
+        "Ingredient Inventory": "ingredient_inventory",
+    },
+    "Production": {
+        "Clock in/out": "scan_qr_code",
+        "Profile": "view_profile",
+        "Ice Cream Stock": "stock_view",
+        "Recipes": "recipe_list",
+        "Production": "production_view",
+        "Production Calculator": "production_calculator",
+        "Ingredient Incoming": "add_ingredient",
+        "Ingredient Inventory": "ingredient_inventory",
+    },
+}
+
+
 @login_required
 def welcome_page(request):
     # Get access level from user
     user_level = request.user.level
 
-    # Dictionary with options depending on access level.
-    options = {
-        "Manager": {
-            "Clock in/out": "scan_qr_code",
-            "Staff Management": "staff_view",
-            "Ice Cream Stock": "stock_view",
-            "Journal": "view_journal",
-            "Recipes": "recipe_list",
-            "Production": "production_view",
-            "Stock Takeout": "stock_takeout_view",
-            "Ingredient Incoming": "add_ingredient",
-            "Production Calculator": "production_calculator",
-            "Ingredient Inventory": "ingredient_inventory",
-        },
-        "Service": {
-            "Clock in/out": "scan_qr_code",
-            "Profile": "view_profile",
-            "Ice Cream Stock": "stock_view",
-            "Recipes": "recipe_list",
-            "Stock Takeout": "stock_takeout_view",
-            "Ingredient Incoming": "add_ingredient",
-            "Ingredient Inventory": "ingredient_inventory",
-        },
-        "Production": {
-            "Clock in/out": "scan_qr_code",
-            "Profile": "view_profile",
-            "Ice Cream Stock": "stock_view",
-            "Recipes": "recipe_list",
-            "Production": "production_view",
-            "Production Calculator": "production_calculator",
-            "Ingredient Incoming": "add_ingredient",
-            "Ingredient Inventory": "ingredient_inventory",
-        },
-    }
-
     # Get specific option according to access level. This will be used in the main welcome template.
-    user_options = options.get(user_level, {})
+    user_options = WELCOME_OPTIONS.get(user_level, {})
 
     return render(
         request,
@@ -241,62 +288,191 @@ def staff_view(request):
     )
 
 
-@login_required
-def stock_view(request):
-    stock_items = StockItem.objects.all()
-    return render(request, "stock_view.html", {"stock_items": stock_items})
+# Seconds a rendered stock table is kept; a production or takeout replaces the
+# stock version, which is part of the fragment key, before that
+STOCK_FRAGMENT_TIMEOUT = 60 * 60
+
+
+@async_login_required
+async def stock_view(request):
+    # ?sort=flavor|size|balance|-balance|litres|-litres, ?flavor=<part of the
+    # name>, ?size=<litres>, ?in_stock=1
+    sort = request.GET.get("sort", "flavor")
+    if sort not in STOCK_SORTS:
+        sort = "flavor"
+    flavor = request.GET.get("flavor", "").strip()
+    try:
+        size = float(request.GET["size"]) if request.GET.get("size") else None
+    except ValueError:
+        size = None
+    in_stock = request.GET.get("in_stock") == "1"
+    filters = {
+        "flavor": flavor,
+        "size": size or "",
+        "in_stock": "1" if in_stock else "",
+    }
+
+    # The rendered table is cached until the next stock movement
+    stock_version = await sync_to_async(version)(StockItem, Recipe)
+    key = make_template_fragment_key(
+        "stock_table", [stock_version, sort, flavor, size, in_stock]
+    )
+    stock_table = await cache.aget(key)
+    if stock_table is None:
+        stock_items = [
+            row async for row in stock_overview(sort, flavor, size, in_stock)
+        ]
+        stock_table = render_to_string(
+            "stock_table.html",
+            {
+                "stock_items": stock_items,
+                "sort": sort,
+                "filter_params": urlencode({k: v for k, v in filters.items() if v}),
+            },
+        )
+        await cache.aset(key, stock_table, STOCK_FRAGMENT_TIMEOUT)
+
+    return render(
+        request,
+        "stock_view.html",
+        {
+            "stock_table": mark_safe(stock_table),
+            "sort": sort,
+            "flavor": flavor,
+            "size": size,
+            "in_stock": in_stock,
+            "filtered": bool(flavor or size is not None or in_stock),
+            "live_updates": live_updates(request),
+            "sizes": StockItem._meta.get_field("size").choices,
+        },
+    )
+
 
+JOURNAL_EXPORT_FIELDS = ["timestamp", "user", "action"]
 
-def view_journal(request):
+
+def filter_journal(params):
     # Get the filter parameter from the request
-    filter_type = request.GET.get("filter", "all")
+    filter_type = params.get("filter", "all")
 
-    # Set the filter range based on the filter parameter
-    today = timezone.now()
+    # Set the filter range based on the filter parameter. Both ends are
+    # timestamps, so PostgreSQL only reads the partitions of that range.
+    now = timezone.now()
+    today = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0)
     if filter_type == "today":
-        start_date = today.date()
-        end_date = today.date() + timezone.timedelta(days=1)
+        start_date = today
+        end_date = today + timezone.timedelta(days=1)
     elif filter_type == "this_week":
         start_date = today - timezone.timedelta(days=today.weekday())
         end_date = start_date + timezone.timedelta(days=7)
     elif filter_type == "this_month":
-        start_date = today.replace(day=1)
-        end_date = (today + timezone.timedelta(days=32)).replace(day=1)
+        start_date = month_start(now)
+        end_date = add_months(start_date, 1)
     elif filter_type == "last_three_months":
-        start_date = today.replace(day=1) - timezone.timedelta(days=90)
-        end_date = today
+        start_date = month_start(now) - timezone.timedelta(days=90)
+        end_date = now
     else:
         # Filter for all entries
         start_date = None
         end_date = None
 
     # Get the search terms from the request
-    search_term = request.GET.get("search", "")
-    search_terms = search_term.split()  # Split the search term into individual words
+    search_term = params.get("search", "")
+
+    # Query the journal based on the filter, matching any word of the search
+    journal = search_journal(
+        Journal.objects.filter(
+            Q(timestamp__gte=start_date, timestamp__lt=end_date)
+            if start_date is not None
+            else Q()
+        ),
+        search_term,
+    ).select_related("user")
+
+    if params.get("order") == "relevance" and search_term:
+        ordering = ["-rank", "-timestamp", "-id"]
+    else:
+        ordering = ["-timestamp", "-id"]
+
+    return journal, ordering
 
-    # Create a list of Q objects for OR search on each word
-    search_queries = [Q(action__icontains=word) for word in search_terms]
 
-    # Combine the Q objects with the OR operator
-    combined_query = search_queries.pop() if search_queries else Q()
-    for query in search_queries:
-        combined_query |= query
+@async_login_required
+async def view_journal(request):
+    journal, ordering = filter_journal(request.GET)
 
-    # Query the journal based on the filter and combined search query
-    journal = Journal.objects.filter(
-        Q(timestamp__gte=start_date, timestamp__lt=end_date)
-        if start_date is not None
-        else Q(),
-        combined_query,
-    ).order_by("-timestamp")
+    # One page at a time, continuing after the last entry of the previous page
+    try:
+        entries, next_cursor = await akeyset_page(
+            journal, ordering, request.GET.get("cursor")
+        )
+    except ValidationError:
+        entries, next_cursor = await akeyset_page(journal, ordering)
+
+    next_params = None
+    if next_cursor is not None:
+        next_params = request.GET.copy()
+        next_params["cursor"] = next_cursor
+        next_params = next_params.urlencode()
+
+    export_params = request.GET.copy()
+    export_params.pop("cursor", None)
 
     return render(
         request,
         "journal.html",
-        {"journal": journal, "filter_type": filter_type, "search_term": search_term},
+        {
+            "journal": entries,
+            "filter_type": request.GET.get("filter", "all"),
+            "search_term": request.GET.get("search", ""),
+            "order": request.GET.get("order", "newest"),
+            "next_params": next_params,
+            "export_params": export_params.urlencode(),
+        },
     )
 
 
+class Echo:
+    # File-like object for csv.writer that hands back each written line
+    def write(self, value):
+        return value
+
+
+@login_required
+def journal_export(request):
+    # The whole filtered journal, streamed row by row in CSV or NDJSON
+    journal, ordering = filter_journal(request.GET)
+    rows = (
+        journal.order_by(*ordering)
+        .values_list("timestamp", "user__username", "action")
+        .iterator(chunk_size=2000)
+    )
+
+    if request.GET.get("format") == "ndjson":
+        lines = (
+            json.dumps(dict(zip(JOURNAL_EXPORT_FIELDS, row)), cls=DjangoJSONEncoder)
+            + "\n"
+            for row in rows
+        )
+        content_type = "application/x-ndjson"
+        filename = "journal.ndjson"
+    else:
+        writer = csv.writer(Echo())
+        lines = itertools.chain(
+            [writer.writerow(JOURNAL_EXPORT_FIELDS)],
+            (
+                writer.writerow([timestamp.isoformat(), username or "", action])
+                for timestamp, username, action in rows
+            ),
+        )
+        content_type = "text/csv"
+        filename = "journal.csv"
+
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
 # had to change auth decorator to use a class based view!
 @method_decorator(login_required, name="dispatch")
 class RecipeListView(ListView):
@@ -307,7 +483,11 @@ class RecipeListView(ListView):
     # list if recipes
     def get_queryset(self):
         # include ingredients related to that recipe.
-        return Recipe.objects.prefetch_related("ingredients")
+        return cached(
+            "recipe_list",
+            [Recipe, RecipeIngredient, Ingredient],
+            lambda: list(Recipe.objects.prefetch_related("ingredients")),
+        )
 
 
 # View for displaying recipe details
@@ -447,146 +627,47 @@ def create_recipe(request):
 # @register_activity
 def production_view(request):
     if request.method == "POST":
-        recipe_id = request.POST["recipe"]
-        quantity_produced = request.POST["quantity_produced"]
-        container_size = request.POST["container_size"]
-        produced_by = request.user
-        recipe = Recipe.objects.get(pk=recipe_id)
-        recipe_ingredients = RecipeIngredient.objects.filter(recipe=recipe)
+        recipe = get_object_or_404(Recipe, pk=request.POST["recipe"])
 
         try:
-            # Check ingredient availability in inventory, and catch any ValidationErrors
-            check_ingredient_availability(
-                recipe_ingredients, quantity_produced, container_size
-            )
-
-            # Create production
-            production = create_production(
+            # Check availability, consume ingredients and register the production
+            # in a single transaction (stock is updated by the post_save signal).
+            book_production(
                 recipe,
-                container_size,
-                recipe_ingredients,
-                quantity_produced,
-                produced_by,
+                request.POST["container_size"],
+                request.POST["quantity_produced"],
+                request.user,
             )
-
-            # Check if the recipe is marked as a base
-            if recipe.is_base:
-                # add base to inventory
-                add_base_to_inventory(recipe, quantity_produced)
-            else:
-                # add ice cream to Stock
-                update_stock(recipe, production, produced_by)
         except ValidationError as e:
-            messages.error(request, e)
+            for message in e.messages:
+                messages.error(request, message)
             return redirect("production_view")
 
-    return redirect("production_view")
-
-
-@login_required
-# @manager_required
-# @production_required
-def check_ingredient_availability(
-    recipe_ingredients, quantity_produced, container_size
-):
-    for recipe_ingredient in recipe_ingredients:
-        required_quantity = (
-            float(recipe_ingredient.quantity) * quantity_produced * container_size
-        )
-        inventory = recipe_ingredient.ingredient.inventory
+        messages.success(request, f"Production of {recipe.flavor} registered.")
+        return redirect("production_view")
 
-        if inventory.quantity < required_quantity:
-            raise ValidationError(
-                f"Ingredient {recipe_ingredient.ingredient.name} is not available in sufficient quantity."
-            )
+    recipes = cached("recipes", [Recipe], lambda: list(Recipe.objects.all()))
+    return render(request, "production_view.html", {"recipes": recipes})
 
 
 @login_required
-# @manager_required
 # @production_required
-# @register_activity
-def create_production(
-    recipe, container_size, recipe_ingredients, quantity_produced, produced_by
-):
-    # Check if the recipe is marked as a base
-    if recipe.is_base:
-        # For base recipes, we treat them as a single ingredient
-        # Calculate the total quantity required based on quantity produced
-        total_quantity_required = quantity_produced
-
-        # Create production
-        production = IceCreamProduction.objects.create(
-            recipe=recipe, quantity_produced=quantity_produced, produced_by=produced_by
-        )
+def production_batch_view(request):
+    # Books a whole production plan sent as JSON:
+    # {"lines": [{"recipe": 1, "container_size": 3, "quantity": 2}, ...]}
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
 
-        # Update inventory for the base (recipe itself)
-        base_ingredient, created = Ingredient.objects.get_or_create(
-            name=recipe.flavor, defaults={"unit_of_measurement": Ingredient.GRAMS}
-        )
-
-        base_ingredient.inventory.quantity += total_quantity_required
-        base_ingredient.inventory.save()
-    else:
-        # If it's not a base, then we consider the container size
-        # Obtain the quantity factor based on the selected container size
-        if container_size == 0.5:
-            quantity_factor = 0.5
-        elif container_size == 3:
-            quantity_factor = 3
-        elif container_size == 6:
-            quantity_factor = 6
-        else:
-            raise ValueError("Invalid container size selected")
-
-        # Calculate the total quantity required based on quantity factor and quantity produced
-        total_quantity_required = quantity_factor * quantity_produced
-
-        # Create production
-        IceCreamProduction.objects.create(
-            recipe=recipe,
-            container_size=container_size,
-            quantity_produced=quantity_produced,
-            produced_by=produced_by,
-        )
-
-    # Update ingredient inventory
-    for recipe_ingredient in recipe_ingredients:
-        required_quantity = float(recipe_ingredient.quantity) * total_quantity_required
-        inventory = recipe_ingredient.ingredient.inventory
-        inventory.quantity -= required_quantity
-        inventory.save()
-
-
-def add_base_to_inventory(recipe, quantity_produced):
-    # Create the base ingredient
-    base_ingredient, created = Ingredient.objects.get_or_create(
-        name=recipe.flavor, defaults={"unit_of_measurement": Ingredient.GRAMS}
-    )
+    try:
+        payload = json.loads(request.body)
+        lines = parse_production_lines(payload.get("lines"))
+        productions = book_production_batch(lines, request.user)
+    except (ValueError, AttributeError):
+        return JsonResponse({"errors": ["Invalid JSON body."]}, status=400)
+    except ValidationError as e:
+        return JsonResponse({"errors": e.messages}, status=400)
 
-    # Update inventory for the base
-    base_ingredient.inventory.quantity += float(quantity_produced)
-    base_ingredient.inventory.save()
-
-    # Update the inventory for the ingredients used to produce the base
-    for ingredient in recipe.base_ingredients.all():
-        required_quantity = float(
-            ingredient.recipeingredient_set.get(recipe=recipe).quantity
-        ) * float(quantity_produced)
-        inventory_entry = IngredientInventory.objects.get(ingredient_name=ingredient)
-        inventory_entry.quantity -= required_quantity
-        inventory_entry.save()
-
-
-@receiver(post_save, sender=IceCreamProduction)
-def update_stock(sender, instance, created, **kwargs):
-    if created:
-        # Update ice cream stock
-        stock_item, created = StockItem.objects.get_or_create(
-            recipe=instance.recipe, size=instance.container_size
-        )
-        stock_item.quantity += instance.quantity_produced
-        stock_item.added_by = instance.produced_by
-        stock_item.save()
+    return JsonResponse({"booked": len(productions)}, status=201)
 
 
 @login_required
@@ -595,42 +676,40 @@ def update_stock(sender, instance, created, **kwargs):
 # @register_activity
 def stock_takeout_view(request):
     if request.method == "POST":
-        stock_item_id = request.POST["stock_item"]
-        quantity_moved = request.POST["quantity_moved"]
-        date_moved = request.POST["date_moved"]
-        moved_by = request.user
-
-        # Validation: Check if there is enough ice cream in stock
-        stock_item = StockItem.objects.get(pk=stock_item_id)
-
-        if float(quantity_moved) <= 0:
-            raise ValidationError("Must be positive number")
-
-        if stock_item.quantity < float(quantity_moved):
-            raise ValidationError("Not enough in Stock")
-
-        # Register the stock movement
-        IceCreamStockTakeOut.objects.create(
-            ice_cream_production=stock_item,
-            quantity_moved=quantity_moved,
-            date_moved=date_moved,
-            moved_by=moved_by,
-        )
+        try:
+            take_out_stock(
+                request.POST["stock_item"],
+                to_decimal(request.POST["quantity_moved"]),
+                request.POST["date_moved"],
+                request.user,
+            )
+        except StockItem.DoesNotExist:
+            raise Http404("Stock item does not exist")
+        except ValidationError as e:
+            for message in e.messages:
+                messages.error(request, message)
 
         return redirect("stock_takeout_view")
 
+    stock_items = stock_with_balance().select_related("recipe")
+    return render(request, "stock_takeout_view.html", {"stock_items": stock_items})
+
 
 @login_required
 # @register_activity
 def add_ingredient(request):
     if request.method == "POST":
         ingredient_name = request.POST["ingredient_name"]
-        quantity = float(request.POST["quantity"])  # Convert the quantity to a float
+        try:
+            quantity = to_decimal(request.POST["quantity"])
+        except ValidationError as e:
+            messages.error(request, " ".join(e.messages))
+            return redirect("add_ingredient")
         unit_weight = request.POST["unit_weight"]
-        lot_number = request.POST.get("lot_number", None)
-        expiration_date = request.POST.get("expiration_date", None)
-        temperature = request.POST.get("temperature", None)
-        observations = request.POST.get("observations", None)
+        lot_number = request.POST.get("lot_number") or None
+        expiration_date = request.POST.get("expiration_date") or None
+        temperature = request.POST.get("temperature") or None
+        observations = request.POST.get("observations") or None
 
         received_by = request.user  # User receiving
 
@@ -643,13 +722,8 @@ def add_ingredient(request):
         if quantity <= 0:
             raise ValidationError("quantity must be a positive number.")
 
-        # Call a function to add the ingredient to inventory
-        if ingredient.is_base:
-            add_base_to_inventory(ingredient, quantity)
-        else:
-            add_to_inventory(ingredient, quantity)
-
-        # Register the ingredient incoming
+        # Register the ingredient incoming, the post_save signal adds it to
+        # the inventory ledger.
         register_ingredient_incoming(
             ingredient,
             quantity,
@@ -664,17 +738,7 @@ def add_ingredient(request):
         messages.success(request, "Ingredient register succesfully.")
         return redirect("ingredient_inventory")
 
-
-def add_to_inventory(ingredient, quantity):
-    # Get or create the inventory entry
-    inventory_entry, created = IngredientInventory.objects.get_or_create(
-        ingredient_name=ingredient
-    )
-
-    # Update the existing quantity with the new quantity if not there than creates it.
-    if not created:
-        inventory_entry.quantity += quantity
-        inventory_entry.save()
+    return render(request, "add_ingredient.html")
 
 
 def register_ingredient_incoming(
@@ -692,7 +756,7 @@ def register_ingredient_incoming(
         ingredient=ingredient,
         quantity=quantity,
         lot_number=lot_number,
-        unit_weight=unit_weight,
+        unit_of_measurement=unit_weight,
         expiration_date=expiration_date,
         temperature=temperature,
         observations=observations,
@@ -700,25 +764,86 @@ def register_ingredient_incoming(
     )
 
 
-@login_required
-def ingredient_inventory_view(request):
-    ingredients_inventory = IngredientInventory.objects.all()
+@async_login_required
+async def ingredient_inventory_view(request):
+    form = IngredientInventoryUpdateForm()
     if request.user.level == "Manager":  # only manager can make changes.
         if request.method == "POST":
-            # do manual changes en inventory
+            # manual correction of the inventory, recorded in the ledger; the
+            # validation and the booking are sync ORM code, run in a thread
             form = IngredientInventoryUpdateForm(request.POST)
-            if form.is_valid():
-                form.save()
+            if await sync_to_async(form.is_valid)():
+                await sync_to_async(form.save)(corrected_by=request.user)
                 messages.success(request, "Changes done successfully.")
-
-    # if there are mistakes in the formulary
-    else:
-        form = IngredientInventoryUpdateForm()
+                return redirect("ingredient_inventory")
+        # Choices read before rendering, which must not query
+        ingredient_field = form.fields["ingredient_name"]
+        ingredient_field.choices = await sync_to_async(list)(ingredient_field.choices)
+
+    ingredients_inventory = await acached(
+        "inventory_table",
+        [IngredientInventory, Ingredient],
+        lambda: alist(inventory_with_balance().select_related("ingredient_name")),
+    )
 
     return render(
         request,
-        "ingredient_inventory.html",
-        {"ingredients_inventory": ingredients_inventory, "form": form},
+        "ingredient_inventory_view.html",
+        {
+            "ingredients_inventory": ingredients_inventory,
+            "form": form,
+            "live_updates": live_updates(request),
+        },
+    )
+
+
+async def alist(queryset):
+    return [row async for row in queryset]
+
+
+def parse_moment(value):
+    # "2023-11-02T18:00" or "2023-11-02" (end of that day), in the current timezone
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                return None
+            moment = datetime.combine(day, datetime.max.time())
+    except ValueError:
+        return None
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+@login_required
+def inventory_as_of_view(request):
+    # Ingredient inventory and ice cream stock at a point in time: ?at=<date>
+    moment = parse_moment(request.GET.get("at", ""))
+    if moment is None:
+        return JsonResponse(
+            {"error": "Parameter 'at' must be a date or a date and time."},
+            status=400,
+        )
+
+    ingredients = inventory_as_of(moment).values_list(
+        "ingredient_name__name", "balance"
+    )
+    stock = stock_as_of(moment).values_list("recipe__flavor", "size", "balance")
+
+    return JsonResponse(
+        {
+            "at": moment.isoformat(),
+            "ingredients": [
+                {"ingredient": name, "quantity": str(balance)}
+                for name, balance in ingredients.order_by("ingredient_name__name")
+            ],
+            "stock": [
+                {"recipe": flavor, "size": size, "quantity": str(balance)}
+                for flavor, size, balance in stock.order_by("recipe__flavor", "size")
+            ],
+        }
     )
 
 
@@ -726,92 +851,77 @@ def ingredient_inventory_view(request):
 # @manager_required
 # @production_required
 def production_calculator_view(request):
+    requirements = None
+    shortages = None
+
     if request.method == "POST":
         form = ProductionCalculatorForm(request.POST)
         if form.is_valid():
             recipes = form.cleaned_data["recipes"]
             desired_quantities = form.cleaned_data["desired_quantities"]
 
-            # Parse desired quantities and recipes
-            desired_quantities = [
-                float(q.strip()) for q in desired_quantities.split(",")
-            ]
-
-            # Dictionary to store ingredient quantities
-            total_ingredient_quantities = {}
-
             try:
-                # Calculate and check availability for each recipe
-                for recipe, desired_quantity in zip(recipes, desired_quantities):
-                    calculate_production(
-                        recipe, desired_quantity, total_ingredient_quantities
+                # Parse desired quantities and recipes
+                desired_quantities = [
+                    to_decimal(q.strip()) for q in desired_quantities.split(",")
+                ]
+                if len(desired_quantities) != len(recipes):
+                    raise ValidationError(
+                        "Enter one desired quantity for each selected recipe."
                     )
+
+                # Calculate the whole plan and report every missing ingredient
+                requirements, shortages = calculate_production(
+                    recipes, desired_quantities
+                )
             except ValidationError as e:
                 form.add_error(None, e)
-            else:
-                # Total quantities calculation is successful
-                print("Calculations done correctly")
-                print(total_ingredient_quantities)
 
     else:
         form = ProductionCalculatorForm()
 
-    return render(request, "production_calculator.html", {"form": form})
-
-
-def calculate_production(recipe, desired_quantity, total_ingredient_quantities):
-    recipe_ingredients = RecipeIngredient.objects.filter(recipe=recipe)
-
-    for recipe_ingredient in recipe_ingredients:
-        # Get the ingredient and its quantity in the recipe
-        ingredient = recipe_ingredient.ingredient
-        quantity_in_recipe = float(recipe_ingredient.quantity)  # Quantity per kg
-
-        # Calculate the total quantity needed based on the desired quantity
-        total_quantity_needed = quantity_in_recipe * desired_quantity
-
-        # Update or initialize the total_ingredient_quantities dictionary
-        if ingredient.id in total_ingredient_quantities:
-            total_ingredient_quantities[ingredient.id] += total_quantity_needed
-        else:
-            total_ingredient_quantities[ingredient.id] = total_quantity_needed
-
-        # Check ingredient availability in inventory
-        check_inventory_availability(ingredient, total_quantity_needed)
-
-        # Check if the recipe's base ingredients need to be added
-        if recipe.is_base:
-            add_base_ingredients(recipe, desired_quantity, total_ingredient_quantities)
+    return render(
+        request,
+        "production_calculator.html",
+        {"form": form, "requirements": requirements, "shortages": shortages},
+    )
 
 
-# Function to check if base ingredients need to be added
-def add_base_ingredients(recipe, desired_quantity, total_ingredient_quantities):
-    for base_ingredient in recipe.base_ingredients.all():
-        # Get the base ingredient's quantity in the recipe
-        recipe_ingredient = base_ingredient.recipeingredient_set.get(recipe=recipe)
-        quantity_in_recipe = float(recipe_ingredient.quantity)  # Quantity per kg
+def calculate_production(recipes, desired_quantities):
+    # Sum the desired kg per recipe; the demand of the whole plan is one product
+    # of the quantity vector with the cached recipe x ingredient matrix.
+    quantities = {}
+    for recipe, desired_quantity in zip(recipes, desired_quantities):
+        quantities[recipe.pk] = quantities.get(recipe.pk, 0) + desired_quantity
 
-        # Calculate the total quantity needed based on the desired quantity
-        total_quantity_needed = quantity_in_recipe * desired_quantity
+    return production_report(quantities)
 
-        # Update or initialize the total_ingredient_quantities dictionary for base ingredients
-        if base_ingredient.id in total_ingredient_quantities:
-            total_ingredient_quantities[base_ingredient.id] += total_quantity_needed
-        else:
-            total_ingredient_quantities[base_ingredient.id] = total_quantity_needed
-
-        # Check ingredient availability in inventory
-        check_inventory_availability(base_ingredient, total_quantity_needed)
 
+@login_required
+# @manager_required
+# @production_required
+def max_production_view(request):
+    plan = None
+    optimal = True
 
-# Function to verify inventory availability
-def check_inventory_availability(ingredient, total_quantity_needed):
-    inventory = ingredient.inventory
+    if request.method == "POST":
+        form = MaxProductionForm(request.POST)
+        if form.is_valid():
+            recipes = form.cleaned_data["recipes"]
+            quantities, optimal = max_production([recipe.pk for recipe in recipes])
+            plan = [
+                {"recipe": recipe, **quantities[recipe.pk]}
+                for recipe in recipes
+                if recipe.pk in quantities
+            ]
+    else:
+        form = MaxProductionForm()
 
-    if inventory.quantity < total_quantity_needed:
-        raise ValidationError(
-            f"Ingredient {ingredient.name} is not available in sufficient quantity. Current quantity: {inventory.quantity} kg, Required quantity: {total_quantity_needed} kg"
-        )
+    return render(
+        request,
+        "max_production.html",
+        {"form": form, "plan": plan, "optimal": optimal},
+    )
 
 
 # simple logout, it redirects you to login site.
@@ -820,120 +930,284 @@ def custom_logout(request):
     return redirect("/")
 
 
-# combined version
+def clock_message(employee, working_hours, action):
+    if action == DUPLICATE:
+        return f"{employee.username} - Already booked"
+    if action == CLOCK_OUT:
+        at = timezone.localtime(working_hours.clock_out)
+        return f"{employee.username} - Clocked Out at {at:%Y-%m-%d %H:%M}"
+    at = timezone.localtime(working_hours.clock_in)
+    return f"{employee.username} - Clocked In at {at:%Y-%m-%d %H:%M}"
+
+
+# Badges are read by the scanner service of the clock terminal (management
+# command run_qr_scanner), which posts them to clock_view; this form is the
+# manual fallback with the badge number.
+@login_required
 def scan_qr_code(request):
     if request.method == "POST":
         form = ClockInOutForm(request.POST)
 
-        if form.is_valid():
-            cap = cv2.VideoCapture(0)
-
-            while True:
-                ret, frame = cap.read()
-                decoded_objects = decode(frame)
-
-                for obj in decoded_objects:
-                    data = obj.data.decode("utf-8")
-
-                    try:
-                        staff_member = UserProfile.objects.get(id=data)
-                        cv2.destroyAllWindows()
-
-                        # Check if the staff member is already clocked in
-                        try:
-                            last_clock_in = WorkingHours.objects.filter(
-                                employee=staff_member, clock_out__isnull=True
-                            ).latest("clock_in")
-                            last_clock_in.clock_out = datetime.now()
-                            last_clock_in.save()
-                            clock_out_formatted = last_clock_in.clock_out.strftime(
-                                "%Y-%m-%d %H:%M"
-                            )
-                            messages.success(
-                                request,
-                                f"{staff_member.username} - Clocked Out at {clock_out_formatted}",
-                            )
-                            return redirect("welcome")
-
-                        except WorkingHours.DoesNotExist:
-                            # Clock staff member in
-                            working_hours = WorkingHours(
-                                employee=staff_member, clock_in=datetime.now()
-                            )
-                            working_hours.save()
-                            clock_in_formatted = working_hours.clock_in.strftime(
-                                "%Y-%m-%d %H:%M"
-                            )
-                            messages.success(
-                                request,
-                                f"{staff_member.username} - Clocked In at {clock_in_formatted}",
-                            )
-                            return redirect("welcome")
-
-                    except UserProfile.DoesNotExist:
-                        cap.release()
-                        cv2.destroyAllWindows()
-                        return redirect("welcome")
-
-                cv2.imshow("QR Code Scanner    Press q to exit", frame)
-
-                if cv2.waitKey(1) & 0xFF == ord("q"):
-                    break
-
-            cap.release()
-            cv2.destroyAllWindows()
-            return redirect("welcome")
+        if form.is_valid() and form.cleaned_data.get("badge"):
+            try:
+                badge = form.cleaned_data["badge"]
+                # Managers clock anyone, the others only themselves
+                if (
+                    request.user.level != "Manager"
+                    and parse_badge(badge) != request.user.id
+                ):
+                    raise ValidationError("You can only clock your own badge.")
+                result = clock(badge)
+            except ValidationError as e:
+                messages.error(request, " ".join(e.messages))
+            else:
+                messages.success(request, clock_message(*result))
         else:
-            return redirect("welcome")
+            messages.info(request, "Scan your badge at the clock terminal.")
+        return redirect("welcome")
     else:
         form = ClockInOutForm()
 
     return render(request, "welcome.html", {"form": form})
 
 
+def clock_token_valid(request):
+    token = settings.CLOCK_API_TOKEN
+    header = request.headers.get("Authorization", "")
+    return bool(token) and hmac.compare_digest(header, f"Token {token}")
+
+
+@csrf_exempt
+def clock_view(request):
+    # Clock event of a scanned badge: {"badge": "<employee id>"}, sent by the
+    # scanner service with "Authorization: Token <CLOCK_API_TOKEN>".
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    if not clock_token_valid(request):
+        return JsonResponse({"error": "Invalid token."}, status=403)
+
+    try:
+        badge = json.loads(request.body).get("badge")
+        employee, working_hours, action = clock(badge)
+    except (ValueError, AttributeError):
+        return JsonResponse({"error": "Invalid JSON body."}, status=400)
+    except ValidationError as e:
+        return JsonResponse({"error": " ".join(e.messages)}, status=400)
+
+    return JsonResponse(
+        {
+            "employee": employee.username,
+            "action": action,
+            "at": working_hours.clock_out or working_hours.clock_in,
+            "message": clock_message(employee, working_hours, action),
+        }
+    )
+
+
+def cursor_params(params):
+    # ?after=<id of the last row already received>&page_size=<rows>, both optional
+    after = params.get("after")
+    page_size = params.get("page_size")
+    after = int(after) if after else None
+    page_size = int(page_size) if page_size else None
+    if page_size is not None and page_size <= 0:
+        raise ValueError("page_size must be positive")
+    return after, page_size
+
+
 def staff_member_list(request):
-    staff_members = UserProfile.objects.all()
-    data = [{"name": staff.username, "email": staff.email} for staff in staff_members]
-    return JsonResponse(data, safe=False)
+    # Streamed in id order; continue with ?after=<last id>. Kept sync: under
+    # WSGI, Django reads a whole async iterator into memory before sending it.
+    try:
+        after, page_size = cursor_params(request.GET)
+    except ValueError:
+        return JsonResponse({"error": "Invalid after or page_size."}, status=400)
+
+    staff_members = UserProfile.objects.order_by("id")
+    if after is not None:
+        staff_members = staff_members.filter(id__gt=after)
+    rows = staff_members.values_list("id", "username", "email")[:page_size]
+
+    return StreamingJsonResponse(
+        {"id": pk, "name": username, "email": email}
+        for pk, username, email in rows.iterator(chunk_size=CHUNK_SIZE)
+    )
 
 
+def badge_response(request, employee):
+    # The content hash of the badge is its ETag: a repeat download is a 304,
+    # without rendering or reading the badge
+    etag = f'"{badge_key(employee.username, employee.id)}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        badge = EmployeeBadge(employee_name=employee.username, employee_id=employee.id)
+        response = HttpResponse(badge.generate_badge(), content_type="image/png")
+        response[
+            "Content-Disposition"
+        ] = f'attachment; filename="{badge.badge_filename()}"'
+    response["ETag"] = etag
+    # Cached by the browser, but revalidated on every download
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
 def generate_employee_badge(request):
     employees = UserProfile.objects.all()
 
     if request.method == "POST":
-        employee_id = request.POST.get("employee_id")
-        selected_employee = UserProfile.objects.get(id=employee_id)
+        # Same badge, and same access rules, as employee_badge
+        try:
+            employee_id = int(request.POST.get("employee_id", ""))
+        except ValueError:
+            raise Http404("Unknown employee.")
+        return employee_badge(request, employee_id)
 
-        # Generate the badge for the selected employee
-        badge = EmployeeBadge(
-            employee_name=selected_employee.username, employee_id=selected_employee.id
-        )
-        file_name = badge.generate_badge()
+    return render(request, "api/employee_list.html", {"employees": employees})
 
-        if file_name:
-            with open(file_name, "rb") as badge_file:
-                response = HttpResponse(
-                    badge_file.read(), content_type="application/pdf"
-                )
-                response[
-                    "Content-Disposition"
-                ] = f'attachment; filename="{file_name.replace("api/badges/", "")}"'
-                os.remove(file_name)
-                return response
-        else:
-            return HttpResponse("Badge not generated.")
 
-    return render(request, "api/employee_list.html", {"employees": employees})
+@login_required
+def employee_badge(request, employee_id):
+    # Managers download every badge, the others only their own
+    if request.user.level != "Manager" and request.user.id != employee_id:
+        return HttpResponseForbidden("Forbidden")
+    employee = get_object_or_404(UserProfile.objects.only("username"), id=employee_id)
+    return badge_response(request, employee)
+
+
+BADGE_SHEET_FORMATS = ("pdf", "zip")
+
+
+@login_required
+def badge_sheet(request):
+    # Badges of the selected employees (employee_ids, none for all of them),
+    # as a printable PDF or a ZIP of PNGs
+    if request.user.level != "Manager":
+        return HttpResponseForbidden("Forbidden")
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required."}, status=405)
+
+    sheet_format = request.POST.get("format", "pdf")
+    if sheet_format not in BADGE_SHEET_FORMATS:
+        return JsonResponse({"error": "Unknown format."}, status=400)
+
+    employees = UserProfile.objects.order_by("username", "id")
+    employee_ids = request.POST.getlist("employee_ids")
+    if employee_ids:
+        try:
+            employees = employees.filter(id__in=[int(pk) for pk in employee_ids])
+        except ValueError:
+            return JsonResponse({"error": "Invalid employee id."}, status=400)
+    employees = list(employees.values_list("username", "id"))
+    if not employees:
+        return JsonResponse({"error": "No employees selected."}, status=400)
+
+    pngs = cached_badges(employees)
+    if sheet_format == "pdf":
+        response = HttpResponse(badge_sheets_pdf(pngs), content_type="application/pdf")
+        response["Content-Disposition"] = 'attachment; filename="badges.pdf"'
+        return response
+
+    response = StreamingHttpResponse(
+        badge_zip_stream(
+            (f"{pk}_{badge_filename(name)}", png)
+            for (name, pk), png in zip(employees, pngs)
+        ),
+        content_type="application/zip",
+    )
+    response["Content-Disposition"] = 'attachment; filename="badges.zip"'
+    return response
 
 
 def working_hours_list(request, staff_member_id):
-    working_hours = WorkingHours.objects.filter(employee_id=staff_member_id)
-    data = [
+    # Streamed in (clock_in, id) order; continue with ?after=<last id>
+    try:
+        after, page_size = cursor_params(request.GET)
+    except ValueError:
+        return JsonResponse({"error": "Invalid after or page_size."}, status=400)
+
+    ordering = ["clock_in", "id"]
+    working_hours = WorkingHours.objects.filter(employee_id=staff_member_id).order_by(
+        *ordering
+    )
+    if after is not None:
+        last = working_hours.filter(id=after).values_list(*ordering).first()
+        if last is None:
+            return JsonResponse({"error": "Invalid after."}, status=400)
+        working_hours = working_hours.filter(after_cursor(ordering, last))
+    rows = working_hours.values_list("id", "clock_in", "clock_out")[:page_size]
+
+    return StreamingJsonResponse(
         {
-            "clock_in": wh.clock_in,
-            "clock_out": wh.clock_out,
-            "recorded_time": wh.recorded_time(),
+            "id": pk,
+            "clock_in": clock_in,
+            "clock_out": clock_out,
+            "recorded_time": (
+                format_duration(clock_out - clock_in) if clock_out else None
+            ),
+            "seconds": (clock_out - clock_in).total_seconds() if clock_out else None,
         }
-        for wh in working_hours
-    ]
-    return JsonResponse(data, safe=False)
+        for pk, clock_in, clock_out in rows.iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+@login_required
+def working_hours_summary(request):
+    # Worked seconds per employee, in total and per day, week and month:
+    # ?start=2023-11-01&end=2023-11-30[&employee=<id>], both dates included.
+    # Only managers can see other employees.
+    start = parse_date(request.GET.get("start", ""))
+    end = parse_date(request.GET.get("end", ""))
+    if start is None or end is None or end < start:
+        return JsonResponse(
+            {"error": "Parameters 'start' and 'end' must be dates, start first."},
+            status=400,
+        )
+
+    employee_id = request.GET.get("employee")
+    if request.user.level != "Manager":
+        employee_id = request.user.pk
+    elif employee_id:
+        try:
+            employee_id = int(employee_id)
+        except ValueError:
+            return JsonResponse({"error": "Invalid employee."}, status=400)
+    else:
+        employee_id = None
+
+    start = timezone.make_aware(datetime.combine(start, datetime.min.time()))
+    end = timezone.make_aware(
+        datetime.combine(end + timezone.timedelta(days=1), datetime.min.time())
+    )
+
+    summary = {
+        "start": start,
+        "end": end,
+        "total": worked_time(start, end, employee_id),
+    }
+    for period in PERIODS:
+        summary[period] = worked_time(start, end, employee_id, period)
+    return JsonResponse(summary)
+
+
+@login_required
+def cache_stats_view(request):
+    # Hit and miss counters of the cached derived data, in this process
+    if request.user.level != "Manager":
+        return HttpResponseForbidden("Forbidden")
+    return JsonResponse(cache_stats())
+
+
+async def events_view(request):
+    # Server-Sent Events of the stock and inventory changes. Only under the
+    # ASGI application: under WSGI the endless stream would hold a worker.
+    if not live_updates(request):
+        raise Http404("Live updates need the ASGI application.")
+    user = await load_user(request)
+    if not user.is_authenticated:
+        return HttpResponseForbidden("Forbidden")
+    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Not buffered by nginx
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,57 @@
+from django.db.models import DateField, DurationField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+
+from .models import WorkingHours
+
+
+# Worked time summed by the database.
+#
+# Only closed shifts (with a clock_out) count, each one entirely in the day,
+# week and month of its clock_in. Days, weeks and months are those of the
+# current timezone; weeks start on Monday.
+
+PERIODS = {
+    "day": TruncDate,
+    "week": TruncWeek,
+    "month": TruncMonth,
+}
+
+WORKED = ExpressionWrapper(F("clock_out") - F("clock_in"), output_field=DurationField())
+
+
+def closed_shifts(start, end, employee_id=None):
+    shifts = WorkingHours.objects.filter(
+        clock_in__gte=start, clock_in__lt=end, clock_out__isnull=False
+    )
+    if employee_id is not None:
+        shifts = shifts.filter(employee_id=employee_id)
+    return shifts
+
+
+def seconds(duration):
+    return duration.total_seconds() if duration is not None else 0
+
+
+def worked_time(start, end, employee_id=None, period=None):
+    """
+    Worked seconds per employee between start (included) and end (excluded),
+    in one query, as [{"employee", "seconds"}] or, with period "day", "week" or
+    "month", as [{"employee", "period", "seconds"}], by employee and period.
+    """
+    shifts = closed_shifts(start, end, employee_id).order_by()
+    group_by = ["employee"]
+    if period is not None:
+        shifts = shifts.annotate(
+            period=PERIODS[period]("clock_in", output_field=DateField())
+        )
+        group_by.append("period")
+
+    rows = shifts.values(*group_by).annotate(worked=Sum(WORKED)).order_by(*group_by)
+    summary = []
+    for row in rows:
+        line = {"employee": row["employee"]}
+        if period is not None:
+            line["period"] = row["period"]
+        line["seconds"] = seconds(row["worked"])
+        summary.append(line)
+    return summary
@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+
+The live stock and inventory updates (api/events/, Server-Sent Events) hold
+one connection per open page, so serve the application with an ASGI server,
+e.g. uvicorn gastromanager.asgi:application.
 """
 
 import os
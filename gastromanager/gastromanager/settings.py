@@ -17,9 +17,6 @@ from dotenv import load_dotenv
 # Set the DJANGO_SETTINGS_MODULE environment variable
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "gastromanager.settings")
 
-# For Django 3.0 or higher, enable async mode to resolve the issue
-os.environ["DJANGO_ALLOW_ASYNC_UNSAFE"] = "true"
-
 load_dotenv()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -49,6 +46,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "api",
 ]
 
@@ -154,3 +152,67 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Journal of @register_activity, written in batches by a background thread
+# (api/journal.py). With JOURNAL_ASYNC = False every entry is written at once.
+
+JOURNAL_ASYNC = True
+JOURNAL_BATCH_SIZE = 100
+JOURNAL_FLUSH_INTERVAL = 200  # milliseconds
+JOURNAL_QUEUE_SIZE = 10000
+
+# Monthly journal partitions (api/partitions.py, command journal_partitions):
+# partitions older than JOURNAL_RETENTION_MONTHS are archived to gzipped CSV
+# files in JOURNAL_ARCHIVE_DIR and dropped. 0 keeps everything.
+
+JOURNAL_RETENTION_MONTHS = 24
+JOURNAL_ARCHIVE_DIR = BASE_DIR / "journal_archive"
+
+# Token of the clock endpoint (api/clock/) used by the badge scanner service
+# (management command run_qr_scanner). The endpoint is disabled without it.
+
+CLOCK_API_TOKEN = os.getenv("CLOCK_API_TOKEN")
+
+# A badge scanned again within this many seconds (on any terminal) is not booked
+CLOCK_DOUBLE_SCAN_SECONDS = 30
+
+# Caches. Derived data (api/caching.py) goes to the default cache, which must be
+# shared by every process: "file" (the processes of one machine) or "redis"
+# (every machine, at CACHE_REDIS_URL). The local memory of each process
+# ("locmem") is only accepted with DEBUG, for the development server.
+# Rendered employee badges (api/badges.py) are kept on disk, shared by every
+# worker process and the badge rendering pool; they are keyed by a hash of
+# their content, so the oldest entries are simply culled past MAX_ENTRIES.
+
+CACHE_BACKENDS = {
+    "locmem": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "OPTIONS": {"MAX_ENTRIES": 1000},
+    },
+    "file": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "cache",
+    },
+    "redis": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.getenv("CACHE_REDIS_URL", "redis://127.0.0.1:6379"),
+    },
+}
+
+CACHES = {
+    "default": CACHE_BACKENDS[os.getenv("CACHE_BACKEND", "locmem")],
+    "badges": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "badge_cache",
+        "TIMEOUT": 60 * 60 * 24 * 30,
+        "OPTIONS": {"MAX_ENTRIES": 2000},
+    },
+}
+
+# Live stock and inventory updates (api/events.py, only offered when served by
+# the ASGI application): "local" broadcasts to the clients of the process that
+# booked the change, "postgresql" to the clients of every process, through
+# LISTEN/NOTIFY.
+
+EVENTS_BROKER = os.getenv("EVENTS_BROKER", "local")